@@ -1,23 +1,35 @@
 from random import randint
+from multiprocessing.pool import ThreadPool
 from Modules import Gimps
+from Modules.Transport import DatagramConnection, ServerConnection
+from Modules.Metrics import Histogram, MetricsRegistry, start_metrics_server, write_metrics_file
+from Modules import Protocol
+from Modules import SaveFile
+from Modules.Watcher import create_watcher
+from Modules.Scheduler import AssignmentScheduler
+from Modules.Scanner import DirectoryScanner
 import json
-import logging
 import os
-import glob
+import logging
 import time
-import socket
 import signal
 import sys
-import platform
 
 
 class Config:
     name = ''
-    workers = 0
-    data_directory = ''
-    data_update_interval = 0
+    instances = []
+    watch_mode = ''
+    read_threads = 0
     server_ip = ''
     server_port = 0
+    server_protocol = ''
+    server_transport = ''
+    metrics_enabled = False
+    metrics_host = ''
+    metrics_port = 0
+    metrics_json_file = ''
+    metrics_json_interval = 0.0
 
     def __init__(self):
         with open('client.config.json', 'r') as fp:
@@ -25,12 +37,64 @@ class Config:
             fp.close()
 
         self.name = obj['client']['name']
-        self.workers = int(obj['client']['workers'])
-        self.data_directory = obj['client']['data_directory']
-        self.data_update_interval = int(obj['client']['data_update_interval'])
+        self.watch_mode = obj['client'].get('watch_mode', 'auto')
+        self.read_threads = int(obj['client'].get('read_threads', 4))
+
+        # Older config files describe a single prime95 instance directly in the client section.
+        if 'instances' in obj['client']:
+            instance_configs = obj['client']['instances']
+        else:
+            instance_configs = [obj['client']]
+
+        self.instances = []
+        for instance_config in instance_configs:
+            self.instances.append({
+                'name_suffix': instance_config.get('name_suffix', ''),
+                'workers': int(instance_config['workers']),
+                'data_directory': instance_config['data_directory'],
+                'data_update_interval': int(instance_config['data_update_interval'])
+            })
 
         self.server_ip = obj['server']['ip']
         self.server_port = int(obj['server']['port'])
+        self.server_protocol = obj['server'].get('protocol', 'binary')
+        self.server_transport = obj['server'].get('transport', 'tcp')
+
+        metrics = obj.get('metrics', {})
+        self.metrics_enabled = bool(metrics.get('enabled', False))
+        self.metrics_host = metrics.get('host', '127.0.0.1')
+        self.metrics_port = int(metrics.get('port', 1171))
+        self.metrics_json_file = metrics.get('json_file', '')
+        self.metrics_json_interval = float(metrics.get('json_interval', 60))
+
+
+class Instance:
+    '''
+    A prime95 instance being monitored. Each instance reports to the server as its own client, named after this
+    machine plus the instance's name suffix.
+    '''
+    index = 0
+    name = ''
+    workers = 0
+    data_directory = ''
+    data_update_interval = 0
+    scanner = None
+    assignments = {}
+
+    def __init__(self, index, client_name, instance_config):
+        self.index = index
+        self.name = client_name + instance_config['name_suffix']
+        self.workers = instance_config['workers']
+        self.data_directory = instance_config['data_directory']
+        self.data_update_interval = instance_config['data_update_interval']
+        self.scanner = DirectoryScanner(self.data_directory)
+        self.assignments = {}
+
+    def get_locate_job(self):
+        return self.index, LOCATE_JOB
+
+    def get_assignment_job(self, file_path):
+        return self.index, file_path
 
 
 # Catch SIGINT
@@ -42,292 +106,410 @@ def signal_handler(sig, frame):
 # Listen on Signal Events
 signal.signal(signal.SIGINT, signal_handler)
 
+# Errors that mean an assignment file is gone, or isn't a readable save file.
+ASSIGNMENT_FILE_ERRORS = (IOError, OSError)
+
+# Scheduler jobs are (instance index, file path) pairs. This takes the place of the file path for the job that looks
+# for new assignment files.
+LOCATE_JOB = "LOCATE"
+
 # Global Variables
-ASSIGNMENTS = []
-TIME_TO_WAIT = 0
-ASSIGNMENT_TO_CHECK = 0
-DIRECTIVE = "INSTANTIATE"  # VALID VALUES: INSTANTIATE, LOCATE, MONITOR
 CONFIG = Config()
+INSTANCES = [Instance(i, CONFIG.name, CONFIG.instances[i]) for i in range(0, len(CONFIG.instances))]
+INSTANCES_BY_DIRECTORY = dict((instance.data_directory, instance) for instance in INSTANCES)
+if CONFIG.server_transport == 'udp':
+    SERVER_CONNECTION = DatagramConnection(CONFIG.server_ip, CONFIG.server_port)
+else:
+    SERVER_CONNECTION = ServerConnection(CONFIG.server_ip, CONFIG.server_port)
+WATCHER = create_watcher([instance.data_directory for instance in INSTANCES], CONFIG.watch_mode)
+SCHEDULER = AssignmentScheduler()
+READ_POOL = ThreadPool(max(1, CONFIG.read_threads))
+READ_LATENCY = Histogram()
+METRICS = MetricsRegistry()
+SENT_UPDATES = METRICS.add_counter('updates_sent_total', 'Assignment updates sent to the server.')
 
 # Logging Parameters
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.debug("Watching for assignment file changes with " + WATCHER.__class__.__name__ + ".")
+
+'''
+File access happens on the READ_POOL threads, so a slow (for example network mounted) directory doesn't hold up the
+others. The functions that run there only touch the files and the assignment objects they were given. Everything else,
+such as the scheduler and each instance's assignment dictionary, is only updated from the main thread once the reads
+have finished.
+'''
+
+
+def read_assignment_file(instance, assignment, stat_result=None):
+    # Runs on the read pool. Returns (changed, stat_result), or (None, None) if the file is gone.
+    changed = True
+
+    try:
+        # Only open the file if its stat shows it has been written since we last read it.
+        if stat_result is None:
+            changed, stat_result = instance.scanner.check_file(assignment.file_path)
+
+        if changed:
+            # Read the assignment file from disk, and update values.
+            assignment.read_file()
+    except SaveFile.IncompleteSaveFileError:
+        # prime95 is still writing the file, so treat it as unchanged and try again later.
+        return False, stat_result
+    except ASSIGNMENT_FILE_ERRORS:
+        return None, None
+
+    return changed, stat_result
+
+
+def open_assignment_files(scanned_files):
+    '''
+    Runs on the read pool. Takes (file_path, stat_result) pairs, each stat taken before the file is read. Returns an
+    (assignment, stat_result) pair for each file that is a readable save file, and the (file_path, stat_result) pairs
+    of the files that aren't, which are rejected until they change.
+    '''
+    assignments = []
+    rejected_files = []
+    stat_results = dict(scanned_files)
+
+    for file_path, header, error in SaveFile.read_headers([file_path for file_path, _ in scanned_files]):
+        if error is None:
+            assignments.append((Gimps.AssignmentFile(file_path, header), header.stat_result))
+        elif not isinstance(error, SaveFile.IncompleteSaveFileError):
+            logging.error("Unable to read assignment file " + file_path + ": " + str(error))
+            rejected_files.append((file_path, stat_results[file_path]))
+
+    return assignments, rejected_files
 
 
-def locate_new_assignment_files():
-    # Change directory to the directory specified in the config.
-    os.chdir(CONFIG.data_directory)
+def open_new_assignment_file(instance, file_path):
+    # Runs on the read pool. Opens a file the watcher reported, unless it was already rejected and hasn't changed.
+    try:
+        stat_result = os.stat(file_path)
+    except OSError:
+        return [], []
 
-    # Loop through each file in the data directory.
-    for directory_file in glob.glob("p*"):
+    if instance.scanner.is_rejected(file_path, stat_result):
+        return [], []
 
-        # Determine which divider we're using.
-        divider = "\\"
+    return open_assignment_files([(file_path, stat_result)])
 
-        if platform.system() == "Linux":
-            divider = "/"
 
-        # Generate the full path of the file.
-        full_directory_file_path = CONFIG.data_directory + divider + directory_file
+def scan_instance(instance):
+    # Runs on the read pool. Scans the data directory, only opening files that are new or have changed.
+    try:
+        new_files, changed_files, removed_files = instance.scanner.scan()
+    except OSError as e:
+        logging.error("Unable to scan " + instance.data_directory + ": " + str(e))
+        return [], [], [], []
 
-        # Verify the file doesn't have a dot (.) and that the file isn't already being monitored.
-        if '.' not in directory_file and not any(assignment_file.file_path == full_directory_file_path
-                                                 for assignment_file in ASSIGNMENTS):
+    new_assignments, rejected_files = open_assignment_files(new_files)
 
-            # Create a new assignment and add it to the ASSIGNMENTS list.
-            try:
-                ASSIGNMENTS.append(Gimps.AssignmentFile(full_directory_file_path))
-            except:
-                logging.error("Attempted to add assignment file to list that doesn't exist. File: " +
-                              full_directory_file_path)
+    changed_assignments = []
+    for file_path, stat_result in changed_files:
+        assignment = instance.assignments[file_path]
+        changed_assignments.append((assignment, read_assignment_file(instance, assignment, stat_result)))
 
+    removed_assignments = [instance.assignments[file_path] for file_path in removed_files]
 
-def calculate_time_to_wait():
-    # Specify Global Variables
-    global TIME_TO_WAIT
-    global ASSIGNMENT_TO_CHECK
+    return new_assignments, changed_assignments, removed_assignments, rejected_files
 
-    # Create containers.
-    oldest_assignment_last_modified_time = int(time.time() + 86400)
-    oldest_assignment_index = 0
 
-    # Identify the oldest assignment. The oldest assignment should be the next assignment the program checks.
-    for i in range(0, len(ASSIGNMENTS)):
-        if ASSIGNMENTS[i].last_modified < oldest_assignment_last_modified_time:
-            oldest_assignment_last_modified_time = ASSIGNMENTS[i].last_modified
-            oldest_assignment_index = i
+def run_read_job(read_job):
+    # Runs on the read pool. Does the file access for one job.
+    job_type, instance, argument = read_job
+    read_start = time.time()
 
-    # Set the global ASSIGNMENT_TO_CHECK variable.
-    ASSIGNMENT_TO_CHECK = oldest_assignment_index
+    if job_type == 'locate':
+        result = scan_instance(instance)
+    elif job_type == 'check':
+        result = read_assignment_file(instance, argument)
+    else:
+        result = open_new_assignment_file(instance, argument)
 
-    # Calculate how old the oldest assignment is in seconds.
-    oldest_assignment_age = int(time.time() - oldest_assignment_last_modified_time)
+    READ_LATENCY.observe(time.time() - read_start)
+    return result
 
+
+def schedule_assignment_check(instance, assignment):
     '''
-    If the oldest assignment is older than the update interval, and the last time we updated it there was a difference
-    between the iterations, then set TIME_TO_WAIT to 1. If the oldest assignment is older than the update interval, but
-    last time we updated the iterations were the same, then set TIME_TO_WAIT to the data_update interval. Otherwise,
-    determine how much time is left before we need to update the oldest assignment, and set TIME_TO_WAIT to that value
-    plus a random number between 1 and 5.
+    prime95 writes the save file once every update interval, so check it again shortly after the next write is due. If
+    that time has already passed, the file is overdue and we only just read it, so back off instead.
     '''
-    if oldest_assignment_age > CONFIG.data_update_interval \
-            and (ASSIGNMENTS[oldest_assignment_index].previous_iterations
-                 != ASSIGNMENTS[oldest_assignment_index].iterations):
-        TIME_TO_WAIT = 1
-        logging.debug("calculate_time_to_wait()| Assignment is older than update interval, and not duplicate.")
-    elif oldest_assignment_age > Config.data_update_interval \
-            and (ASSIGNMENTS[oldest_assignment_index].previous_iterations
-                 == ASSIGNMENTS[oldest_assignment_index].iterations):
-        TIME_TO_WAIT = CONFIG.data_update_interval
-        logging.debug("calculate_time_to_wait()| Assignment is older than update interval, and duplicate.")
+    job = instance.get_assignment_job(assignment.file_path)
+    next_save_time = assignment.last_modified + instance.data_update_interval + randint(1, 5)
+
+    if next_save_time > time.time():
+        SCHEDULER.schedule(job, next_save_time)
     else:
-        TIME_TO_WAIT = CONFIG.data_update_interval - oldest_assignment_age + randint(1, 5)
-        logging.debug("calculate_time_to_wait()| Assignment is not older than update interval")
+        SCHEDULER.defer(job, instance.data_update_interval)
 
 
-def do_server_communication(exponent, iterations):
-    # Create Server Message
-    """
-    Message Format
-    CLIENT_NAME|CLIENT_WORKERS|UPDATE_INTERVAL|ASSIGNMENT_EXPONENT|ASSIGNMENT_ITERATIONS
-    """
-    server_message = CONFIG.name + "|" + str(CONFIG.workers) + "|" + str(CONFIG.data_update_interval) + "|" + str(
-        exponent) + "|" + str(iterations)
+def start_monitoring_assignment(instance, assignment, stat_result, updates):
+    instance.assignments[assignment.file_path] = assignment
+    instance.scanner.remember(assignment.file_path, stat_result)
 
-    # Create Socket Connection
-    socket_connection = socket.socket()
+    updates.append((assignment.exponent, assignment.iterations))
+    schedule_assignment_check(instance, assignment)
+    logging.debug("Started monitoring " + assignment.file_path + ".")
 
-    try:
-        # Connect to Server
-        socket_connection.connect((CONFIG.server_ip, CONFIG.server_port))
-        logging.debug("do_server_communication()| Connected to " + str(CONFIG.server_ip) + ":"
-                      + str(CONFIG.server_port) + ".")
 
-        # Send Message to Server
-        socket_connection.send(server_message)
-        logging.debug("do_server_communication()| Client to Server Message: " + server_message)
+def stop_monitoring_assignment(instance, assignment, updates):
+    # Notify server that the assignment is gone, and look for the one that replaced it.
+    updates.append((assignment.exponent, -1))
+    del instance.assignments[assignment.file_path]
+    instance.scanner.forget(assignment.file_path)
+    SCHEDULER.forget(instance.get_assignment_job(assignment.file_path))
+    SCHEDULER.schedule_no_later_than(instance.get_locate_job(), 0)
+    logging.debug("Stopped monitoring " + assignment.file_path + ".")
 
-        # Disconnect from Server
-        socket_connection.close()
-        logging.debug("do_server_communication()| Disconnected from " + str(CONFIG.server_ip) + ":"
-                      + str(CONFIG.server_port) + ".")
-    except:
-        # Unable to connect to server, so let's log this.
-        logging.error("do_server_communication()| Unable to connect to " + str(CONFIG.server_ip) + ":"
-                      + str(CONFIG.server_port) + ".")
 
+def finish_assignment_check(instance, assignment, changed, stat_result, updates):
+    if changed is None:
+        stop_monitoring_assignment(instance, assignment, updates)
+        return
 
-while True:
-    logging.debug("Sleeping for " + str(TIME_TO_WAIT) + " seconds.")
-    time.sleep(TIME_TO_WAIT)
+    if changed:
+        instance.scanner.remember(assignment.file_path, stat_result)
 
-    if DIRECTIVE == "INSTANTIATE":
-        logging.debug("DIRECTIVE is INSTANTIATE.")
+    updates.append((assignment.exponent, assignment.iterations))
+    job = instance.get_assignment_job(assignment.file_path)
 
-        # Identify and read all data files.
-        locate_new_assignment_files()
-        logging.debug("Located all new assignment files.")
+    if changed and assignment.previous_iterations != assignment.iterations:
+        # The file was saved again, so expect the next save one update interval after it.
+        SCHEDULER.reset_backoff(job)
+        schedule_assignment_check(instance, assignment)
+        logging.debug("Assignment " + str(assignment.exponent) + " progressed to " + str(assignment.iterations) + ".")
+    else:
+        # The file hasn't been saved yet, so back off before checking it again.
+        SCHEDULER.defer(job, instance.data_update_interval)
+        logging.debug("Assignment " + str(assignment.exponent) + " is unchanged, checking again in " +
+                      str(int(SCHEDULER.get_due_time(job) - time.time())) + " seconds.")
 
-        # Send all data file information to the server.
-        for assignment in ASSIGNMENTS:
-            do_server_communication(assignment.exponent, assignment.iterations)
-        logging.debug("Notified server of all data files.")
 
-        # Determine how long the program should sleep.
-        calculate_time_to_wait()
-        logging.debug("Set TIME_TO_WAIT to " + str(TIME_TO_WAIT) + ".")
+def reject_assignment_files(instance, rejected_files):
+    for file_path, stat_result in rejected_files:
+        if file_path not in instance.assignments:
+            instance.scanner.reject(file_path, stat_result)
 
-        # Set DIRECTIVE to MONITOR.
-        DIRECTIVE = "MONITOR"
-        logging.debug("Set DIRECTIVE to MONITOR.")
 
-        # Continue WHILE Loop, which will sleep the program for the specified amount of time in TIME_TO_WAIT.
-        logging.debug("Resetting Loop.")
-        continue
+def finish_locate(instance, scan_result, updates):
+    new_assignments, changed_assignments, removed_assignments, rejected_files = scan_result
+    reject_assignment_files(instance, rejected_files)
 
-    elif DIRECTIVE == "MONITOR":
-        logging.debug("DIRECTIVE is MONITOR.")
+    for assignment, stat_result in new_assignments:
+        if assignment.file_path not in instance.assignments:
+            start_monitoring_assignment(instance, assignment, stat_result, updates)
 
-        try:
-            # Read the assignment file from disk, and update values.
-            ASSIGNMENTS[ASSIGNMENT_TO_CHECK].read_file()
-            logging.debug("Updated assignment " + str(ASSIGNMENT_TO_CHECK) + "'s data.")
+    for assignment, (changed, stat_result) in changed_assignments:
+        if assignment.file_path in instance.assignments:
+            finish_assignment_check(instance, assignment, changed, stat_result, updates)
+
+    for assignment in removed_assignments:
+        if assignment.file_path in instance.assignments:
+            stop_monitoring_assignment(instance, assignment, updates)
+
+    logging.debug("Located all new assignment files in " + instance.data_directory + ".")
+
+    # Keep looking once a minute while we know of fewer assignments than this instance has workers.
+    if len(instance.assignments) < instance.workers:
+        SCHEDULER.schedule_no_later_than(instance.get_locate_job(), 60)
 
-            # Notify server of changes.
-            do_server_communication(ASSIGNMENTS[ASSIGNMENT_TO_CHECK].exponent,
-                                    ASSIGNMENTS[ASSIGNMENT_TO_CHECK].iterations)
 
-            # Determine how long the program should sleep.
-            calculate_time_to_wait()
-            logging.debug("Set TIME_TO_WAIT to " + str(TIME_TO_WAIT) + ".")
+def get_changed_file_jobs(changed_files):
+    # Turn the (directory, file_name) pairs reported by the watcher into read jobs.
+    read_jobs = []
 
-            # Continue WHILE Loop, which will sleep the program for the specified amount of time in TIME_TO_WAIT.
-            logging.debug("Resetting Loop.")
+    for directory, directory_file in changed_files:
+        instance = INSTANCES_BY_DIRECTORY.get(directory)
+        if instance is None:
             continue
 
-        except:
-            # Notify server of changes.
-            do_server_communication(ASSIGNMENTS[ASSIGNMENT_TO_CHECK].exponent, -1)
+        # The watcher lost track of events, so rescan the directory. That re-reads every file we know about that has
+        # changed, and looks for new ones.
+        if directory_file == '':
+            read_jobs.append(('locate', instance, None))
+            continue
 
-            # Remove assignment file from list.
-            ASSIGNMENTS.pop(ASSIGNMENT_TO_CHECK)
-            logging.debug("Removed assignment " + str(ASSIGNMENT_TO_CHECK) + " from list.")
+        file_path = instance.scanner.get_path(directory_file)
+        assignment = instance.assignments.get(file_path)
 
-            # Identify and read all assignment files.
-            locate_new_assignment_files()
-            logging.debug("Located all new assignment files.")
+        if assignment is not None:
+            # An assignment we know about was saved or removed.
+            read_jobs.append(('check', instance, assignment))
+        else:
+            # A new assignment has started.
+            read_jobs.append(('new', instance, file_path))
 
-            # If the list is empty...
-            if len(ASSIGNMENTS) == 0:
-                logging.debug("List is empty.")
+    return read_jobs
 
-                # Set DIRECTIVE to LOCATE.
-                DIRECTIVE = "LOCATE"
-                logging.debug("Set DIRECTIVE to LOCATE.")
 
-                # Set TIME_TO_WAIT to 60.
-                TIME_TO_WAIT = 60
-                logging.debug("Set TIME_TO_WAIT to " + str(TIME_TO_WAIT) + ".")
+def get_due_jobs():
+    # Turn the scheduler jobs that have come due into read jobs.
+    read_jobs = []
 
-                # Continue WHILE Loop, which will sleep the program for the specified amount of time in TIME_TO_WAIT.
-                logging.debug("Resetting Loop.")
-                continue
+    for instance_index, file_path in SCHEDULER.pop_due():
+        instance = INSTANCES[instance_index]
 
-            else:
-                logging.debug("List is not empty.")
+        if file_path == LOCATE_JOB:
+            read_jobs.append(('locate', instance, None))
+        elif file_path in instance.assignments:
+            read_jobs.append(('check', instance, instance.assignments[file_path]))
 
-                # Determine how long the program should sleep.
-                calculate_time_to_wait()
+    return read_jobs
 
-                # Verify that the client is aware of the correct number of assignments.
-                if len(ASSIGNMENTS) < CONFIG.workers:
-                    logging.debug("List contains fewer assignments than workers for this client.")
 
-                    # Wait a maximum of 60 seconds before checking for the new assignments.
-                    if TIME_TO_WAIT > 60:
-                        TIME_TO_WAIT = 60
-                    logging.debug("Set TIME_TO_WAIT to " + str(TIME_TO_WAIT) + ".")
+def run_read_jobs(read_jobs):
+    # Do the file access for every job on the read pool, then apply the results here on the main thread.
+    updates = dict((instance.index, []) for instance in INSTANCES)
 
-                    # Set DIRECTIVE to LOCATE.
-                    DIRECTIVE = "LOCATE"
-                    logging.debug("Set DIRECTIVE to LOCATE.")
+    # A file can be reported by the watcher and come due at the same time, so make sure it is only read once. A locate
+    # job re-reads every known file of its instance that has changed, so checks for that instance are held back rather
+    # than reading the same files alongside it.
+    locating_instances = set(instance.index for job_type, instance, _ in read_jobs if job_type == 'locate')
+    unique_read_jobs = []
+    held_checks = []
+    seen_read_jobs = set()
+    for job_type, instance, argument in read_jobs:
+        job_key = (job_type, instance.index, argument.file_path if job_type == 'check' else argument)
 
-                    # Continue WHILE Loop, which will sleep the program for the specified amount of time in
-                    # TIME_TO_WAIT.
-                    logging.debug("Resetting Loop.")
-                    continue
+        if job_key in seen_read_jobs:
+            continue
+        seen_read_jobs.add(job_key)
 
-                else:
-                    logging.debug("List contains the exact number of assignments per worker for this client.")
+        if job_type == 'check' and instance.index in locating_instances:
+            held_checks.append((instance, argument))
+        else:
+            unique_read_jobs.append((job_type, instance, argument))
+    read_jobs = unique_read_jobs
 
-                    logging.debug("Set TIME_TO_WAIT to " + str(TIME_TO_WAIT) + ".")
+    if len(read_jobs) == 0:
+        return updates
 
-                    # Continue WHILE Loop, which will sleep the program for the specified amount of time in
-                    # TIME_TO_WAIT.
-                    logging.debug("Resetting Loop.")
-                    continue
+    # Waiting on the async result (rather than using map) keeps the main thread responsive to SIGINT.
+    results = READ_POOL.map_async(run_read_job, read_jobs).get(86400)
 
-    elif DIRECTIVE == "LOCATE":
-        logging.debug("DIRECTIVE is LOCATE.")
+    located_files = set()
 
-        # If the list is empty...
-        if len(ASSIGNMENTS) == 0:
-            logging.debug("List is empty.")
+    for (job_type, instance, argument), result in zip(read_jobs, results):
+        instance_updates = updates[instance.index]
 
-            # Identify and read all assignment files.
-            locate_new_assignment_files()
-            logging.debug("Located all new assignment files.")
+        if job_type == 'locate':
+            located_files.update((instance.index, assignment.file_path) for assignment, _ in result[1])
+            located_files.update((instance.index, assignment.file_path) for assignment in result[2])
+            finish_locate(instance, result, instance_updates)
+        elif job_type == 'check':
+            if argument.file_path in instance.assignments:
+                finish_assignment_check(instance, argument, result[0], result[1], instance_updates)
+        else:
+            new_assignments, rejected_files = result
+            reject_assignment_files(instance, rejected_files)
 
-            # If the list is still empty...
-            if len(ASSIGNMENTS) == 0:
-                logging.debug("List is still empty.")
+            for assignment, stat_result in new_assignments:
+                if assignment.file_path not in instance.assignments:
+                    start_monitoring_assignment(instance, assignment, stat_result, instance_updates)
 
-                # Set TIME_TO_WAIT to 60.
-                TIME_TO_WAIT = 60
-                logging.debug("Set TIME_TO_WAIT to " + str(TIME_TO_WAIT) + ".")
+    # A held check the locate didn't cover found its file unchanged. If it came due, it has to be scheduled again.
+    for instance, assignment in held_checks:
+        if ((instance.index, assignment.file_path) not in located_files and
+                instance.assignments.get(assignment.file_path) is assignment and
+                instance.get_assignment_job(assignment.file_path) not in SCHEDULER):
+            finish_assignment_check(instance, assignment, False, None, updates[instance.index])
 
-                # Continue WHILE Loop, which will sleep the program for the specified amount of time in TIME_TO_WAIT.
-                logging.debug("Resetting Loop.")
-                continue
-            else:
-                logging.debug("List is no longer empty.")
+    return updates
 
-                # Set TIME_TO_WAIT to 1.
-                TIME_TO_WAIT = 1
-                logging.debug("Set TIME_TO_WAIT to " + str(TIME_TO_WAIT) + ".")
 
-                # Continue WHILE Loop, which will sleep the program for the specified amount of time in TIME_TO_WAIT.
-                logging.debug("Resetting Loop.")
-                continue
-        else:
-            logging.debug("List is not empty.")
+def do_server_communication(updates):
+    # Create Server Message
+    """
+    Every pending assignment update, for every instance, is sent to the server in a single message. By default this is
+    a binary frame (see Modules/Protocol.py). Over UDP the frames are split into as few datagrams as will hold them.
+
+    The legacy text format is for older servers, which only read one CLIENT|WORKERS|INTERVAL|EXPONENT|ITERATIONS
+    message from each connection. Each update is sent on a connection of its own then, the same as older clients did.
+    """
+    clients = []
+    for instance in INSTANCES:
+        if len(updates[instance.index]) > 0:
+            clients.append((instance.name, instance.workers, instance.data_update_interval, updates[instance.index]))
+
+    if len(clients) == 0:
+        return
+
+    if CONFIG.server_transport == 'udp':
+        sent = SERVER_CONNECTION.send_clients(clients)
+    elif CONFIG.server_protocol == 'text':
+        sent = True
+        for client_name, workers, update_interval, assignments in clients:
+            for assignment in assignments:
+                server_message = Protocol.encode_text_message(client_name, workers, update_interval, [assignment])
+                sent = SERVER_CONNECTION.send_and_close(server_message) and sent
+    else:
+        # Send Message to Server over the persistent connection.
+        sent = SERVER_CONNECTION.send(Protocol.encode_frame(clients))
+
+    if sent:
+        SENT_UPDATES.inc(sum(len(client[3]) for client in clients))
+
+        for client in clients:
+            logging.debug("do_server_communication()| Sent " + str(len(client[3])) + " assignment update(s) for "
+                          + client[0] + " to server: " + str(client[3]))
+    else:
+        # Unable to connect to server, so let's log this.
+        logging.error("do_server_communication()| Unable to connect to " + str(CONFIG.server_ip) + ":"
+                      + str(CONFIG.server_port) + ".")
+
+
+def register_metrics():
+    METRICS.add_counter('messages_sent_total', 'Messages sent to the server.',
+                        lambda: SERVER_CONNECTION.messages_sent)
+    METRICS.add_counter('bytes_sent_total', 'Bytes sent to the server.', lambda: SERVER_CONNECTION.bytes_sent)
+    METRICS.add_counter('connect_failures_total', 'Failed attempts to connect to the server.',
+                        lambda: SERVER_CONNECTION.connect_failures)
+    METRICS.add_gauge('assignments', 'Assignment files being monitored.',
+                      lambda: sum(len(instance.assignments) for instance in INSTANCES))
+    METRICS.add_gauge('scheduled_jobs', 'Checks waiting in the scheduler.', lambda: len(SCHEDULER.entries))
+    METRICS.add_histogram('read_seconds', 'Time taken by each job on the read pool.', READ_LATENCY)
+    METRICS.add_histogram('scheduler_lateness_seconds', 'How long after their due time checks were started.',
+                          SCHEDULER.lateness)
+
 
-            # Identify and read all assignment files.
-            locate_new_assignment_files()
-            logging.debug("Located all new assignment files.")
+register_metrics()
 
-            # Determine how long the program should sleep.
-            calculate_time_to_wait()
-            logging.debug("Set TIME_TO_WAIT to " + str(TIME_TO_WAIT) + ".")
+if CONFIG.metrics_enabled:
+    start_metrics_server(METRICS, CONFIG.metrics_host, CONFIG.metrics_port)
 
-            if len(ASSIGNMENTS) < CONFIG.workers:
-                logging.debug("List contains fewer assignments than workers for this client.")
+next_metrics_write = time.time() + CONFIG.metrics_json_interval
 
-                # Wait a maximum of 60 seconds before checking for the new assignments.
-                if TIME_TO_WAIT > 60:
-                    TIME_TO_WAIT = 60
-                logging.debug("Set TIME_TO_WAIT to " + str(TIME_TO_WAIT) + ".")
+# Look for assignment files as soon as the program starts.
+for monitored_instance in INSTANCES:
+    SCHEDULER.schedule_in(monitored_instance.get_locate_job(), 0)
 
-                # Continue WHILE Loop, which will sleep the program for the specified amount of time in TIME_TO_WAIT.
-                logging.debug("Resetting Loop.")
-                continue
+while True:
+    time_to_wait = SCHEDULER.time_until_next()
+    if time_to_wait is None:
+        time_to_wait = 60
+
+    # Wake up in time to (optionally) dump the metrics to file.
+    if CONFIG.metrics_json_file != '':
+        time_to_wait = max(0, min(time_to_wait, next_metrics_write - time.time()))
+
+    logging.debug("Sleeping for " + str(time_to_wait) + " seconds.")
+    changed_assignment_files = WATCHER.wait(time_to_wait)
+    pending_read_jobs = []
 
-            else:
-                logging.debug("List contains the exact number of assignments per worker for this client.")
+    # Woken early by save files changing, so read them straight away.
+    if len(changed_assignment_files) > 0:
+        logging.debug("Assignment files changed: " + str(sorted(changed_assignment_files)))
+        pending_read_jobs.extend(get_changed_file_jobs(changed_assignment_files))
 
-                # Set DIRECTIVE to MONITOR.
-                DIRECTIVE = "MONITOR"
-                logging.debug("Set DIRECTIVE to MONITOR.")
+    # Run every job that has come due, then notify server of every change in a single batch.
+    pending_read_jobs.extend(get_due_jobs())
+    do_server_communication(run_read_jobs(pending_read_jobs))
 
-                # Continue WHILE Loop, which will sleep the program for the specified amount of time in TIME_TO_WAIT.
-                logging.debug("Resetting Loop.")
-                continue
+    if CONFIG.metrics_json_file != '' and time.time() >= next_metrics_write:
+        next_metrics_write = time.time() + CONFIG.metrics_json_interval
+
+        try:
+            write_metrics_file(METRICS, CONFIG.metrics_json_file)
+        except (IOError, OSError) as e:
+            logging.error("Unable to write metrics to " + CONFIG.metrics_json_file + ": " + str(e))
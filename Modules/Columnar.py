@@ -0,0 +1,721 @@
+'''
+Struct-of-arrays storage for the server's clients and assignments, for fleets too large to hold as Assignment objects.
+
+Each assignment is a slot in a set of typed columns (exponent, iterations, progress, dates, speed samples and so on),
+and client names are interned and referred to by id. Slots of removed assignments are reused. Assignments are handed
+out as AssignmentView objects, which are created on demand and read straight from the columns, so anything written
+for Gimps.Assignment (the table, the JSON pages, the subscription stream) works on either.
+
+ColumnarClientManager offers the same API as Gimps.ClientManager, and produces and accepts the same snapshot state.
+
+When NumPy is installed, the completion dates of a large batch of updates are worked out in one pass over the columns,
+which it reads and writes in place. Only IEEE division, addition and truncation are done there, so the dates are
+exactly the same as the scalar code gives.
+'''
+
+import bisect
+import heapq
+import math
+import time
+from array import array
+from Modules import Estimator
+from Modules.Gimps import SORT_KEYS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Below this many updated slots, a pass over every slot costs more than working them out one at a time.
+MINIMUM_VECTORIZED_BATCH = 64
+
+
+def get_column_array(column):
+    # A NumPy array sharing the column's memory, so nothing is copied either way.
+    return numpy.frombuffer(column, dtype=column.typecode)
+
+
+class AssignmentColumns:
+    client_names = []
+    client_ids_by_name = {}
+    client_ids = None
+    exponents = None
+    iterations = None
+    progress = None
+    last_updated = None
+    last_report_times = None
+    last_progress_times = None
+    update_intervals = None
+    estimated_completion_dates = None
+    sample_counts = None
+    sample_positions = None
+    sample_iteration_sums = None
+    sample_second_sums = None
+    versions = None
+    stale = None
+    sample_offsets = None
+    sample_pools = {}
+    free_sample_offsets = {}
+    sort_keys = []
+    free_slots = []
+
+    def __init__(self):
+        self.client_names = []
+        self.client_ids_by_name = {}
+        self.client_ids = array('l')
+        self.exponents = array('l')
+        self.iterations = array('l')
+        self.progress = array('d')
+        # Dates are kept as doubles, since a C long is only 32 bits on some platforms.
+        self.last_updated = array('d')
+        self.last_report_times = array('d')
+        self.last_progress_times = array('d')
+        self.update_intervals = array('l')
+        self.estimated_completion_dates = array('d')
+        self.sample_counts = array('l')
+        self.sample_positions = array('l')
+        self.sample_iteration_sums = array('d')
+        self.sample_second_sums = array('d')
+
+        # Versions aren't reset when a slot is reused, so a row cached for the slot's previous assignment is never
+        # mistaken for the new one's.
+        self.versions = array('l')
+        self.stale = array('b')
+
+        # The speed samples of every slot with the same window size share one array, as (iterations, seconds) pairs.
+        # A slot's offset into its pool is -1 until it gets its first sample.
+        self.sample_offsets = array('l')
+        self.sample_pools = {}
+        self.free_sample_offsets = {}
+        self.sort_keys = []
+        self.free_slots = []
+
+    def add_client_name(self, client_name):
+        # A client that was removed and comes back gets its old id.
+        client_id = self.client_ids_by_name.get(client_name)
+
+        if client_id is None:
+            client_id = self.client_ids_by_name[client_name] = len(self.client_names)
+
+            # intern() only takes byte strings. Names are only stored once here either way.
+            self.client_names.append(intern(client_name) if isinstance(client_name, str) else client_name)
+
+        return client_id
+
+    def allocate(self, client_id, exponent, update_interval):
+        if len(self.free_slots) > 0:
+            slot = self.free_slots.pop()
+        else:
+            slot = len(self.exponents)
+
+            for column in (self.client_ids, self.exponents, self.iterations, self.update_intervals, self.sample_counts,
+                           self.sample_positions, self.versions, self.stale):
+                column.append(0)
+            for column in (self.progress, self.last_updated, self.last_report_times, self.last_progress_times,
+                           self.estimated_completion_dates, self.sample_iteration_sums, self.sample_second_sums):
+                column.append(0.0)
+            self.sample_offsets.append(-1)
+            self.sort_keys.append(None)
+
+        self.client_ids[slot] = client_id
+        self.exponents[slot] = int(exponent)
+        self.iterations[slot] = 0
+        self.progress[slot] = 0.0
+        self.last_updated[slot] = 0.0
+        self.last_report_times[slot] = 0.0
+        self.last_progress_times[slot] = 0.0
+        self.update_intervals[slot] = int(update_interval)
+        self.estimated_completion_dates[slot] = 0.0
+        self.sample_counts[slot] = 0
+        self.sample_positions[slot] = 0
+        self.sample_iteration_sums[slot] = 0.0
+        self.sample_second_sums[slot] = 0.0
+        self.stale[slot] = 0
+
+        return slot
+
+    def free(self, slot):
+        offset = self.sample_offsets[slot]
+        if offset != -1:
+            self.free_sample_offsets[self.get_window_size(slot)].append(offset)
+            self.sample_offsets[slot] = -1
+
+        self.sort_keys[slot] = None
+        self.free_slots.append(slot)
+
+    def get_window_size(self, slot):
+        return max(1, 21600 // self.update_intervals[slot])
+
+    def get_samples(self, slot):
+        # Returns a copy of the slot's sample window, as (iterations, seconds) pairs.
+        offset = self.sample_offsets[slot]
+        if offset == -1:
+            return array('d')
+
+        window_size = self.get_window_size(slot)
+        return self.sample_pools[window_size][offset:offset + 2 * window_size]
+
+    def add_sample(self, slot, iterations, seconds):
+        # The same ring buffer as Assignment.add_sample, kept in the slot's part of its pool.
+        window_size = self.get_window_size(slot)
+        samples = self.sample_pools.get(window_size)
+        if samples is None:
+            samples = self.sample_pools[window_size] = array('d')
+            self.free_sample_offsets[window_size] = []
+
+        offset = self.sample_offsets[slot]
+        if offset == -1:
+            if len(self.free_sample_offsets[window_size]) > 0:
+                offset = self.free_sample_offsets[window_size].pop()
+            else:
+                offset = len(samples)
+                samples.extend(array('d', [0.0]) * (2 * window_size))
+            self.sample_offsets[slot] = offset
+
+        position = self.sample_positions[slot]
+        index = offset + 2 * position
+
+        if self.sample_counts[slot] == window_size:
+            self.sample_iteration_sums[slot] -= samples[index]
+            self.sample_second_sums[slot] -= samples[index + 1]
+        else:
+            self.sample_counts[slot] += 1
+
+        samples[index] = iterations
+        samples[index + 1] = seconds
+        self.sample_iteration_sums[slot] += iterations
+        self.sample_second_sums[slot] += seconds
+        self.sample_positions[slot] = (position + 1) % window_size
+
+        # Re-sum each time the window wraps around. By then every pair in it has been written by this slot, even in a
+        # reused part of the pool.
+        if self.sample_positions[slot] == 0:
+            self.sample_iteration_sums[slot] = math.fsum(samples[offset:offset + 2 * window_size:2])
+            self.sample_second_sums[slot] = math.fsum(samples[offset + 1:offset + 2 * window_size:2])
+
+    def get_average_iterations_per_second(self, slot):
+        return Estimator.get_iterations_per_second(self.sample_iteration_sums[slot], self.sample_second_sums[slot])
+
+    def update_estimate(self, slot):
+        self.estimated_completion_dates[slot] = Estimator.get_estimated_completion_date(
+            self.exponents[slot] - self.iterations[slot], self.get_average_iterations_per_second(slot),
+            self.last_report_times[slot])
+        self.update_progress(slot)
+
+    def update_estimates_vectorized(self, slots):
+        '''
+        The same as calling update_estimate for each of the slots, with the completion dates of every slot worked out
+        at once with NumPy. Only those of the given slots are kept, so the rest keep theirs, such as the ones restored
+        from a snapshot.
+        '''
+        remaining_iterations = get_column_array(self.exponents) - get_column_array(self.iterations)
+        iteration_sums = get_column_array(self.sample_iteration_sums)
+        second_sums = get_column_array(self.sample_second_sums)
+
+        # Divide everywhere and then throw away the results for slots that don't have a speed yet.
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            iterations_per_second = numpy.where(second_sums > 0, iteration_sums / second_sums, 0.0)
+            estimated_completion_dates = numpy.trunc(get_column_array(self.last_report_times)
+                                                     + remaining_iterations / iterations_per_second)
+        estimated_completion_dates[iterations_per_second == 0] = 0.0
+
+        indices = numpy.fromiter(slots, dtype=numpy.intp, count=len(slots))
+        get_column_array(self.estimated_completion_dates)[indices] = estimated_completion_dates[indices]
+
+        # Python's round() rounds differently to NumPy's, so progress is still worked out one slot at a time.
+        for slot in slots:
+            self.update_progress(slot)
+
+    def update_progress(self, slot):
+        self.progress[slot] = round(100 * (self.iterations[slot] * 1.0) / (self.exponents[slot] * 1.0), 2)
+
+    def update_iterations(self, slot, new_iterations, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+
+        new_iterations = int(new_iterations)
+        iterations = self.iterations[slot]
+        last_progress_time = self.last_progress_times[slot]
+
+        if iterations > 0 and new_iterations > iterations and timestamp > last_progress_time:
+            self.add_sample(slot, new_iterations - iterations, timestamp - last_progress_time)
+
+        if new_iterations != iterations:
+            self.last_progress_times[slot] = timestamp
+
+        self.iterations[slot] = new_iterations
+        self.last_updated[slot] = int(timestamp)
+        self.last_report_times[slot] = timestamp
+        self.stale[slot] = 0
+        self.versions[slot] += 1
+
+    def get_state(self, slot):
+        samples = self.get_samples(slot)
+        sample_count = self.sample_counts[slot]
+
+        if sample_count == len(samples) // 2:
+            position = 2 * self.sample_positions[slot]
+            samples = samples[position:] + samples[:position]
+        else:
+            samples = samples[:2 * sample_count]
+
+        return (self.exponents[slot], self.iterations[slot], int(self.last_updated[slot]),
+                self.last_progress_times[slot], int(self.estimated_completion_dates[slot]), samples[0::2].tostring(),
+                samples[1::2].tostring(), self.stale[slot] != 0)
+
+    def set_state(self, slot, assignment_state):
+        (_, iterations, last_updated, last_progress_time, estimated_completion_date, sample_iterations,
+         sample_seconds, stale) = assignment_state
+
+        for sample in zip(array('d', sample_iterations), array('d', sample_seconds)):
+            self.add_sample(slot, *sample)
+
+        self.iterations[slot] = int(iterations)
+        self.last_updated[slot] = int(last_updated)
+        self.last_report_times[slot] = float(last_updated)
+        self.last_progress_times[slot] = float(last_progress_time)
+        self.estimated_completion_dates[slot] = int(estimated_completion_date)
+        self.stale[slot] = 1 if stale else 0
+        self.update_progress(slot)
+        self.versions[slot] += 1
+
+
+class AssignmentView(object):
+    '''
+    A read only view of one assignment slot, with the same attributes as Gimps.Assignment. Views of the same slot
+    compare equal, so they can key the row caches.
+    '''
+    __slots__ = ('columns', 'slot')
+
+    def __init__(self, columns, slot):
+        self.columns = columns
+        self.slot = slot
+
+    def __eq__(self, other):
+        return isinstance(other, AssignmentView) and self.slot == other.slot and self.columns is other.columns
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.slot)
+
+    @property
+    def client_name(self):
+        return self.columns.client_names[self.columns.client_ids[self.slot]]
+
+    @property
+    def exponent(self):
+        return self.columns.exponents[self.slot]
+
+    @property
+    def exponent_digit_length(self):
+        return int(round(self.columns.exponents[self.slot] * 0.301029995664))
+
+    @property
+    def iterations(self):
+        return self.columns.iterations[self.slot]
+
+    @property
+    def progress(self):
+        return self.columns.progress[self.slot]
+
+    @property
+    def last_updated(self):
+        return int(self.columns.last_updated[self.slot])
+
+    @property
+    def update_interval(self):
+        return self.columns.update_intervals[self.slot]
+
+    @property
+    def estimated_completion_date(self):
+        return int(self.columns.estimated_completion_dates[self.slot])
+
+    @property
+    def stale(self):
+        return self.columns.stale[self.slot] != 0
+
+    @property
+    def version(self):
+        return self.columns.versions[self.slot]
+
+    def get_average_iterations_per_second(self):
+        return self.columns.get_average_iterations_per_second(self.slot)
+
+    def get_state(self):
+        return self.columns.get_state(self.slot)
+
+
+class SortedSlotIndex:
+    '''
+    Keeps every slot in display order, the same way Gimps.SortedAssignmentIndex does for Assignment objects.
+    '''
+    columns = None
+    sort_by = ''
+    key_function = None
+    keys = []
+    slots = None
+    pending = None
+
+    def __init__(self, columns, sort_by='progress'):
+        if sort_by not in SORT_KEYS:
+            raise ValueError("Unknown sort key: " + str(sort_by))
+
+        self.columns = columns
+        self.sort_by = sort_by
+        self.key_function = SORT_KEYS[sort_by]
+        self.keys = []
+        self.slots = array('l')
+        self.pending = None
+
+    def __iter__(self):
+        columns = self.columns
+        return (AssignmentView(columns, slot) for slot in self.slots)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def get_key(self, slot):
+        return self.key_function(AssignmentView(self.columns, slot))
+
+    def insert(self, slot):
+        key = self.get_key(slot)
+        position = bisect.bisect_right(self.keys, key)
+
+        self.keys.insert(position, key)
+        self.slots.insert(position, slot)
+        self.columns.sort_keys[slot] = key
+
+    def remove(self, slot):
+        position = bisect.bisect_left(self.keys, self.columns.sort_keys[slot])
+
+        while self.slots[position] != slot:
+            position += 1
+
+        del self.keys[position]
+        del self.slots[position]
+        self.columns.sort_keys[slot] = None
+
+    def insert_many(self, slots):
+        entries = [(self.get_key(slot), slot) for slot in slots]
+        entries.extend(zip(self.keys, self.slots))
+        entries.sort(key=lambda entry: entry[0])
+
+        self.keys = [key for key, _ in entries]
+        self.slots = array('l', [slot for _, slot in entries])
+
+        for key, slot in entries:
+            self.columns.sort_keys[slot] = key
+
+    def update(self, slot):
+        if self.get_key(slot) == self.columns.sort_keys[slot]:
+            return
+
+        self.remove(slot)
+        self.insert(slot)
+
+    def rebuild(self):
+        slots = self.slots
+        self.keys = []
+        self.slots = array('l')
+        self.insert_many(slots)
+
+    def update_iterations(self, slot, new_iterations, timestamp=None):
+        self.columns.update_iterations(slot, new_iterations, timestamp)
+
+        if self.pending is not None:
+            self.pending.add(slot)
+        else:
+            self.columns.update_estimate(slot)
+            self.update(slot)
+
+    def begin_batch(self):
+        if self.pending is None:
+            self.pending = set()
+
+    def finish_batch(self):
+        pending_slots = list(self.pending or ())
+        self.pending = None
+
+        if len(pending_slots) == 0:
+            return
+
+        columns = self.columns
+        if numpy is not None and len(pending_slots) >= MINIMUM_VECTORIZED_BATCH:
+            columns.update_estimates_vectorized(pending_slots)
+        else:
+            for slot in pending_slots:
+                columns.update_estimate(slot)
+
+        if len(pending_slots) > len(self.slots) // 4:
+            self.rebuild()
+            return
+
+        # Slots freed during the batch have no sort key, and aren't in the index any more.
+        for slot in pending_slots:
+            if columns.sort_keys[slot] is not None:
+                self.update(slot)
+
+
+class ColumnarClient(object):
+    __slots__ = ('name', 'client_id', 'number_of_workers', 'update_interval', 'via', 'slots', 'assignments_by_exponent',
+                 'sorted_index', 'expiry', 'update_order', 'slots_added')
+
+    def __init__(self, name, client_id, number_of_workers, update_interval, sorted_index, expiry=None):
+        self.name = name
+        self.client_id = client_id
+        self.update_attributes(number_of_workers, update_interval)
+        self.via = ''
+        self.slots = []
+        self.assignments_by_exponent = {}
+        self.sorted_index = sorted_index
+        self.expiry = expiry
+
+        # Heap of (last_updated, insertion order, exponent, slot), the same as Gimps.Client.update_order.
+        self.update_order = []
+        self.slots_added = 0
+
+    @property
+    def assignments(self):
+        columns = self.sorted_index.columns
+        return [AssignmentView(columns, slot) for slot in self.slots]
+
+    def update_attributes(self, number_of_workers, update_interval):
+        self.number_of_workers = int(number_of_workers)
+        self.update_interval = int(update_interval)
+
+    def set_via(self, via):
+        if via != self.via:
+            self.via = via
+
+            for slot in self.slots:
+                self.sorted_index.columns.versions[slot] += 1
+
+    def check_assignment(self, exponent):
+        return exponent in self.assignments_by_exponent
+
+    def get_assignment(self, exponent):
+        slot = self.assignments_by_exponent.get(exponent)
+
+        if slot is None:
+            return None
+        return AssignmentView(self.sorted_index.columns, slot)
+
+    def mark_assignment_stale(self, exponent):
+        slot = self.assignments_by_exponent.get(exponent)
+        columns = self.sorted_index.columns
+
+        if slot is not None and columns.stale[slot] == 0:
+            columns.stale[slot] = 1
+            columns.versions[slot] += 1
+
+    def push_update_order(self, slot):
+        columns = self.sorted_index.columns
+        self.slots_added += 1
+        heapq.heappush(self.update_order, (columns.last_updated[slot], self.slots_added, columns.exponents[slot], slot))
+
+        if len(self.update_order) > 2 * len(self.slots) + 8:
+            self.update_order = [entry for entry in self.update_order
+                                 if self.assignments_by_exponent.get(entry[2]) == entry[3]]
+            heapq.heapify(self.update_order)
+
+    def clean_assignments(self):
+        # Remove the least recently updated assignments until there are no more than there are workers.
+        last_updated = self.sorted_index.columns.last_updated
+
+        while len(self.slots) > self.number_of_workers:
+            entry = heapq.heappop(self.update_order)
+            slot = entry[3]
+
+            if self.assignments_by_exponent.get(entry[2]) != slot:
+                continue
+
+            if last_updated[slot] != entry[0]:
+                heapq.heappush(self.update_order, (last_updated[slot],) + entry[1:])
+                continue
+
+            self.remove_slot(slot)
+
+    def create_slot(self, exponent):
+        # Replace any existing assignment for this exponent rather than tracking it twice.
+        if exponent in self.assignments_by_exponent:
+            self.remove_assignment(exponent)
+
+        slot = self.sorted_index.columns.allocate(self.client_id, exponent, self.update_interval)
+        self.slots.append(slot)
+        self.assignments_by_exponent[int(exponent)] = slot
+
+        return slot
+
+    def add_assignment(self, exponent, iterations, timestamp=None):
+        slot = self.create_slot(exponent)
+        columns = self.sorted_index.columns
+
+        columns.update_iterations(slot, iterations, timestamp)
+        columns.update_estimate(slot)
+        self.sorted_index.insert(slot)
+        self.push_update_order(slot)
+
+        if self.expiry is not None:
+            self.expiry.track(self, exponent, int(columns.last_updated[slot]))
+
+        self.clean_assignments()
+
+    def update_assignment(self, exponent, iterations):
+        slot = self.assignments_by_exponent.get(exponent)
+
+        if slot is not None:
+            self.sorted_index.update_iterations(slot, iterations)
+
+    def add_or_update_assignment(self, exponent, iterations, timestamp=None):
+        slot = self.assignments_by_exponent.get(exponent)
+
+        if slot is not None:
+            self.sorted_index.update_iterations(slot, iterations, timestamp)
+        else:
+            self.add_assignment(exponent, iterations, timestamp)
+
+    def remove_slot(self, slot):
+        columns = self.sorted_index.columns
+
+        self.slots.remove(slot)
+        del self.assignments_by_exponent[columns.exponents[slot]]
+
+        if columns.sort_keys[slot] is not None:
+            self.sorted_index.remove(slot)
+        columns.free(slot)
+
+    def remove_assignment(self, exponent):
+        slot = self.assignments_by_exponent.get(exponent)
+
+        if slot is not None:
+            self.remove_slot(slot)
+
+    def get_number_of_assignments(self):
+        return int(len(self.slots))
+
+    def get_state(self):
+        columns = self.sorted_index.columns
+        return (self.name, self.number_of_workers, self.update_interval, self.via,
+                [columns.get_state(slot) for slot in self.slots])
+
+    def restore_assignment(self, assignment_state):
+        # Returns the slot, which is left out of the sorted index so a whole snapshot can be added in one go.
+        slot = self.create_slot(assignment_state[0])
+        self.sorted_index.columns.set_state(slot, assignment_state)
+        self.push_update_order(slot)
+
+        if self.expiry is not None:
+            self.expiry.track(self, assignment_state[0], int(self.sorted_index.columns.last_updated[slot]))
+
+        return slot
+
+
+class ColumnarClientManager:
+    columns = None
+    clients = []
+    clients_by_name = {}
+    sorted_index = None
+    expiry = None
+
+    def __init__(self, sort_by='progress', expiry=None):
+        self.columns = AssignmentColumns()
+        self.clients = []
+        self.clients_by_name = {}
+        self.sorted_index = SortedSlotIndex(self.columns, sort_by)
+        self.expiry = expiry
+
+    def add_client(self, client_name, number_of_workers, update_interval):
+        client = ColumnarClient(client_name, self.columns.add_client_name(client_name), number_of_workers,
+                                update_interval, self.sorted_index, self.expiry)
+        self.clients.append(client)
+        self.clients_by_name[client_name] = client
+
+        return client
+
+    def create_client(self, client_name, number_of_workers, update_interval, exponent, iterations, timestamp=None):
+        client = self.add_client(client_name, number_of_workers, update_interval)
+        client.add_assignment(exponent, iterations, timestamp)
+
+        return client
+
+    def get_client(self, client_name):
+        return self.clients_by_name.get(client_name)
+
+    def add_or_update_client(self, client_name, number_of_workers, update_interval, exponent, iterations,
+                             timestamp=None, via=None):
+        client = self.clients_by_name.get(client_name)
+
+        if client is None:
+            client = self.create_client(client_name, number_of_workers, update_interval, exponent, iterations,
+                                        timestamp)
+        else:
+            client.update_attributes(number_of_workers, update_interval)
+            client.add_or_update_assignment(exponent, iterations, timestamp)
+
+        if via is not None:
+            client.set_via(via)
+
+    def update_client_attributes(self, client_name, number_of_workers, update_interval):
+        client = self.clients_by_name.get(client_name)
+
+        if client is not None:
+            client.update_attributes(number_of_workers, update_interval)
+
+    def add_or_update_client_assignment(self, client_name, exponent, iterations):
+        client = self.clients_by_name.get(client_name)
+
+        if client is not None:
+            client.add_or_update_assignment(exponent, iterations)
+
+    def remove_clients(self, client_names):
+        removed_clients = set()
+
+        for client_name in client_names:
+            client = self.clients_by_name.pop(client_name, None)
+
+            if client is not None:
+                for slot in list(client.slots):
+                    client.remove_slot(slot)
+                removed_clients.add(client_name)
+
+        if len(removed_clients) > 0:
+            self.clients = [client for client in self.clients if client.name not in removed_clients]
+
+    def expire_assignments(self):
+        if self.expiry is None:
+            return {}
+
+        return self.expiry.expire(self)
+
+    def get_assignments_sorted(self):
+        return list(self.sorted_index)
+
+    def get_state(self):
+        return [client.get_state() for client in self.clients]
+
+    def restore_state(self, client_states):
+        restored_slots = []
+
+        for client_name, number_of_workers, update_interval, via, assignment_states in client_states:
+            client = self.clients_by_name.get(client_name)
+
+            if client is None:
+                client = self.add_client(client_name, number_of_workers, update_interval)
+
+            client.set_via(via)
+
+            for assignment_state in assignment_states:
+                restored_slots.append(client.restore_assignment(assignment_state))
+
+        self.sorted_index.insert_many(restored_slots)
+
+    def iter_assignments_sorted(self):
+        return iter(self.sorted_index)
+
+    def begin_batch(self):
+        self.sorted_index.begin_batch()
+
+    def finish_batch(self):
+        self.sorted_index.finish_batch()
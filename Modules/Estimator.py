@@ -0,0 +1,21 @@
+'''
+Speed and completion date estimates for assignments.
+
+An assignment's speed is the iterations it completed within its sample window divided by the seconds those iterations
+took, so reports that arrive late or early are weighted by the time they actually cover. The completion date is then
+the time of the last report plus the remaining iterations at that speed.
+'''
+
+
+def get_iterations_per_second(iteration_sum, second_sum):
+    if second_sum <= 0:
+        return 0.0
+
+    return iteration_sum / second_sum
+
+
+def get_estimated_completion_date(remaining_iterations, iterations_per_second, report_time):
+    if iterations_per_second == 0:
+        return 0
+
+    return int(report_time + remaining_iterations / iterations_per_second)
@@ -0,0 +1,154 @@
+import errno
+import heapq
+import select
+import time
+
+
+class Timer:
+    when = 0
+    callback = None
+    cancelled = False
+
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop:
+    '''
+    A small single-threaded event loop built on the select module. Sockets are registered with a callback that is run
+    when they become readable (or writable), and timers are kept in a heap ordered by the time they are due.
+    '''
+    readers = {}
+    writers = {}
+    timers = []
+    running = False
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.readers = {}
+        self.writers = {}
+        self.timers = []
+        self.timer_sequence = 0
+        self.running = False
+
+        # Prefer poll() where it exists, as select() is limited to FD_SETSIZE descriptors on Linux.
+        self.poller = None
+        if hasattr(select, 'poll'):
+            self.poller = select.poll()
+
+    def update_registration(self, file_descriptor):
+        if self.poller is None:
+            return
+
+        event_mask = 0
+        if file_descriptor in self.readers:
+            event_mask |= select.POLLIN
+        if file_descriptor in self.writers:
+            event_mask |= select.POLLOUT
+
+        if event_mask:
+            self.poller.register(file_descriptor, event_mask)
+        else:
+            try:
+                self.poller.unregister(file_descriptor)
+            except KeyError:
+                pass
+
+    def add_reader(self, sock, callback):
+        file_descriptor = sock.fileno()
+        self.readers[file_descriptor] = callback
+        self.update_registration(file_descriptor)
+        return file_descriptor
+
+    def remove_reader(self, file_descriptor):
+        if self.readers.pop(file_descriptor, None) is not None:
+            self.update_registration(file_descriptor)
+
+    def add_writer(self, sock, callback):
+        file_descriptor = sock.fileno()
+        self.writers[file_descriptor] = callback
+        self.update_registration(file_descriptor)
+        return file_descriptor
+
+    def remove_writer(self, file_descriptor):
+        if self.writers.pop(file_descriptor, None) is not None:
+            self.update_registration(file_descriptor)
+
+    def call_at(self, when, callback):
+        timer = Timer(when, callback)
+        self.timer_sequence += 1
+        heapq.heappush(self.timers, (when, self.timer_sequence, timer))
+        return timer
+
+    def call_later(self, delay, callback):
+        return self.call_at(self.clock() + delay, callback)
+
+    def get_timeout(self, max_timeout):
+        # Discard cancelled timers sitting at the top of the heap.
+        while len(self.timers) > 0 and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+
+        if len(self.timers) == 0:
+            return max_timeout
+
+        timeout = max(0.0, self.timers[0][0] - self.clock())
+
+        if max_timeout is not None:
+            timeout = min(timeout, max_timeout)
+
+        return timeout
+
+    def wait_for_events(self, timeout):
+        if len(self.readers) == 0 and len(self.writers) == 0:
+            time.sleep(timeout if timeout is not None else 1)
+            return [], []
+
+        try:
+            if self.poller is not None:
+                events = self.poller.poll(None if timeout is None else int(timeout * 1000))
+                readable = [fd for fd, event in events if event & (select.POLLIN | select.POLLHUP | select.POLLERR)]
+                writable = [fd for fd, event in events if event & (select.POLLOUT | select.POLLHUP | select.POLLERR)]
+                return readable, writable
+
+            readable, writable, _ = select.select(list(self.readers), list(self.writers), [], timeout)
+            return readable, writable
+        except (select.error, IOError, OSError) as e:
+            # A signal interrupted the wait, simply return to the caller.
+            if e.args[0] == errno.EINTR:
+                return [], []
+            raise
+
+    def run_once(self, max_timeout=None):
+        readable, writable = self.wait_for_events(self.get_timeout(max_timeout))
+
+        # Dispatch socket callbacks. A callback may unregister other descriptors, so look each one up again.
+        for file_descriptor in readable:
+            callback = self.readers.get(file_descriptor)
+            if callback is not None:
+                callback()
+
+        for file_descriptor in writable:
+            callback = self.writers.get(file_descriptor)
+            if callback is not None:
+                callback()
+
+        # Run every timer that is due.
+        now = self.clock()
+        while len(self.timers) > 0 and self.timers[0][0] <= now:
+            timer = heapq.heappop(self.timers)[2]
+            if not timer.cancelled:
+                timer.callback()
+
+    def run_forever(self):
+        self.running = True
+
+        while self.running:
+            self.run_once()
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,86 @@
+'''
+Expiry of assignments whose clients have stopped reporting them.
+
+An assignment is marked stale once its client has gone stale_intervals of its update intervals without reporting it,
+and is removed after evict_intervals. A client is removed along with its last assignment, so a machine that has been
+switched off for good drops out of the table without the server having to be restarted.
+
+Every assignment has a single deadline in a heap, which is only looked at once it has passed. An assignment that has
+reported since is given a later deadline then, so progress updates never touch the heap and expiry costs nothing in
+the message path. The server runs it from the event loop.
+'''
+
+import time
+from collections import OrderedDict
+from Modules.Scheduler import AssignmentScheduler
+
+
+class AssignmentExpiry:
+    stale_intervals = 0
+    evict_intervals = 0
+    deadlines = None
+    stale_assignments = 0
+    evicted_assignments = 0
+    evicted_clients = 0
+
+    def __init__(self, stale_intervals=3, evict_intervals=48, clock=time.time):
+        if not 0 < stale_intervals <= evict_intervals:
+            raise ValueError("Assignments must go stale before they are evicted")
+
+        self.stale_intervals = stale_intervals
+        self.evict_intervals = evict_intervals
+        self.deadlines = AssignmentScheduler(clock)
+        self.stale_assignments = 0
+        self.evicted_assignments = 0
+        self.evicted_clients = 0
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def track(self, client, exponent, last_updated):
+        # Called for each new assignment. Its first deadline is the time it would go stale.
+        self.deadlines.schedule((client.name, exponent), last_updated + self.stale_intervals * client.update_interval)
+
+    def expire(self, client_manager):
+        '''
+        Marks or removes every assignment whose deadline has passed, then removes the clients left without any. Returns
+        the assignments that changed keyed by (client_name, exponent), with None for the ones that were removed.
+        '''
+        now = self.deadlines.clock()
+        changed_assignments = OrderedDict()
+        emptied_clients = []
+
+        for key in self.deadlines.pop_due():
+            client_name, exponent = key
+            client = client_manager.get_client(client_name)
+            assignment = client.get_assignment(exponent) if client is not None else None
+
+            # Removed since it was tracked.
+            if assignment is None:
+                continue
+
+            stale_deadline = assignment.last_updated + self.stale_intervals * client.update_interval
+            evict_deadline = assignment.last_updated + self.evict_intervals * client.update_interval
+
+            if now >= evict_deadline:
+                client.remove_assignment(exponent)
+                changed_assignments[key] = None
+                self.evicted_assignments += 1
+
+                if client.get_number_of_assignments() == 0:
+                    emptied_clients.append(client_name)
+            elif now >= stale_deadline:
+                if not assignment.stale:
+                    client.mark_assignment_stale(exponent)
+                    changed_assignments[key] = client.get_assignment(exponent)
+                    self.stale_assignments += 1
+
+                self.deadlines.schedule(key, evict_deadline)
+            else:
+                # Reported since the deadline was set.
+                self.deadlines.schedule(key, stale_deadline)
+
+        client_manager.remove_clients(emptied_clients)
+        self.evicted_clients += len(emptied_clients)
+
+        return changed_assignments
@@ -1,178 +1,527 @@
-import struct
-import os
+import bisect
+import heapq
+import math
 import time
+from array import array
+from Modules import Estimator
+from Modules import SaveFile
+
+# Sort keys the assignment table can be ordered by. Every key ends with the exponent so that ties are broken the same
+# way each time.
+SORT_KEYS = {
+    'progress': lambda assignment: (-assignment.progress, assignment.exponent),
+    'estimated_completion': lambda assignment: (assignment.estimated_completion_date == 0,
+                                                assignment.estimated_completion_date, assignment.exponent),
+    'last_updated': lambda assignment: (-assignment.last_updated, assignment.exponent),
+    'client': lambda assignment: (assignment.client_name, -assignment.progress, assignment.exponent),
+}
+
+
+class SortedAssignmentIndex:
+    '''
+    Keeps every assignment in display order. Keys are held in a parallel list so the position of an assignment can be
+    found with bisect, and an assignment whose key changes is moved rather than the whole list being sorted again.
+    '''
+    sort_by = ''
+    key_function = None
+    keys = []
+    assignments = []
+    pending = None
+
+    def __init__(self, sort_by='progress'):
+        if sort_by not in SORT_KEYS:
+            raise ValueError("Unknown sort key: " + str(sort_by))
+
+        self.sort_by = sort_by
+        self.key_function = SORT_KEYS[sort_by]
+        self.keys = []
+        self.assignments = []
+
+        # While a batch of updates is being applied, the assignments waiting for new estimates.
+        self.pending = None
+
+    def __iter__(self):
+        return iter(self.assignments)
+
+    def __len__(self):
+        return len(self.assignments)
+
+    def insert(self, assignment):
+        key = self.key_function(assignment)
+        position = bisect.bisect_right(self.keys, key)
+
+        self.keys.insert(position, key)
+        self.assignments.insert(position, assignment)
+        assignment.sort_key = key
+        assignment.sorted_index = self
+
+    def remove(self, assignment):
+        position = bisect.bisect_left(self.keys, assignment.sort_key)
+
+        # The same exponent can be reported by two clients, so step past equal keys until we reach this assignment.
+        while self.assignments[position] is not assignment:
+            position += 1
+
+        del self.keys[position]
+        del self.assignments[position]
+        assignment.sort_key = None
+        assignment.sorted_index = None
+
+    def insert_many(self, assignments):
+        # Add a batch of assignments with a single sort, rather than one list insertion each.
+        entries = [(self.key_function(assignment), assignment) for assignment in assignments]
+        entries.extend(zip(self.keys, self.assignments))
+        entries.sort(key=lambda entry: entry[0])
+
+        self.keys = [key for key, _ in entries]
+        self.assignments = [assignment for _, assignment in entries]
+
+        for key, assignment in entries:
+            assignment.sort_key = key
+            assignment.sorted_index = self
+
+    def update(self, assignment):
+        if self.key_function(assignment) == assignment.sort_key:
+            return
+
+        self.remove(assignment)
+        self.insert(assignment)
+
+    def rebuild(self):
+        assignments = self.assignments
+        self.keys = []
+        self.assignments = []
+        self.insert_many(assignments)
+
+    def begin_batch(self):
+        # Updates made until finish_batch is called only record the new iterations, the rest is done once at the end.
+        if self.pending is None:
+            self.pending = set()
+
+    def finish_batch(self):
+        pending_assignments = list(self.pending or ())
+        self.pending = None
+
+        if len(pending_assignments) == 0:
+            return
+
+        # However many times an assignment was updated in the batch, its estimate is only worked out once.
+        for assignment in pending_assignments:
+            assignment.update_estimated_completion_date()
+            assignment.progress = assignment.get_progress()
+
+        # Moving a few assignments is cheaper than sorting them all again, but not once a good part of them changed.
+        if len(pending_assignments) > len(self.assignments) // 4:
+            self.rebuild()
+            return
+
+        for assignment in pending_assignments:
+            if assignment.sorted_index is self:
+                self.update(assignment)
 
 
 class ClientManager:
     clients = []
+    clients_by_name = {}
+    sorted_index = None
+    expiry = None
 
-    def __init__(self):
+    def __init__(self, sort_by='progress', expiry=None):
         self.clients = []
+        self.clients_by_name = {}
+        self.sorted_index = SortedAssignmentIndex(sort_by)
+        self.expiry = expiry
 
-    def create_client(self, client_name, number_of_workers, update_interval, exponent, iterations):
-        client = Client(client_name, number_of_workers, update_interval)
-        client.add_assignment(exponent, iterations)
+    def create_client(self, client_name, number_of_workers, update_interval, exponent, iterations, timestamp=None):
+        client = Client(client_name, number_of_workers, update_interval, self.sorted_index, self.expiry)
+        client.add_assignment(exponent, iterations, timestamp)
         self.clients.append(client)
+        self.clients_by_name[client_name] = client
+
+        return client
+
+    def get_client(self, client_name):
+        return self.clients_by_name.get(client_name)
+
+    def add_or_update_client(self, client_name, number_of_workers, update_interval, exponent, iterations,
+                             timestamp=None, via=None):
+        '''
+        The timestamp defaults to now, and is only given when replaying updates that were recorded earlier. Via is the
+        path of relays the update came through, or None to leave the client's path as it is.
+        '''
+        client = self.clients_by_name.get(client_name)
 
-    def add_or_update_client(self, client_name, number_of_workers, update_interval, exponent, iterations):
-        for i in range(0, len(self.clients)):
-            if self.clients[i].name == client_name:
-                self.update_client_attributes(client_name, number_of_workers, update_interval)
-                self.add_or_update_client_assignment(client_name, exponent, iterations)
-                return
+        if client is None:
+            client = self.create_client(client_name, number_of_workers, update_interval, exponent, iterations,
+                                        timestamp)
+        else:
+            client.update_attributes(number_of_workers, update_interval)
+            client.add_or_update_assignment(exponent, iterations, timestamp)
 
-        self.create_client(client_name, number_of_workers, update_interval, exponent, iterations)
+        if via is not None:
+            client.set_via(via)
 
     def update_client_attributes(self, client_name, number_of_workers, update_interval):
-        for i in range(0, len(self.clients)):
-            if self.clients[i].name == client_name:
-                self.clients[i].update_attributes(number_of_workers, update_interval)
+        client = self.clients_by_name.get(client_name)
+
+        if client is not None:
+            client.update_attributes(number_of_workers, update_interval)
 
     def add_or_update_client_assignment(self, client_name, exponent, iterations):
-        for i in range(0, len(self.clients)):
-            if self.clients[i].name == client_name:
-                if self.clients[i].check_assignment(exponent):
-                    self.clients[i].update_assignment(exponent, iterations)
-                    return
-                else:
-                    self.clients[i].add_assignment(exponent, iterations)
-                    return
+        client = self.clients_by_name.get(client_name)
+
+        if client is not None:
+            client.add_or_update_assignment(exponent, iterations)
+
+    def remove_clients(self, client_names):
+        # Removes the clients and all their assignments, rebuilding the list of clients once for the lot.
+        removed_clients = set()
+
+        for client_name in client_names:
+            client = self.clients_by_name.pop(client_name, None)
+
+            if client is not None:
+                for exponent in list(client.assignments_by_exponent):
+                    client.remove_assignment(exponent)
+                removed_clients.add(client_name)
+
+        if len(removed_clients) > 0:
+            self.clients = [client for client in self.clients if client.name not in removed_clients]
+
+    def expire_assignments(self):
+        # Marks or removes the assignments that have stopped reporting, see Expiry.AssignmentExpiry.
+        if self.expiry is None:
+            return {}
+
+        return self.expiry.expire(self)
 
     def get_assignments_sorted(self):
-        assignments = []
+        return list(self.sorted_index)
+
+    def get_state(self):
+        # Plain data describing every client and assignment, for snapshots.
+        return [client.get_state() for client in self.clients]
+
+    def restore_state(self, client_states):
+        restored_assignments = []
+
+        for client_name, number_of_workers, update_interval, via, assignment_states in client_states:
+            client = self.clients_by_name.get(client_name)
+
+            if client is None:
+                client = Client(client_name, number_of_workers, update_interval, self.sorted_index, self.expiry)
+                self.clients.append(client)
+                self.clients_by_name[client_name] = client
+
+            client.set_via(via)
+
+            for assignment_state in assignment_states:
+                restored_assignments.append(client.restore_assignment(assignment_state))
+
+        self.sorted_index.insert_many(restored_assignments)
+
+    def iter_assignments_sorted(self):
+        # Walk the assignments in display order without copying them.
+        return iter(self.sorted_index)
 
-        for i in range(0, len(self.clients)):
-            for j in range(0, len(self.clients[i].assignments)):
-                assignments.append(self.clients[i].assignments[j])
+    def begin_batch(self):
+        self.sorted_index.begin_batch()
 
-        return sorted(assignments, key=lambda x: x.progress, reverse=True)
+    def finish_batch(self):
+        # Bring the estimates and display order of everything updated since begin_batch up to date in one pass.
+        self.sorted_index.finish_batch()
 
 
 class Client:
     name = ''
     number_of_workers = 0
     update_interval = 0
+    via = ''
     assignments = []
+    assignments_by_exponent = {}
+    sorted_index = None
+    expiry = None
+    update_order = []
+    assignments_added = 0
 
-    def __init__(self, name, number_of_workers, update_interval):
+    def __init__(self, name, number_of_workers, update_interval, sorted_index=None, expiry=None):
         self.name = name
         self.update_attributes(number_of_workers, update_interval)
+        self.via = ''
         self.assignments = []
+        self.assignments_by_exponent = {}
+        self.sorted_index = sorted_index
+        self.expiry = expiry
+
+        # Heap of (last_updated, insertion order, assignment), oldest first. Entries are only corrected when they reach
+        # the top, so reports never have to touch the heap.
+        self.update_order = []
+        self.assignments_added = 0
 
     def update_attributes(self, number_of_workers, update_interval):
         self.number_of_workers = int(number_of_workers)
         self.update_interval = int(update_interval)
 
+    def set_via(self, via):
+        # The path is shown in each of the client's rows, so they have to be drawn again when it changes.
+        if via != self.via:
+            self.via = via
+
+            for assignment in self.assignments:
+                assignment.version += 1
+
     def check_assignment(self, exponent):
-        for assignment in self.assignments:
-            if assignment.exponent == exponent:
-                return True
-        return False
+        return exponent in self.assignments_by_exponent
+
+    def get_assignment(self, exponent):
+        return self.assignments_by_exponent.get(exponent)
+
+    def mark_assignment_stale(self, exponent):
+        assignment = self.assignments_by_exponent.get(exponent)
+
+        if assignment is not None and not assignment.stale:
+            assignment.stale = True
+            assignment.version += 1
+
+    def push_update_order(self, assignment):
+        self.assignments_added += 1
+        heapq.heappush(self.update_order, (assignment.last_updated, self.assignments_added, assignment))
+
+        # Entries of removed assignments are only dropped when they reach the top, so clear them out if they pile up.
+        if len(self.update_order) > 2 * len(self.assignments) + 8:
+            self.update_order = [entry for entry in self.update_order
+                                 if self.assignments_by_exponent.get(entry[2].exponent) is entry[2]]
+            heapq.heapify(self.update_order)
 
     def clean_assignments(self):
         '''
         There can be instances where the server isn't notified of an assignment removal. This will result in the client
-        having more assignments allocated to it than it should. We can remedy this by looping through all the
-        assignments, and removing the oldest one's until the number of assignments matches the number of workers for the
-        server.
+        having more assignments allocated to it than it should. We can remedy this by removing the oldest ones until the
+        number of assignments matches the number of workers for the client.
         '''
 
         while len(self.assignments) > self.number_of_workers:
-            oldest_assignment_last_updated_time = int(time.time() + 86400)
-            oldest_assignment_index = 0
+            last_updated, insertion_order, assignment = heapq.heappop(self.update_order)
+
+            # Already removed.
+            if self.assignments_by_exponent.get(assignment.exponent) is not assignment:
+                continue
 
-            # Identify the oldest assignment.
-            for i in range(0, len(self.assignments)):
-                if self.assignments[i].last_updated < oldest_assignment_last_updated_time:
-                    oldest_assignment_last_updated_time = self.assignments[i].last_updated
-                    oldest_assignment_index = i
+            # Reported since the entry was pushed, so put it back where it now belongs.
+            if assignment.last_updated != last_updated:
+                heapq.heappush(self.update_order, (assignment.last_updated, insertion_order, assignment))
+                continue
 
-            # Remove the oldest assignment
-            self.assignments.pop(oldest_assignment_index)
+            self.remove_assignment(assignment.exponent)
 
-    def add_assignment(self, exponent, iterations):
-        new_assignment = Assignment(self.name, exponent, iterations, self.update_interval)
+    def add_assignment(self, exponent, iterations, timestamp=None):
+        # Replace any existing assignment for this exponent rather than tracking it twice.
+        if exponent in self.assignments_by_exponent:
+            self.remove_assignment(exponent)
+
+        new_assignment = Assignment(self.name, exponent, iterations, self.update_interval, timestamp)
         self.assignments.append(new_assignment)
+        self.assignments_by_exponent[new_assignment.exponent] = new_assignment
+
+        if self.sorted_index is not None:
+            self.sorted_index.insert(new_assignment)
+
+        self.push_update_order(new_assignment)
+
+        if self.expiry is not None:
+            self.expiry.track(self, exponent, new_assignment.last_updated)
 
         # Make sure we don't have more assignments than we have workers for this client.
         self.clean_assignments()
 
     def update_assignment(self, exponent, iterations):
-        for assignment in self.assignments:
-            if assignment.exponent == exponent:
-                assignment.update_iterations(iterations)
-                return
+        assignment = self.assignments_by_exponent.get(exponent)
+
+        if assignment is not None:
+            assignment.update_iterations(iterations)
+
+    def add_or_update_assignment(self, exponent, iterations, timestamp=None):
+        assignment = self.assignments_by_exponent.get(exponent)
+
+        if assignment is not None:
+            assignment.update_iterations(iterations, timestamp)
+        else:
+            self.add_assignment(exponent, iterations, timestamp)
 
     def remove_assignment(self, exponent):
-        for index in range(0, len(self.assignments)):
-            if self.assignments[index].exponent == exponent:
-                self.assignments.pop(index)
-                return
+        assignment = self.assignments_by_exponent.pop(exponent, None)
+
+        if assignment is not None:
+            self.assignments.remove(assignment)
+
+            if assignment.sorted_index is not None:
+                assignment.sorted_index.remove(assignment)
 
     def get_number_of_assignments(self):
         return int(len(self.assignments))
 
+    def get_state(self):
+        return (self.name, self.number_of_workers, self.update_interval, self.via,
+                [assignment.get_state() for assignment in self.assignments])
 
-class Assignment:
-    client_name = ""
-    exponent = 0
-    exponent_digit_length = 0
-    iterations = 0
-    progress = 0.0
-    last_updated = 0
-    update_interval = 0
-    estimated_completion_date = 0
-    average_iterations_per_second = []
+    def restore_assignment(self, assignment_state):
+        # The restored assignment is returned rather than added to the sorted index, so that a whole snapshot can be
+        # added in one go.
+        exponent = assignment_state[0]
+
+        if exponent in self.assignments_by_exponent:
+            self.remove_assignment(exponent)
 
-    def __init__(self, client_name, exponent, iterations, update_interval):
+        restored_assignment = Assignment(self.name, exponent, 0, self.update_interval)
+        restored_assignment.set_state(assignment_state)
+        self.assignments.append(restored_assignment)
+        self.assignments_by_exponent[exponent] = restored_assignment
+        self.push_update_order(restored_assignment)
+
+        if self.expiry is not None:
+            self.expiry.track(self, exponent, restored_assignment.last_updated)
+
+        return restored_assignment
+
+
+class Assignment(object):
+    # Assignments are the most numerous objects on the server, so skip the per-instance __dict__.
+    __slots__ = ('client_name', 'exponent', 'exponent_digit_length', 'iterations', 'progress', 'last_updated',
+                 'last_report_time', 'last_progress_time', 'update_interval', 'estimated_completion_date',
+                 'sample_iterations', 'sample_seconds', 'sample_count', 'sample_position', 'sample_iteration_sum',
+                 'sample_second_sum', 'stale', 'sorted_index', 'sort_key', 'version')
+
+    def __init__(self, client_name, exponent, iterations, update_interval, timestamp=None):
         self.client_name = client_name
         self.exponent = int(exponent)
         self.exponent_digit_length = int(round(exponent * 0.301029995664))
+        self.iterations = 0
+        self.progress = 0.0
         self.update_interval = int(update_interval)
-        self.last_updated = int(time.time())
-        self.update_iterations(iterations)
-        self.average_iterations_per_second = []
+        self.estimated_completion_date = 0
+        self.sorted_index = None
+        self.sort_key = None
+
+        # Set once the client has gone several update intervals without reporting the assignment.
+        self.stale = False
+
+        # Incremented whenever anything shown in the assignment's table row changes.
+        self.version = 0
+
+        # Ring buffers holding the last six hours of speed samples, each the iterations completed between two reports
+        # and the seconds that actually passed between them, along with their running sums.
+        window_size = max(1, 21600 // self.update_interval)
+        self.sample_iterations = array('d', [0.0]) * window_size
+        self.sample_seconds = array('d', [0.0]) * window_size
+        self.sample_count = 0
+        self.sample_position = 0
+        self.sample_iteration_sum = 0.0
+        self.sample_second_sum = 0.0
+
+        self.last_updated = 0
+        self.last_report_time = 0.0
+        self.last_progress_time = 0.0
+        self.update_iterations(iterations, timestamp)
+
+    def add_sample(self, iterations, seconds):
+        window_size = len(self.sample_iterations)
+
+        # Once the buffer is full, the newest sample replaces the oldest one.
+        if self.sample_count == window_size:
+            self.sample_iteration_sum -= self.sample_iterations[self.sample_position]
+            self.sample_second_sum -= self.sample_seconds[self.sample_position]
+        else:
+            self.sample_count += 1
+
+        self.sample_iterations[self.sample_position] = iterations
+        self.sample_seconds[self.sample_position] = seconds
+        self.sample_iteration_sum += iterations
+        self.sample_second_sum += seconds
+        self.sample_position = (self.sample_position + 1) % window_size
+
+        # Re-sum the buffers each time they wrap around so floating point error can't build up in the running sums.
+        if self.sample_position == 0:
+            self.sample_iteration_sum = math.fsum(self.sample_iterations)
+            self.sample_second_sum = math.fsum(self.sample_seconds)
+
+    def update_iterations(self, new_iterations, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+
+        new_iterations = int(new_iterations)
+
+        # Clients also report assignments that haven't moved, so the sample covers all the time since the iterations
+        # last changed.
+        if self.iterations > 0 and new_iterations > self.iterations and timestamp > self.last_progress_time:
+            self.add_sample(new_iterations - self.iterations, timestamp - self.last_progress_time)
+
+        if new_iterations != self.iterations:
+            self.last_progress_time = timestamp
 
-    def update_iterations(self, new_iterations):
-        if self.iterations > 0:
-            iterations_since_last_update = int(new_iterations) - self.iterations
+        self.iterations = new_iterations
+        self.last_updated = int(timestamp)
+        self.last_report_time = timestamp
+        self.stale = False
+
+        if self.sorted_index is not None and self.sorted_index.pending is not None:
+            # Part of a batch, so the estimate and position are updated when the batch is finished.
+            self.sorted_index.pending.add(self)
+        else:
+            self.update_estimated_completion_date()
+            self.update_progress()
+
+        self.version += 1
+
+    def get_state(self):
+        # The speed samples are stored oldest first, so they can be restored into a window of any size.
+        sample_iterations = self.sample_iterations
+        sample_seconds = self.sample_seconds
+        if self.sample_count == len(sample_iterations):
+            sample_iterations = sample_iterations[self.sample_position:] + sample_iterations[:self.sample_position]
+            sample_seconds = sample_seconds[self.sample_position:] + sample_seconds[:self.sample_position]
         else:
-            iterations_since_last_update = 0
+            sample_iterations = sample_iterations[:self.sample_count]
+            sample_seconds = sample_seconds[:self.sample_count]
 
-        if iterations_since_last_update > 0:
-            self.average_iterations_per_second.append(iterations_since_last_update / (self.update_interval * 1.0))
+        return (self.exponent, self.iterations, self.last_updated, self.last_progress_time,
+                self.estimated_completion_date, sample_iterations.tostring(), sample_seconds.tostring(), self.stale)
 
-        self.iterations = int(new_iterations)
+    def set_state(self, assignment_state):
+        (_, iterations, last_updated, last_progress_time, estimated_completion_date, sample_iterations,
+         sample_seconds, stale) = assignment_state
 
-        if len(self.average_iterations_per_second) > (21600 / self.update_interval):
-            self.average_iterations_per_second.pop(0)
+        for sample in zip(array('d', sample_iterations), array('d', sample_seconds)):
+            self.add_sample(*sample)
 
-        self.last_updated = int(time.time())
-        self.update_estimated_completion_date()
+        self.iterations = int(iterations)
+        self.last_updated = int(last_updated)
+        self.last_report_time = float(last_updated)
+        self.last_progress_time = float(last_progress_time)
+        self.estimated_completion_date = int(estimated_completion_date)
+        self.stale = bool(stale)
         self.update_progress()
+        self.version += 1
 
     def get_average_iterations_per_second(self):
-        average_iterations_per_second = 0
-
-        for iterations in self.average_iterations_per_second:
-            average_iterations_per_second = average_iterations_per_second + iterations
+        return Estimator.get_iterations_per_second(self.sample_iteration_sum, self.sample_second_sum)
 
-        if len(self.average_iterations_per_second) == 0:
-            return 0.0
-        else:
-            return average_iterations_per_second / (len(self.average_iterations_per_second) * 1.0)
+    def update_estimated_completion_date(self, timestamp=None):
+        # Estimated from the last report, unless another time is given.
+        if timestamp is None:
+            timestamp = self.last_report_time
 
-    def update_estimated_completion_date(self):
-        average_iterations_per_second = self.get_average_iterations_per_second()
+        self.estimated_completion_date = Estimator.get_estimated_completion_date(
+            self.exponent - self.iterations, self.get_average_iterations_per_second(), timestamp)
 
-        if average_iterations_per_second == 0:
-            self.estimated_completion_date = int(0)
-        else:
-            self.estimated_completion_date = int(time.time() + ((self.exponent - self.iterations) /
-                                                                average_iterations_per_second))
+    def get_progress(self):
+        return round(100 * (self.iterations * 1.0) / (self.exponent * 1.0), 2)
 
     def update_progress(self):
-        self.progress = round(100 * (self.iterations * 1.0) / (self.exponent * 1.0), 2)
+        self.progress = self.get_progress()
+
+        # Move the assignment to its new position in the display order.
+        if self.sorted_index is not None:
+            self.sorted_index.update(self)
 
 
 class AssignmentFile:
@@ -180,25 +529,22 @@ class AssignmentFile:
     exponent = 0
     iterations = 0
     previous_iterations = 0
+    work_type = ''
     last_modified = 0
     time_to_check = 0
     time_to_sleep = 0
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, header=None):
         self.file_path = file_path
-        self.read_file()
-
-    def read_file(self):
-        if not os.path.isfile(self.file_path):
-            raise Exception(self.file_path + " does not exist.")
-
-        self.last_modified = int(os.path.getmtime(self.file_path))
-
-        with open(self.file_path, 'rb') as data_file:
-            byte_stream = data_file.read(60)
-
-            data_file.close()
-
-            self.exponent = int(struct.unpack_from("<L", byte_stream, 20)[0])
-            self.previous_iterations = self.iterations
-            self.iterations = int(struct.unpack_from("<L", byte_stream, 56)[0])
+        self.read_file(header)
+
+    def read_file(self, header=None):
+        # Callers that have already parsed the header, such as a batch read of a whole directory, can pass it in.
+        if header is None:
+            header = SaveFile.read_header(self.file_path)
+
+        self.last_modified = int(header.stat_result.st_mtime)
+        self.exponent = header.get_exponent()
+        self.work_type = header.work_type
+        self.previous_iterations = self.iterations
+        self.iterations = header.get_iterations()
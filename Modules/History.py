@@ -0,0 +1,227 @@
+import Queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS samples (
+    timestamp REAL NOT NULL,
+    client_name TEXT NOT NULL,
+    number_of_workers INTEGER NOT NULL,
+    update_interval INTEGER NOT NULL,
+    exponent INTEGER NOT NULL,
+    iterations INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_by_assignment ON samples (client_name, exponent, timestamp);
+CREATE INDEX IF NOT EXISTS samples_by_time ON samples (timestamp);
+'''
+
+INSERT_SAMPLE = 'INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?)'
+DELETE_OLD_SAMPLES = 'DELETE FROM samples WHERE timestamp < ?'
+
+# Marks the end of the queue when the store is closed.
+STOP = None
+
+
+class HistoryStore:
+    '''
+    Records every client update as a timestamped sample in an SQLite database running in WAL mode. Samples are handed
+    to a writer thread through a queue and written in batches, one transaction each, so recording a sample never waits
+    on the disk. If the writer falls too far behind, new samples are dropped (and counted) rather than blocking. A batch
+    that can't be written (the database is locked, or the disk is full) is counted as failed and the writer carries on.
+
+    Samples older than the retention period are deleted by the writer thread once every prune interval, so the database
+    doesn't grow without bound. A retention of 0 keeps every sample.
+
+    Queries open their own connection, which WAL mode lets run alongside the writer.
+    '''
+    database_path = ''
+    flush_interval = 0.0
+    batch_size = 0
+    retention = 0
+    prune_interval = 0.0
+    sample_queue = None
+    writer_thread = None
+    query_connection = None
+    dropped_samples = 0
+    written_samples = 0
+    failed_samples = 0
+    pruned_samples = 0
+    last_error = None
+
+    def __init__(self, database_path, flush_interval=1.0, batch_size=1000, maximum_pending=100000, retention=2592000,
+                 prune_interval=3600):
+        self.database_path = database_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self.sample_queue = Queue.Queue(maximum_pending)
+        self.writer_thread = None
+        self.query_connection = None
+        self.dropped_samples = 0
+        self.written_samples = 0
+        self.failed_samples = 0
+        self.pruned_samples = 0
+        self.last_error = None
+
+        # Create the schema up front, so a bad path is reported when the server starts.
+        connection = self.connect()
+        connection.executescript(SCHEMA)
+        connection.close()
+
+    def connect(self):
+        # Client names come back as unicode, the same as they are decoded from the wire.
+        connection = sqlite3.connect(self.database_path)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def start(self):
+        self.writer_thread = threading.Thread(target=self.write_samples, name='HistoryWriter')
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+
+    def record(self, client_name, number_of_workers, update_interval, exponent, iterations, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+
+        try:
+            self.sample_queue.put_nowait((timestamp, client_name, number_of_workers, update_interval, exponent,
+                                          iterations))
+        except Queue.Full:
+            self.dropped_samples += 1
+
+    def close(self, timeout=10):
+        # Write out everything that has been recorded, then stop the writer. Gives up after the timeout if the writer
+        # can't keep up, rather than holding up the shutdown.
+        if self.writer_thread is not None:
+            try:
+                self.sample_queue.put(STOP, True, timeout)
+                self.writer_thread.join(timeout)
+            except Queue.Full:
+                pass
+            self.writer_thread = None
+
+        if self.query_connection is not None:
+            self.query_connection.close()
+            self.query_connection = None
+
+    def write_samples(self):
+        # Runs on the writer thread, which owns its own connection.
+        connection = self.connect()
+        stopping = False
+        next_prune_time = time.time()
+
+        while not stopping:
+            if self.retention > 0 and time.time() >= next_prune_time:
+                self.prune(connection)
+                next_prune_time = time.time() + self.prune_interval
+
+            # Wake up for the next prune even when no samples arrive.
+            try:
+                batch = [self.sample_queue.get(True, max(0.001, next_prune_time - time.time()))
+                         if self.retention > 0 else self.sample_queue.get()]
+            except Queue.Empty:
+                continue
+
+            flush_time = time.time() + self.flush_interval
+
+            # Keep collecting until the batch is full or the flush interval is up, so a burst of updates is written in
+            # a single transaction.
+            while len(batch) < self.batch_size:
+                timeout = flush_time - time.time()
+                if timeout <= 0:
+                    break
+
+                try:
+                    batch.append(self.sample_queue.get(True, timeout))
+                except Queue.Empty:
+                    break
+
+            if STOP in batch:
+                stopping = True
+                batch = [sample for sample in batch if sample is not STOP]
+
+                # Nothing else will be recorded, so take whatever is left in the queue too.
+                while True:
+                    try:
+                        batch.append(self.sample_queue.get_nowait())
+                    except Queue.Empty:
+                        break
+
+            if len(batch) > 0:
+                try:
+                    with connection:
+                        connection.executemany(INSERT_SAMPLE, batch)
+                    self.written_samples += len(batch)
+                except sqlite3.Error as e:
+                    self.failed_samples += len(batch)
+                    self.last_error = e
+
+        connection.close()
+
+    def prune(self, connection):
+        try:
+            with connection:
+                cursor = connection.execute(DELETE_OLD_SAMPLES, (time.time() - self.retention,))
+            self.pruned_samples += max(0, cursor.rowcount)
+        except sqlite3.Error as e:
+            self.last_error = e
+
+    def get_query_connection(self):
+        if self.query_connection is None:
+            self.query_connection = self.connect()
+
+        return self.query_connection
+
+    def get_assignment_history(self, client_name, exponent, start_time=0, end_time=None):
+        # Return the (timestamp, iterations) samples recorded for one assignment, oldest first.
+        if end_time is None:
+            end_time = time.time()
+
+        cursor = self.get_query_connection().execute(
+            'SELECT timestamp, iterations FROM samples WHERE client_name = ? AND exponent = ? AND timestamp >= ? AND '
+            'timestamp <= ? ORDER BY timestamp', (client_name, exponent, start_time, end_time))
+
+        return cursor.fetchall()
+
+    def get_client_throughput(self, client_name, start_time, end_time, bucket_size=3600):
+        '''
+        Return the client's combined speed over a time range as a list of (bucket_start, iterations_per_second) pairs,
+        one for every bucket_size seconds. The iterations completed between two samples of the same assignment are
+        credited to the bucket the later sample falls in.
+        '''
+        cursor = self.get_query_connection().execute(
+            'SELECT exponent, timestamp, iterations FROM samples WHERE client_name = ? AND timestamp >= ? AND '
+            'timestamp < ? ORDER BY exponent, timestamp', (client_name, start_time, end_time))
+
+        number_of_buckets = max(1, int((end_time - start_time + bucket_size - 1) // bucket_size))
+        completed_iterations = [0] * number_of_buckets
+        previous_exponent = None
+        previous_iterations = 0
+
+        for exponent, timestamp, iterations in cursor:
+            if exponent == previous_exponent and iterations > previous_iterations >= 0:
+                completed_iterations[int((timestamp - start_time) // bucket_size)] += iterations - previous_iterations
+
+            previous_exponent = exponent
+            previous_iterations = iterations
+
+        return [(start_time + i * bucket_size, completed_iterations[i] / float(bucket_size))
+                for i in range(0, number_of_buckets)]
+
+    def replay(self, client_manager, start_time):
+        # Feed the samples recorded since start_time back through a client manager, rebuilding its speed windows.
+        cursor = self.get_query_connection().execute(
+            'SELECT client_name, number_of_workers, update_interval, exponent, iterations, timestamp FROM samples '
+            'WHERE timestamp >= ? ORDER BY timestamp', (start_time,))
+
+        replayed_samples = 0
+        client_manager.begin_batch()
+        for sample in cursor:
+            client_manager.add_or_update_client(*sample)
+            replayed_samples += 1
+        client_manager.finish_batch()
+
+        return replayed_samples
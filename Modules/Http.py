@@ -0,0 +1,233 @@
+import errno
+import hashlib
+import socket
+from email.utils import formatdate
+from Modules.Ingest import WOULD_BLOCK_ERRORS
+
+# Largest request head (request line and headers) the server will accept.
+MAXIMUM_REQUEST_SIZE = 8192
+
+STATUS_LINES = {
+    200: 'HTTP/1.1 200 OK',
+    304: 'HTTP/1.1 304 Not Modified',
+    400: 'HTTP/1.1 400 Bad Request',
+    404: 'HTTP/1.1 404 Not Found',
+    405: 'HTTP/1.1 405 Method Not Allowed',
+}
+
+
+class ResponseCache:
+    '''
+    Holds the body of every page the HTTP server can serve, already serialized, along with an ETag derived from its
+    content. Pages are replaced when the state they show changes, so serving a request never has to build anything.
+    The exception is pages set with a handler, which are built each time they are requested.
+    '''
+    pages = {}
+    handlers = {}
+
+    def __init__(self):
+        self.pages = {}
+        self.handlers = {}
+
+    def set_page(self, path, content_type, body):
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        self.pages[path] = (etag, content_type, body)
+
+    def set_handler(self, path, content_type, function):
+        # For pages that change too often to keep up to date, such as /metrics.
+        self.handlers[path] = (content_type, function)
+
+    def get_page(self, path):
+        # Returns (etag, content_type, body), or None for an unknown path.
+        if path in self.handlers:
+            content_type, function = self.handlers[path]
+            self.set_page(path, content_type, function())
+
+        return self.pages.get(path)
+
+
+def parse_request(request_head):
+    # Returns (method, path, headers) for the head of an HTTP request, or None if it is malformed.
+    lines = request_head.split('\r\n')
+    request_line = lines[0].split(' ')
+
+    if len(request_line) != 3 or not request_line[2].startswith('HTTP/'):
+        return None
+
+    headers = {}
+    for line in lines[1:]:
+        name, separator, value = line.partition(':')
+        if separator:
+            headers[name.strip().lower()] = value.strip()
+
+    method, path = request_line[0], request_line[1].split('?', 1)[0]
+    return method, path, headers
+
+
+def etag_matches(if_none_match, etag):
+    if if_none_match is None:
+        return False
+
+    return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+
+def build_response(status, headers, body=''):
+    response_head = [STATUS_LINES[status], 'Date: ' + formatdate(usegmt=True), 'Connection: close']
+    response_head.extend(name + ': ' + value for name, value in headers)
+
+    return '\r\n'.join(response_head) + '\r\n\r\n' + body
+
+
+class HttpConnection:
+    '''
+    A single HTTP request. The request head is read, answered from the response cache, and the connection is closed
+    once the response has been written.
+    '''
+    server = None
+    sock = None
+    file_descriptor = -1
+    request = ''
+    response = ''
+    timeout_timer = None
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.request = ''
+        self.response = ''
+
+        self.sock.setblocking(0)
+        self.file_descriptor = server.loop.add_reader(sock, self.handle_read)
+        self.timeout_timer = server.loop.call_later(server.read_timeout, self.close)
+
+    def handle_read(self):
+        try:
+            data = self.sock.recv(4096)
+        except socket.error as e:
+            if e.args[0] in WOULD_BLOCK_ERRORS:
+                return
+            self.close()
+            return
+
+        if not data:
+            self.close()
+            return
+
+        self.request += data
+        end_of_head = self.request.find('\r\n\r\n')
+
+        if end_of_head == -1:
+            if len(self.request) > MAXIMUM_REQUEST_SIZE:
+                self.send_response(build_response(400, [('Content-Length', '0')]))
+            return
+
+        self.server.loop.remove_reader(self.file_descriptor)
+        self.send_response(self.server.handle_request(self.request[:end_of_head]))
+
+    def send_response(self, response):
+        self.response = response
+        self.server.loop.remove_reader(self.file_descriptor)
+        self.server.loop.add_writer(self.sock, self.handle_write)
+
+    def handle_write(self):
+        try:
+            sent = self.sock.send(self.response)
+        except socket.error as e:
+            if e.args[0] in WOULD_BLOCK_ERRORS:
+                return
+            self.close()
+            return
+
+        self.response = self.response[sent:]
+
+        if self.response == '':
+            self.close()
+
+    def close(self):
+        if self.timeout_timer is not None:
+            self.timeout_timer.cancel()
+            self.timeout_timer = None
+
+        self.server.loop.remove_reader(self.file_descriptor)
+        self.server.loop.remove_writer(self.file_descriptor)
+        self.server.connections.pop(self.file_descriptor, None)
+
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+class HttpServer:
+    '''
+    Serves the pages in a response cache over HTTP, on the same event loop as the ingest server. Requests carrying an
+    If-None-Match header that matches the page's ETag are answered with 304 Not Modified and no body.
+    '''
+    loop = None
+    responses = None
+    host = ''
+    port = 0
+    backlog = 0
+    read_timeout = 0
+    sock = None
+    connections = {}
+    requests_served = 0
+
+    def __init__(self, loop, responses, host, port, read_timeout=10, backlog=128):
+        self.loop = loop
+        self.responses = responses
+        self.host = host
+        self.port = int(port)
+        self.read_timeout = read_timeout
+        self.backlog = int(backlog)
+        self.connections = {}
+        self.requests_served = 0
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(self.backlog)
+        self.sock.setblocking(0)
+        self.loop.add_reader(self.sock, self.handle_accept)
+
+    def handle_accept(self):
+        while True:
+            try:
+                client_socket, _ = self.sock.accept()
+            except socket.error as e:
+                if e.args[0] in WOULD_BLOCK_ERRORS or e.args[0] == errno.ECONNABORTED:
+                    return
+                raise
+
+            connection = HttpConnection(self, client_socket)
+            self.connections[connection.file_descriptor] = connection
+
+    def handle_request(self, request_head):
+        # Build the complete response to a request head.
+        self.requests_served += 1
+        request = parse_request(request_head)
+
+        if request is None:
+            return build_response(400, [('Content-Length', '0')])
+
+        method, path, headers = request
+
+        if method not in ('GET', 'HEAD'):
+            return build_response(405, [('Allow', 'GET, HEAD'), ('Content-Length', '0')])
+
+        page = self.responses.get_page(path)
+        if page is None:
+            return build_response(404, [('Content-Length', '0')])
+
+        etag, content_type, body = page
+        page_headers = [('ETag', etag), ('Cache-Control', 'no-cache')]
+
+        if etag_matches(headers.get('if-none-match'), etag):
+            return build_response(304, page_headers)
+
+        page_headers.extend([('Content-Type', content_type), ('Content-Length', str(len(body)))])
+        return build_response(200, page_headers, body if method == 'GET' else '')
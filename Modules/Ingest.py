@@ -0,0 +1,279 @@
+import errno
+import socket
+import time
+from Modules.Metrics import Histogram
+from Modules.Protocol import FrameDecoder, ProtocolError, decode_datagram
+
+# Errors raised by non-blocking sockets when there is simply nothing to do right now.
+WOULD_BLOCK_ERRORS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+# Most datagrams read in one go, so a flood of them can't keep the event loop from everything else.
+MAXIMUM_DATAGRAMS_PER_READ = 1024
+
+# Seconds between sweeps for the sequence numbers of assignments the server no longer tracks.
+SEQUENCE_PRUNE_INTERVAL = 60
+
+
+class IngestConnection:
+    '''
+    A single client connection. Legacy clients send one message and close the connection, while newer clients keep
+    the connection open and send binary frames or newline terminated batches. A partially received message must be
+    completed within the read timeout, and a connection sitting idle between messages is closed after the idle timeout.
+    '''
+    server = None
+    sock = None
+    address = None
+    file_descriptor = -1
+    decoder = None
+    timeout_timer = None
+    waiting_for_message = False
+
+    def __init__(self, server, sock, address):
+        self.server = server
+        self.sock = sock
+        self.address = address
+        self.decoder = FrameDecoder()
+        self.timeout_timer = None
+
+        self.sock.setblocking(0)
+        self.file_descriptor = server.loop.add_reader(sock, self.handle_read)
+        self.set_timeout(server.read_timeout)
+        self.waiting_for_message = True
+
+    def set_timeout(self, timeout):
+        if self.timeout_timer is not None:
+            self.timeout_timer.cancel()
+
+        self.timeout_timer = self.server.loop.call_later(timeout, self.handle_timeout)
+
+    def handle_read(self):
+        try:
+            data = self.sock.recv(4096)
+        except socket.error as e:
+            if e.args[0] in WOULD_BLOCK_ERRORS:
+                return
+            self.close()
+            return
+
+        # The client closed its side of the connection, so whatever is left in the buffer is a complete message.
+        if not data:
+            self.server.handle_updates(self.decoder.finish(), self.decoder)
+            self.close()
+            return
+
+        parse_start = time.time()
+        try:
+            updates = self.decoder.feed(data)
+        except ProtocolError:
+            # The stream can't be resynchronised after a bad frame.
+            self.server.rejected_messages += 1
+            self.close()
+            return
+        self.server.parse_latency.observe(time.time() - parse_start)
+
+        self.server.handle_updates(updates, self.decoder)
+
+        # Give a partial message the read timeout to complete, otherwise allow the connection to sit idle.
+        if self.decoder.has_partial_message():
+            if not self.waiting_for_message:
+                self.set_timeout(self.server.read_timeout)
+                self.waiting_for_message = True
+        else:
+            self.set_timeout(self.server.idle_timeout)
+            self.waiting_for_message = False
+
+    def handle_timeout(self):
+        # Discard any partial message the client stalled on.
+        if self.waiting_for_message:
+            self.server.timed_out_connections += 1
+
+        self.timeout_timer = None
+        self.close()
+
+    def close(self):
+        if self.timeout_timer is not None:
+            self.timeout_timer.cancel()
+            self.timeout_timer = None
+
+        self.server.loop.remove_reader(self.file_descriptor)
+        self.server.connections.pop(self.file_descriptor, None)
+
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+class IngestServer:
+    '''
+    Accepts client connections on the event loop and reads from all of them at once. Every complete message is decoded
+    and each resulting update is placed on the message queue, where the server applies it to the client manager.
+    '''
+    loop = None
+    message_queue = None
+    host = ''
+    port = 0
+    backlog = 0
+    read_timeout = 0
+    idle_timeout = 0
+    sock = None
+    connections = {}
+    accepted_connections = 0
+    received_messages = 0
+    received_updates = 0
+    rejected_messages = 0
+    timed_out_connections = 0
+    parse_latency = None
+
+    def __init__(self, loop, message_queue, host, port, read_timeout=10, backlog=128, idle_timeout=3600):
+        self.loop = loop
+        self.message_queue = message_queue
+        self.host = host
+        self.port = int(port)
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self.backlog = int(backlog)
+        self.connections = {}
+        self.accepted_connections = 0
+        self.received_messages = 0
+        self.received_updates = 0
+        self.rejected_messages = 0
+        self.timed_out_connections = 0
+        self.parse_latency = Histogram()
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(self.backlog)
+        self.sock.setblocking(0)
+        self.loop.add_reader(self.sock, self.handle_accept)
+
+    def handle_accept(self):
+        # Accept every pending connection, not just the first one.
+        while True:
+            try:
+                client_socket, address = self.sock.accept()
+            except socket.error as e:
+                if e.args[0] in WOULD_BLOCK_ERRORS or e.args[0] == errno.ECONNABORTED:
+                    return
+                raise
+
+            connection = IngestConnection(self, client_socket, address)
+            self.connections[connection.file_descriptor] = connection
+            self.accepted_connections += 1
+
+    def handle_updates(self, updates, decoder):
+        # Collect the count of messages the decoder has decoded, and the malformed text messages it skipped over.
+        self.received_messages += decoder.decoded_messages
+        self.rejected_messages += decoder.rejected_messages
+        self.received_updates += len(updates)
+        decoder.decoded_messages = 0
+        decoder.rejected_messages = 0
+
+        for update in updates:
+            self.message_queue.put(update)
+
+
+class DatagramServer:
+    '''
+    Receives progress reports sent as UDP datagrams, each holding a single frame (see Modules/Protocol.py). Datagrams
+    can be lost or arrive out of order, so the epoch and sequence number of the last accepted update for each assignment
+    are kept, and an update is thrown away if it arrives after a newer one for the same assignment. Updates for other
+    assignments, such as the rest of a report that was split across datagrams, are unaffected. A lost or discarded
+    update is made up for by the client's next report.
+
+    The sequence numbers of assignments that were removed or expired are swept out every SEQUENCE_PRUNE_INTERVAL
+    seconds, using is_tracked(client_name, exponent) to tell which ones the server still has.
+    '''
+    loop = None
+    message_queue = None
+    host = ''
+    port = 0
+    receive_buffer = 0
+    sock = None
+    sequences = {}
+    is_tracked = None
+    received_datagrams = 0
+    received_updates = 0
+    rejected_datagrams = 0
+    stale_updates = 0
+    parse_latency = None
+
+    def __init__(self, loop, message_queue, host, port, receive_buffer=1048576, is_tracked=None):
+        self.loop = loop
+        self.message_queue = message_queue
+        self.host = host
+        self.port = int(port)
+        self.receive_buffer = int(receive_buffer)
+        self.sequences = {}
+        self.is_tracked = is_tracked
+        self.received_datagrams = 0
+        self.received_updates = 0
+        self.rejected_datagrams = 0
+        self.stale_updates = 0
+        self.parse_latency = Histogram()
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        # A larger receive buffer rides out bursts between event loop iterations. The system may cap it.
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+        except socket.error:
+            pass
+
+        self.sock.bind((self.host, self.port))
+        self.sock.setblocking(0)
+        self.loop.add_reader(self.sock, self.handle_read)
+
+        if self.is_tracked is not None:
+            self.loop.call_later(SEQUENCE_PRUNE_INTERVAL, self.prune_sequences)
+
+    def prune_sequences(self):
+        # Forget the assignments that have gone, so the sequence numbers of every assignment ever seen aren't kept.
+        for key in [key for key in self.sequences if not self.is_tracked(*key)]:
+            del self.sequences[key]
+
+        self.loop.call_later(SEQUENCE_PRUNE_INTERVAL, self.prune_sequences)
+
+    def handle_read(self):
+        # Drain the socket until it would block.
+        for _ in range(0, MAXIMUM_DATAGRAMS_PER_READ):
+            try:
+                data = self.sock.recv(65535)
+            except socket.error as e:
+                if e.args[0] in WOULD_BLOCK_ERRORS:
+                    return
+                # Some platforms report an earlier send's ICMP error here. It doesn't affect anything we receive.
+                continue
+
+            self.handle_datagram(data)
+
+    def handle_datagram(self, data):
+        parse_start = time.time()
+
+        try:
+            epoch, sequence, updates = decode_datagram(data)
+        except ProtocolError:
+            self.rejected_datagrams += 1
+            return
+
+        self.received_datagrams += 1
+        self.parse_latency.observe(time.time() - parse_start)
+
+        # Sequence numbers start again when a client restarts, and its clock may have gone back since, so any change of
+        # epoch is accepted. A duplicated datagram is discarded as well, but not a later update for the same assignment
+        # in this datagram (such as its removal).
+        accepted_keys = set()
+        for update in updates:
+            key = (update[0], update[3])
+            last_epoch, last_sequence = self.sequences.get(key, (None, 0))
+
+            if epoch != last_epoch or sequence > last_sequence or key in accepted_keys:
+                self.sequences[key] = (epoch, sequence)
+                accepted_keys.add(key)
+                self.received_updates += 1
+                self.message_queue.put(update)
+            else:
+                self.stale_updates += 1
@@ -0,0 +1,164 @@
+'''
+Counters, gauges and histograms describing what the client and server are doing, exported in the Prometheus text
+format or as JSON.
+
+Recording is kept as cheap as possible, so it can stay on all the time: counters that a module already keeps as plain
+attributes (such as IngestServer.rejected_messages) are read through a function when the metrics are exported, and
+updating a histogram is a bisect and three additions. Updates from several threads aren't locked, so a count can
+occasionally be missed, which is an acceptable trade for metrics.
+'''
+
+import bisect
+import json
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from Modules.Snapshot import write_file_atomically
+
+# Upper bounds (in seconds) of the default histogram buckets, from 100us to 10s.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+# Upper bounds of the buckets for histograms of how many things were handled at once, such as updates per batch.
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 100000)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+class Counter:
+    value = 0
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get_value(self):
+        return self.value
+
+
+class Histogram:
+    buckets = ()
+    bucket_counts = []
+    count = 0
+    sum = 0.0
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # The extra bucket at the end counts observations above the largest bound.
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_value(self):
+        return {'count': self.count, 'sum': self.sum, 'buckets': dict(zip(self.buckets, self.bucket_counts))}
+
+
+class FunctionMetric:
+    # A counter or gauge whose value is read from a function when the metrics are exported.
+    function = None
+
+    def __init__(self, function):
+        self.function = function
+
+    def get_value(self):
+        return self.function()
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MetricsRegistry:
+    prefix = ''
+    metrics = []
+
+    def __init__(self, prefix='gimps_'):
+        self.prefix = prefix
+        self.metrics = []
+
+    def add(self, name, metric_type, description, metric):
+        self.metrics.append((self.prefix + name, metric_type, description, metric))
+        return metric
+
+    def add_counter(self, name, description, function=None):
+        # Returns a Counter to increment, or reads the count from the function if one is given.
+        return self.add(name, 'counter', description, Counter() if function is None else FunctionMetric(function))
+
+    def add_gauge(self, name, description, function):
+        return self.add(name, 'gauge', description, FunctionMetric(function))
+
+    def add_histogram(self, name, description, histogram=None):
+        return self.add(name, 'histogram', description, Histogram() if histogram is None else histogram)
+
+    def render_prometheus(self):
+        lines = []
+
+        for name, metric_type, description, metric in self.metrics:
+            lines.append('# HELP ' + name + ' ' + description)
+            lines.append('# TYPE ' + name + ' ' + metric_type)
+
+            if metric_type != 'histogram':
+                lines.append(name + ' ' + format_value(metric.get_value()))
+                continue
+
+            # Prometheus buckets are cumulative.
+            cumulative_count = 0
+            for bound, bucket_count in zip(metric.buckets, metric.bucket_counts):
+                cumulative_count += bucket_count
+                lines.append(name + '_bucket{le="' + format_value(bound) + '"} ' + str(cumulative_count))
+            lines.append(name + '_bucket{le="+Inf"} ' + str(metric.count))
+            lines.append(name + '_sum ' + format_value(metric.sum))
+            lines.append(name + '_count ' + str(metric.count))
+
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self):
+        return json.dumps({
+            'timestamp': time.time(),
+            'metrics': dict((name, metric.get_value()) for name, _, _, metric in self.metrics)
+        }, sort_keys=True)
+
+
+def write_metrics_file(registry, file_path):
+    # Dump the metrics as JSON, replacing the previous dump atomically.
+    write_file_atomically(file_path, registry.to_json() + '\n')
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render_prometheus()
+        self.send_response(200)
+        self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(registry, host, port):
+    '''
+    Serve /metrics from a background thread, for processes without an event loop of their own (such as the client).
+    '''
+    metrics_server = HTTPServer((host, int(port)), MetricsRequestHandler)
+    metrics_server.registry = registry
+
+    server_thread = threading.Thread(target=metrics_server.serve_forever, name='MetricsServer')
+    server_thread.daemon = True
+    server_thread.start()
+
+    return metrics_server
@@ -0,0 +1,382 @@
+'''
+Wire protocol between clients and the server.
+
+Binary Frame Format (all integers big endian)
+    FRAME_HEADER        magic (0xA7), version, flags, payload length
+    payload             SEQUENCE_HEADER (only when the frame has FLAG_SEQUENCE set), followed by one or more client
+                        blocks, each made up of
+        CLIENT_HEADER       name length, workers, update interval, record count
+        name                UTF-8 encoded client name
+        VIA_HEADER          via length (only when the frame has FLAG_VIA set)
+        via                 UTF-8 encoded names of the relays the client's reports came through, separated by " > "
+        ASSIGNMENT_RECORD   exponent, iterations (repeated record count times)
+
+Legacy Text Format
+    CLIENT_NAME|CLIENT_WORKERS|UPDATE_INTERVAL|ASSIGNMENT_EXPONENT|ASSIGNMENT_ITERATIONS[|ASSIGNMENT_EXPONENT|...]
+
+The magic byte can never start a text message, since it is not printable and is not a valid first byte of a UTF-8
+sequence, so the server tells the two formats apart by looking at the first byte of each message.
+
+Over UDP, each datagram holds a single frame with FLAG_SEQUENCE set. Its SEQUENCE_HEADER holds an epoch (the time the
+sender started) and a sequence number that goes up by one with each datagram, so the server can tell when a datagram
+has arrived after a newer one from the same client.
+
+Every decoded update is a (client_name, workers, update_interval, exponent, iterations, via) tuple, where via is empty
+for clients that reported directly.
+'''
+
+import struct
+
+FRAME_MAGIC = 0xA7
+PROTOCOL_VERSION = 1
+
+# Set on frames forwarded by a relay, whose client blocks carry the path they were relayed along.
+FLAG_VIA = 0x0001
+# Set on frames sent as UDP datagrams, whose payload starts with the sender's epoch and sequence number.
+FLAG_SEQUENCE = 0x0002
+SUPPORTED_FLAGS = FLAG_VIA | FLAG_SEQUENCE
+
+FRAME_HEADER = struct.Struct('!BBHI')
+CLIENT_HEADER = struct.Struct('!HHIH')
+VIA_HEADER = struct.Struct('!H')
+SEQUENCE_HEADER = struct.Struct('!II')
+ASSIGNMENT_RECORD = struct.Struct('!Iq')
+
+# Largest frame the server will accept.
+MAXIMUM_FRAME_SIZE = 1048576
+
+# Largest legacy text message the server will accept.
+MAXIMUM_TEXT_MESSAGE_SIZE = 65536
+
+# Largest datagram a client will send, small enough to avoid IP fragmentation on ordinary networks.
+MAXIMUM_DATAGRAM_SIZE = 1400
+
+# Separates relay names in a via path.
+VIA_SEPARATOR = ' > '
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def encode_text_message(client_name, number_of_workers, update_interval, assignments):
+    # Build a legacy text message. Batches sent over a persistent connection must be followed by a newline.
+    message = str(client_name) + "|" + str(number_of_workers) + "|" + str(update_interval)
+
+    for exponent, iterations in assignments:
+        message += "|" + str(exponent) + "|" + str(iterations)
+
+    return message
+
+
+def parse_text_message(message):
+    # Parse a legacy text message, returning one update per assignment it contains.
+    split_message = message.rstrip("\r\n").split("|")
+
+    if len(split_message) < 5 or len(split_message) % 2 != 1:
+        raise ProtocolError("Malformed client message: " + repr(message))
+
+    try:
+        # Retrieve values from client message.
+        client_name = decode_string(split_message[0])
+        client_number_of_workers = int(split_message[1])
+        client_update_interval = int(split_message[2])
+
+        updates = []
+        for i in range(3, len(split_message), 2):
+            client_assignment_exponent = int(split_message[i])
+            client_assignment_iterations = int(split_message[i + 1])
+            updates.append((client_name, client_number_of_workers, client_update_interval, client_assignment_exponent,
+                            client_assignment_iterations, ''))
+    except ValueError:
+        raise ProtocolError("Malformed client message: " + repr(message))
+
+    return updates
+
+
+def encode_string(string):
+    if isinstance(string, unicode):
+        return string.encode('utf-8')
+    return string
+
+
+def decode_string(data):
+    # Names are sent as UTF-8, and are decoded so they can be shown alongside everything else.
+    try:
+        return str(data).decode('utf-8')
+    except UnicodeDecodeError:
+        raise ProtocolError("Name isn't valid UTF-8: " + repr(str(data)))
+
+
+def encode_frame(clients, relayed=False, sequence=None):
+    '''
+    Build a binary frame. Clients is a list of (client_name, number_of_workers, update_interval, assignments) tuples,
+    where assignments is a list of (exponent, iterations) pairs. Relays set relayed, and add the via path of each
+    client to the end of its tuple. Datagrams are given an (epoch, sequence number) pair as their sequence.
+    '''
+    encoded_names = []
+    encoded_vias = []
+    payload_length = 0
+    flags = 0
+
+    if relayed:
+        flags |= FLAG_VIA
+    if sequence is not None:
+        flags |= FLAG_SEQUENCE
+        payload_length += SEQUENCE_HEADER.size
+
+    for client in clients:
+        client_name, assignments = encode_string(client[0]), client[3]
+        encoded_names.append(client_name)
+        payload_length += CLIENT_HEADER.size + len(client_name) + ASSIGNMENT_RECORD.size * len(assignments)
+
+        if relayed:
+            encoded_vias.append(encode_string(client[4]))
+            payload_length += VIA_HEADER.size + len(encoded_vias[-1])
+
+    frame = bytearray(FRAME_HEADER.size + payload_length)
+    FRAME_HEADER.pack_into(frame, 0, FRAME_MAGIC, PROTOCOL_VERSION, flags, payload_length)
+    offset = FRAME_HEADER.size
+
+    if sequence is not None:
+        SEQUENCE_HEADER.pack_into(frame, offset, *sequence)
+        offset += SEQUENCE_HEADER.size
+
+    for i in range(0, len(clients)):
+        client_name = encoded_names[i]
+        number_of_workers, update_interval, assignments = clients[i][1:4]
+
+        CLIENT_HEADER.pack_into(frame, offset, len(client_name), number_of_workers, update_interval, len(assignments))
+        offset += CLIENT_HEADER.size
+        frame[offset:offset + len(client_name)] = client_name
+        offset += len(client_name)
+
+        if relayed:
+            VIA_HEADER.pack_into(frame, offset, len(encoded_vias[i]))
+            offset += VIA_HEADER.size
+            frame[offset:offset + len(encoded_vias[i])] = encoded_vias[i]
+            offset += len(encoded_vias[i])
+
+        for exponent, iterations in assignments:
+            ASSIGNMENT_RECORD.pack_into(frame, offset, exponent, iterations)
+            offset += ASSIGNMENT_RECORD.size
+
+    return str(frame)
+
+
+def encode_datagrams(clients, epoch, first_sequence):
+    '''
+    Build the datagrams for a batch of clients (given the same way as for encode_frame), numbered from first_sequence.
+    Clients are packed into as few datagrams as possible, and a client with too many assignments for one datagram is
+    split across several.
+    '''
+    maximum_payload_length = MAXIMUM_DATAGRAM_SIZE - FRAME_HEADER.size - SEQUENCE_HEADER.size
+    batches = []
+    batch = []
+    available_length = maximum_payload_length
+
+    for client_name, number_of_workers, update_interval, assignments in clients:
+        block_header_length = CLIENT_HEADER.size + len(encode_string(client_name))
+        if block_header_length + ASSIGNMENT_RECORD.size > maximum_payload_length:
+            raise ProtocolError("Client name " + repr(client_name) + " is too long to send in a datagram.")
+
+        remaining_assignments = list(assignments)
+        while len(remaining_assignments) > 0:
+            if available_length < block_header_length + ASSIGNMENT_RECORD.size:
+                batches.append(batch)
+                batch = []
+                available_length = maximum_payload_length
+
+            record_count = min(len(remaining_assignments),
+                               (available_length - block_header_length) // ASSIGNMENT_RECORD.size)
+            batch.append((client_name, number_of_workers, update_interval, remaining_assignments[:record_count]))
+            remaining_assignments = remaining_assignments[record_count:]
+            available_length -= block_header_length + record_count * ASSIGNMENT_RECORD.size
+
+    if len(batch) > 0:
+        batches.append(batch)
+
+    return [encode_frame(batches[i], sequence=(epoch, (first_sequence + i) & 0xFFFFFFFF))
+            for i in range(0, len(batches))]
+
+
+def decode_datagram(data):
+    # Returns (epoch, sequence, updates) for a datagram. Raises ProtocolError if it isn't a single, complete frame.
+    if len(data) < FRAME_HEADER.size + SEQUENCE_HEADER.size:
+        raise ProtocolError("Datagram is too short.")
+
+    magic, version, flags, payload_length = FRAME_HEADER.unpack_from(data)
+
+    if magic != FRAME_MAGIC or version > PROTOCOL_VERSION or flags & ~SUPPORTED_FLAGS:
+        raise ProtocolError("Datagram isn't a supported frame.")
+    if not flags & FLAG_SEQUENCE:
+        raise ProtocolError("Datagram has no sequence number.")
+    if FRAME_HEADER.size + payload_length != len(data):
+        raise ProtocolError("Datagram length doesn't match its frame.")
+
+    epoch, sequence = SEQUENCE_HEADER.unpack_from(data, FRAME_HEADER.size)
+    return epoch, sequence, decode_frame_payload(data, FRAME_HEADER.size, len(data), flags)
+
+
+def decode_frame_payload(buffer, offset, end, flags=0):
+    # Decode the client blocks in buffer[offset:end] into a list of updates.
+    updates = []
+    via = ''
+
+    # Frames arriving over TCP are already in order, so their sequence numbers aren't needed.
+    if flags & FLAG_SEQUENCE:
+        if offset + SEQUENCE_HEADER.size > end:
+            raise ProtocolError("Truncated sequence header.")
+        offset += SEQUENCE_HEADER.size
+
+    while offset < end:
+        if offset + CLIENT_HEADER.size > end:
+            raise ProtocolError("Truncated client block.")
+
+        name_length, number_of_workers, update_interval, record_count = CLIENT_HEADER.unpack_from(buffer, offset)
+        offset += CLIENT_HEADER.size
+
+        if offset + name_length + record_count * ASSIGNMENT_RECORD.size > end:
+            raise ProtocolError("Truncated client block.")
+
+        client_name = decode_string(buffer[offset:offset + name_length])
+        offset += name_length
+
+        if flags & FLAG_VIA:
+            if offset + VIA_HEADER.size > end:
+                raise ProtocolError("Truncated client block.")
+
+            via_length, = VIA_HEADER.unpack_from(buffer, offset)
+            offset += VIA_HEADER.size
+
+            if offset + via_length + record_count * ASSIGNMENT_RECORD.size > end:
+                raise ProtocolError("Truncated client block.")
+
+            via = decode_string(buffer[offset:offset + via_length])
+            offset += via_length
+
+        for i in range(0, record_count):
+            exponent, iterations = ASSIGNMENT_RECORD.unpack_from(buffer, offset)
+            offset += ASSIGNMENT_RECORD.size
+            updates.append((client_name, number_of_workers, update_interval, exponent, iterations, via))
+
+    return updates
+
+
+class FrameDecoder:
+    '''
+    Incrementally decodes a stream of binary frames and legacy text messages. Received data is appended to a reusable
+    buffer, and fields are unpacked from it in place with precompiled structs. Messages split across several reads are
+    held until the rest arrives.
+    '''
+    buffer = None
+    offset = 0
+    decoded_messages = 0
+    rejected_messages = 0
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+        self.decoded_messages = 0
+        self.rejected_messages = 0
+
+    def has_partial_message(self):
+        return self.offset < len(self.buffer)
+
+    def feed(self, data):
+        self.buffer += data
+        updates = []
+
+        while self.offset < len(self.buffer):
+            if self.buffer[self.offset] == FRAME_MAGIC:
+                frame_updates = self.decode_frame()
+            else:
+                frame_updates = self.decode_text_line()
+
+            # The rest of the message hasn't arrived yet.
+            if frame_updates is None:
+                break
+
+            updates.extend(frame_updates)
+
+        self.compact()
+        return updates
+
+    def finish(self):
+        # The connection closed. Anything left over is a legacy message which is terminated by the close itself.
+        updates = []
+
+        if self.has_partial_message():
+            try:
+                if self.buffer[self.offset] == FRAME_MAGIC:
+                    raise ProtocolError("Connection closed part way through a frame.")
+                updates = parse_text_message(str(self.buffer[self.offset:]))
+                self.decoded_messages += 1
+            except ProtocolError:
+                self.rejected_messages += 1
+
+        self.buffer = bytearray()
+        self.offset = 0
+        return updates
+
+    def decode_frame(self):
+        if len(self.buffer) - self.offset < FRAME_HEADER.size:
+            return None
+
+        magic, version, flags, payload_length = FRAME_HEADER.unpack_from(self.buffer, self.offset)
+
+        # A bad header means we can no longer find frame boundaries, so the stream can't be recovered.
+        if version > PROTOCOL_VERSION or flags & ~SUPPORTED_FLAGS:
+            raise ProtocolError("Unsupported frame version " + str(version) + " with flags " + str(flags) + ".")
+        if payload_length > MAXIMUM_FRAME_SIZE:
+            raise ProtocolError("Frame of " + str(payload_length) + " bytes is too large.")
+
+        start = self.offset + FRAME_HEADER.size
+        end = start + payload_length
+
+        if len(self.buffer) < end:
+            return None
+
+        self.offset = end
+
+        # The frame's length is still known, so a bad payload (such as a name that isn't UTF-8) only loses that frame.
+        try:
+            updates = decode_frame_payload(self.buffer, start, end, flags)
+        except ProtocolError:
+            self.rejected_messages += 1
+            return []
+
+        self.decoded_messages += 1
+        return updates
+
+    def decode_text_line(self):
+        end = self.buffer.find('\n', self.offset)
+
+        if end == -1:
+            if len(self.buffer) - self.offset > MAXIMUM_TEXT_MESSAGE_SIZE:
+                raise ProtocolError("Text message is too large.")
+            return None
+
+        line = str(self.buffer[self.offset:end])
+        self.offset = end + 1
+
+        if line.strip() == '':
+            return []
+
+        try:
+            updates = parse_text_message(line)
+            self.decoded_messages += 1
+            return updates
+        except ProtocolError:
+            # Text lines are self delimiting, so a bad one can be skipped without losing the rest of the stream.
+            self.rejected_messages += 1
+            return []
+
+    def compact(self):
+        # Drop consumed bytes from the front of the buffer.
+        if self.offset == len(self.buffer):
+            del self.buffer[:]
+            self.offset = 0
+        elif self.offset > 65536:
+            del self.buffer[:self.offset]
+            self.offset = 0
@@ -0,0 +1,145 @@
+import ftplib
+import hashlib
+import io
+import posixpath
+import threading
+import time
+from Modules.Metrics import Histogram
+
+
+class FtpPublisher:
+    '''
+    Uploads the rendered table to an FTP server from a background thread, so a slow or unreachable FTP server never
+    holds up the event loop. The session is kept open between uploads and only reopened after an error. Tables that
+    are published while an upload is in progress replace each other, so only the latest is sent, and a table that
+    hasn't changed since the last successful upload isn't sent at all.
+
+    Each upload is stored under a temporary name and then renamed over the published file, so anyone downloading it
+    never sees a partial table. The FTP class is injectable so the publisher can be pointed at a stand-in server. Every
+    command has a timeout, so a server that stops responding counts as a failed upload rather than stalling the thread.
+    '''
+    host = ''
+    user = ''
+    password = ''
+    remote_path = ''
+    timeout = 0.0
+    ftp_factory = None
+    session = None
+    condition = None
+    pending_content = None
+    published_hash = None
+    worker_thread = None
+    running = False
+    uploads = 0
+    skipped_uploads = 0
+    failed_uploads = 0
+    last_error = None
+    upload_time = None
+
+    def __init__(self, host, user, password, path, file_name, timeout=30, ftp_factory=ftplib.FTP):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.remote_path = posixpath.join(path, posixpath.basename(file_name.replace('\\', '/')))
+        self.timeout = timeout
+        self.ftp_factory = ftp_factory
+        self.session = None
+        self.condition = threading.Condition()
+        self.pending_content = None
+        self.published_hash = None
+        self.worker_thread = None
+        self.running = False
+        self.uploads = 0
+        self.skipped_uploads = 0
+        self.failed_uploads = 0
+        self.last_error = None
+        self.upload_time = Histogram()
+
+    def start(self):
+        self.running = True
+        self.worker_thread = threading.Thread(target=self.publish_pending, name='FtpPublisher')
+        self.worker_thread.daemon = True
+        self.worker_thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        if self.worker_thread is not None:
+            self.worker_thread.join()
+            self.worker_thread = None
+
+        self.close_session()
+
+    def publish(self, content):
+        # Queue content for upload, replacing anything that hasn't been uploaded yet.
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+
+        with self.condition:
+            self.pending_content = content
+            self.condition.notify()
+
+    def publish_pending(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending_content is None:
+                    self.condition.wait()
+
+                if not self.running:
+                    return
+
+                content = self.pending_content
+                self.pending_content = None
+
+            self.upload(content)
+
+    def upload(self, content):
+        content_hash = hashlib.sha1(content).digest()
+
+        if content_hash == self.published_hash:
+            self.skipped_uploads += 1
+            return
+
+        # If the open session has gone stale, reconnect and try once more.
+        upload_start = time.time()
+        for attempt in range(0, 2):
+            try:
+                self.store(content)
+                self.upload_time.observe(time.time() - upload_start)
+                self.published_hash = content_hash
+                self.uploads += 1
+                self.last_error = None
+                return
+            except (ftplib.all_errors + (AttributeError,)) as e:
+                # ftplib raises AttributeError when the server drops the connection part way through a command.
+                self.last_error = e
+                self.close_session()
+
+        self.failed_uploads += 1
+
+    def store(self, content):
+        if self.session is None:
+            self.session = self.ftp_factory(self.host, self.user, self.password, timeout=self.timeout)
+
+        temporary_path = self.remote_path + '.tmp'
+        self.session.storbinary('STOR ' + temporary_path, io.BytesIO(content))
+
+        try:
+            self.session.rename(temporary_path, self.remote_path)
+        except ftplib.error_perm:
+            # Some servers won't rename over an existing file.
+            self.session.delete(self.remote_path)
+            self.session.rename(temporary_path, self.remote_path)
+
+    def close_session(self):
+        if self.session is None:
+            return
+
+        try:
+            self.session.quit()
+        except (ftplib.all_errors + (AttributeError,)):
+            self.session.close()
+
+        self.session = None
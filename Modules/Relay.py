@@ -0,0 +1,140 @@
+'''
+Relay mode, for fanning in the clients at a site over a single connection.
+
+A relay is a server that also forwards everything its clients report to an upstream server, which can itself be a
+relay. Updates are merged so only the latest one for each assignment is kept, and are sent upstream once every forward
+interval over a single persistent connection. Each client is tagged with the path of relays its reports came through,
+which the central server shows next to the client's name.
+'''
+
+import threading
+from collections import OrderedDict
+from Modules import Protocol
+
+
+def extend_via(via, relay_name):
+    # The path reads from the client towards the central server.
+    if via == '':
+        return relay_name
+
+    return via + Protocol.VIA_SEPARATOR + relay_name
+
+
+def encode_batch(pending):
+    '''
+    Encode the pending updates, keyed by (client_name, exponent), as one or more relayed frames. Updates are grouped
+    into a block per client, and blocks are split across frames so none is larger than the upstream server accepts.
+    '''
+    clients = OrderedDict()
+    for (client_name, exponent), (number_of_workers, update_interval, iterations, via) in pending.items():
+        clients.setdefault((client_name, number_of_workers, update_interval, via), []).append((exponent, iterations))
+
+    frames = []
+    frame_clients = []
+    frame_size = 0
+
+    for (client_name, number_of_workers, update_interval, via), assignments in clients.items():
+        # Names are measured once encoded, since non-ASCII names take more bytes than characters.
+        name_size = len(Protocol.encode_string(client_name)) + len(Protocol.encode_string(via))
+        block_size = (Protocol.CLIENT_HEADER.size + Protocol.VIA_HEADER.size + name_size +
+                      Protocol.ASSIGNMENT_RECORD.size * len(assignments))
+
+        if len(frame_clients) > 0 and frame_size + block_size > Protocol.MAXIMUM_FRAME_SIZE:
+            frames.append(Protocol.encode_frame(frame_clients, True))
+            frame_clients = []
+            frame_size = 0
+
+        frame_clients.append((client_name, number_of_workers, update_interval, assignments, via))
+        frame_size += block_size
+
+    if len(frame_clients) > 0:
+        frames.append(Protocol.encode_frame(frame_clients, True))
+
+    return ''.join(frames)
+
+
+class RelayForwarder:
+    '''
+    Collects updates on the event loop thread and forwards them upstream from a background thread, so a slow or
+    unreachable upstream server never holds up the relay. If a batch can't be sent, its updates are merged back in
+    with anything newer and sent with the next one.
+    '''
+    relay_name = ''
+    connection = None
+    forward_interval = 0.0
+    condition = None
+    pending = None
+    worker_thread = None
+    running = False
+    forwarded_updates = 0
+    forwarded_batches = 0
+    failed_batches = 0
+
+    def __init__(self, relay_name, connection, forward_interval=10):
+        self.relay_name = relay_name
+        self.connection = connection
+        self.forward_interval = float(forward_interval)
+        self.condition = threading.Condition()
+        self.pending = OrderedDict()
+        self.worker_thread = None
+        self.running = False
+        self.forwarded_updates = 0
+        self.forwarded_batches = 0
+        self.failed_batches = 0
+
+    def start(self):
+        self.running = True
+        self.worker_thread = threading.Thread(target=self.forward_pending, name='RelayForwarder')
+        self.worker_thread.daemon = True
+        self.worker_thread.start()
+
+    def stop(self):
+        # Forward whatever is still pending, then stop.
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        if self.worker_thread is not None:
+            self.worker_thread.join()
+            self.worker_thread = None
+
+        self.connection.close()
+
+    def add(self, client_name, number_of_workers, update_interval, exponent, iterations, via=''):
+        # Replaces any update for the same assignment that hasn't been forwarded yet.
+        key = (client_name, exponent)
+        via = extend_via(via, self.relay_name)
+
+        with self.condition:
+            self.pending.pop(key, None)
+            self.pending[key] = (number_of_workers, update_interval, iterations, via)
+
+    def forward_pending(self):
+        while True:
+            with self.condition:
+                if self.running:
+                    self.condition.wait(self.forward_interval)
+
+                pending = self.pending
+                self.pending = OrderedDict()
+                running = self.running
+
+            if len(pending) > 0:
+                self.forward(pending)
+
+            if not running:
+                return
+
+    def forward(self, pending):
+        if self.connection.send(encode_batch(pending)):
+            self.forwarded_updates += len(pending)
+            self.forwarded_batches += 1
+            return
+
+        # Keep the updates for the next batch, unless a newer one for the same assignment has arrived since.
+        self.failed_batches += 1
+
+        with self.condition:
+            for key, update in pending.items():
+                if key not in self.pending:
+                    self.pending[key] = update
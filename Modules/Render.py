@@ -0,0 +1,126 @@
+import ctypes
+import platform
+import sys
+import time
+
+# ANSI escape sequence that clears the screen and moves the cursor to the top left corner.
+CLEAR_SCREEN = '\033[2J\033[H'
+
+
+def enable_escape_sequences():
+    '''
+    Windows consoles only understand ANSI escape sequences once virtual terminal processing has been switched on for
+    the standard output handle. Other platforms support them already.
+    '''
+    if platform.system() != 'Windows':
+        return
+
+    try:
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-11)
+        mode = ctypes.c_ulong()
+
+        if kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+            kernel32.SetConsoleMode(handle, mode.value | 0x0004)
+    except (AttributeError, OSError):
+        pass
+
+
+def write_screen(text, clear=True, stream=sys.stdout):
+    # Clear the console and write the text in a single write, so the screen is never shown half drawn.
+    if clear:
+        stream.write(CLEAR_SCREEN + text + '\n')
+    else:
+        stream.write(text + '\n')
+
+    stream.flush()
+
+
+class RenderScheduler:
+    '''
+    Coalesces redraw requests. Callers mark the display as dirty whenever state changes, and the render callback is
+    run on the event loop at most max_refresh_rate times per second, no matter how many updates arrive in between.
+    '''
+    loop = None
+    render_callback = None
+    minimum_interval = 0.0
+    dirty = False
+    timer = None
+    last_render = 0.0
+
+    def __init__(self, loop, render_callback, max_refresh_rate=1.0):
+        self.loop = loop
+        self.render_callback = render_callback
+        self.dirty = False
+        self.timer = None
+        self.last_render = 0.0
+
+        if max_refresh_rate > 0:
+            self.minimum_interval = 1.0 / max_refresh_rate
+        else:
+            self.minimum_interval = 0.0
+
+    def mark_dirty(self):
+        self.dirty = True
+
+        # A redraw is already on its way, it will pick this change up too.
+        if self.timer is not None:
+            return
+
+        render_time = max(self.loop.clock(), self.last_render + self.minimum_interval)
+        self.timer = self.loop.call_at(render_time, self.render)
+
+    def render(self):
+        self.timer = None
+
+        if not self.dirty:
+            return
+
+        self.dirty = False
+        self.last_render = self.loop.clock()
+        self.render_callback()
+
+
+def get_timezone_key():
+    # Formatted dates depend on the local timezone, so cached rows have to be rebuilt if it is changed.
+    return time.timezone, time.altzone, time.daylight, time.tzname
+
+
+class RowCache:
+    '''
+    Caches the formatted table row for each assignment, along with the assignment's version counter. A row is only
+    formatted again when its assignment has changed since it was last drawn, so a redraw after a single update formats
+    a single row. Rows for assignments that are no longer drawn are dropped.
+    '''
+    format_row = None
+    rows = {}
+    timezone_key = None
+    rows_formatted = 0
+
+    def __init__(self, format_row):
+        self.format_row = format_row
+        self.rows = {}
+        self.timezone_key = get_timezone_key()
+        self.rows_formatted = 0
+
+    def get_rows(self, assignments):
+        timezone_key = get_timezone_key()
+        if timezone_key != self.timezone_key:
+            self.timezone_key = timezone_key
+            self.rows = {}
+
+        rows = {}
+        table_data = []
+
+        for assignment in assignments:
+            cached_row = self.rows.get(assignment)
+
+            if cached_row is None or cached_row[0] != assignment.version:
+                cached_row = (assignment.version, self.format_row(assignment))
+                self.rows_formatted += 1
+
+            rows[assignment] = cached_row
+            table_data.append(cached_row[1])
+
+        self.rows = rows
+        return table_data
@@ -0,0 +1,160 @@
+'''
+Reads the header at the start of prime95 LL and PRP save files.
+
+Header Format (all integers little endian)
+    0   magic               identifies the work type
+    4   version             save file format version
+    8   k                   the number being tested is k * b^n + c
+    16  b
+    20  n                   the exponent
+    24  c
+    28  stage               NUL padded string, such as "LL" or "PRP"
+    40  pct_complete        fraction of the work done when the file was written
+    48  checksum            checksum of the data following the header
+    52  error_count
+    56  counter             iterations completed
+
+Double checks are written with the same magic number as first time LL tests, so the two can't be told apart from the
+save file alone.
+'''
+
+import errno
+import io
+import os
+import stat
+import struct
+import threading
+
+LL_MAGIC = 0x2c7330a8
+PRP_MAGIC = 0x87f2a91b
+
+WORK_TYPES = {
+    LL_MAGIC: 'LL',
+    PRP_MAGIC: 'PRP',
+}
+
+SAVE_FILE_HEADER = struct.Struct('<LLdLLl11sxdLLL')
+
+
+class SaveFileError(IOError):
+    pass
+
+
+class IncompleteSaveFileError(SaveFileError):
+    '''
+    The file is shorter than a header, or changed while it was being read. prime95 is most likely still writing it, so
+    it is worth trying again later.
+    '''
+    pass
+
+
+class SaveFileHeader:
+    file_path = ''
+    magic = 0
+    work_type = ''
+    version = 0
+    k = 0.0
+    b = 0
+    n = 0
+    c = 0
+    stage = ''
+    pct_complete = 0.0
+    checksum = 0
+    error_count = 0
+    counter = 0
+    stat_result = None
+
+    def __init__(self, file_path, fields, stat_result):
+        self.file_path = file_path
+        (self.magic, self.version, self.k, self.b, self.n, self.c, stage, self.pct_complete, self.checksum,
+         self.error_count, self.counter) = fields
+        self.work_type = WORK_TYPES[self.magic]
+        self.stage = stage.rstrip('\0')
+        self.stat_result = stat_result
+
+    def get_exponent(self):
+        return self.n
+
+    def get_iterations(self):
+        return self.counter
+
+
+class SaveFileParser:
+    '''
+    Parses save file headers into a buffer that is allocated once and reused for every file, unpacking the fields in
+    place with a precompiled struct. A parser isn't thread safe, use get_parser() to get one for the current thread.
+    '''
+    buffer = None
+
+    def __init__(self):
+        self.buffer = bytearray(SAVE_FILE_HEADER.size)
+
+    def read_header(self, file_path):
+        with io.open(file_path, 'rb', buffering=0) as data_file:
+            stat_before = os.fstat(data_file.fileno())
+
+            if not stat.S_ISREG(stat_before.st_mode):
+                raise IOError(errno.ENOENT, file_path + " does not exist.")
+
+            bytes_read = data_file.readinto(self.buffer)
+            stat_after = os.fstat(data_file.fileno())
+
+        if bytes_read < SAVE_FILE_HEADER.size:
+            raise IncompleteSaveFileError(errno.EAGAIN, file_path + " is too short to be a save file.")
+
+        if stat_before.st_size != stat_after.st_size or stat_before.st_mtime != stat_after.st_mtime:
+            raise IncompleteSaveFileError(errno.EAGAIN, file_path + " changed while it was being read.")
+
+        fields = SAVE_FILE_HEADER.unpack_from(self.buffer)
+
+        if fields[0] not in WORK_TYPES:
+            raise SaveFileError(errno.EINVAL, file_path + " is not an LL or PRP save file.")
+
+        return SaveFileHeader(file_path, fields, stat_after)
+
+    def read_headers(self, file_paths):
+        '''
+        Parse a batch of save files with the one buffer. Returns a (file_path, header, error) tuple for each file, where
+        exactly one of header and error is set.
+        '''
+        results = []
+
+        for file_path in file_paths:
+            try:
+                results.append((file_path, self.read_header(file_path), None))
+            except (IOError, OSError) as e:
+                results.append((file_path, None, e))
+
+        return results
+
+    def read_directory(self, directory, prefix='p'):
+        # Parse every save file in a prime95 working directory in a single pass.
+        file_paths = [os.path.join(directory, file_name) for file_name in os.listdir(directory)
+                      if file_name.startswith(prefix) and '.' not in file_name]
+
+        return self.read_headers(file_paths)
+
+
+THREAD_PARSERS = threading.local()
+
+
+def get_parser():
+    parser = getattr(THREAD_PARSERS, 'parser', None)
+
+    if parser is None:
+        parser = SaveFileParser()
+        THREAD_PARSERS.parser = parser
+
+    return parser
+
+
+def read_header(file_path):
+    return get_parser().read_header(file_path)
+
+
+def read_headers(file_paths):
+    return get_parser().read_headers(file_paths)
+
+
+def read_directory(directory, prefix='p'):
+    return get_parser().read_directory(directory, prefix)
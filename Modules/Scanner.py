@@ -0,0 +1,115 @@
+import os
+
+# os.scandir only exists on Python 3.5+, the scandir package provides it for older versions. Without either, fall back
+# to listing the directory and calling stat on each file.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+def get_file_signature(stat_result):
+    # A file whose modification time, size and inode are unchanged hasn't been written since we last read it.
+    return stat_result.st_mtime, stat_result.st_size, stat_result.st_ino
+
+
+class DirectoryScanner:
+    '''
+    Scans a prime95 working directory for save files. The scanner remembers the signature of every file it has been
+    told about, so a scan only reports files that are new, changed or gone, and the caller only has to open those. The
+    stat results gathered while scanning are handed back so the caller doesn't need to stat the files again.
+
+    Files the caller couldn't use (such as ones that aren't LL save files) are remembered as rejected, and are only
+    reported as new again once they have changed.
+    '''
+    directory = ''
+    prefix = ''
+    known_files = {}
+    rejected_files = {}
+
+    def __init__(self, directory, prefix='p'):
+        self.directory = directory
+        self.prefix = prefix
+        self.known_files = {}
+        self.rejected_files = {}
+
+    def get_path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def is_assignment_file_name(self, file_name):
+        return file_name.startswith(self.prefix) and '.' not in file_name
+
+    def list_files(self):
+        # Yield a (path, stat_result) pair for every save file in the directory.
+        if scandir is not None:
+            for entry in scandir(self.directory):
+                if not self.is_assignment_file_name(entry.name):
+                    continue
+
+                try:
+                    if entry.is_file():
+                        yield entry.path, entry.stat()
+                except OSError:
+                    # The file was removed while we were scanning.
+                    continue
+        else:
+            for file_name in os.listdir(self.directory):
+                if not self.is_assignment_file_name(file_name):
+                    continue
+
+                file_path = self.get_path(file_name)
+                try:
+                    yield file_path, os.stat(file_path)
+                except OSError:
+                    continue
+
+    def scan(self):
+        '''
+        Returns three lists: (path, stat_result) pairs for files that are new, (path, stat_result) pairs for known files
+        that have changed, and the paths of known files that no longer exist.
+        '''
+        new_files = []
+        changed_files = []
+        seen_files = set()
+
+        for file_path, stat_result in self.list_files():
+            seen_files.add(file_path)
+            signature = self.known_files.get(file_path)
+
+            if signature is None:
+                if not self.is_rejected(file_path, stat_result):
+                    new_files.append((file_path, stat_result))
+            elif signature != get_file_signature(stat_result):
+                changed_files.append((file_path, stat_result))
+
+        removed_files = [file_path for file_path in self.known_files if file_path not in seen_files]
+
+        # Rejected files that are gone don't need to be reported, only forgotten.
+        for file_path in [file_path for file_path in self.rejected_files if file_path not in seen_files]:
+            del self.rejected_files[file_path]
+
+        return new_files, changed_files, removed_files
+
+    def check_file(self, file_path):
+        '''
+        Stat a single file and return (changed, stat_result). Raises OSError if the file no longer exists.
+        '''
+        stat_result = os.stat(file_path)
+        return self.known_files.get(file_path) != get_file_signature(stat_result), stat_result
+
+    def is_rejected(self, file_path, stat_result):
+        return self.rejected_files.get(file_path) == get_file_signature(stat_result)
+
+    def remember(self, file_path, stat_result):
+        self.known_files[file_path] = get_file_signature(stat_result)
+        self.rejected_files.pop(file_path, None)
+
+    def reject(self, file_path, stat_result):
+        # The stat must be from before the file was read, so a file written since is tried again.
+        self.rejected_files[file_path] = get_file_signature(stat_result)
+
+    def forget(self, file_path):
+        self.known_files.pop(file_path, None)
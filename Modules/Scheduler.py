@@ -0,0 +1,110 @@
+import heapq
+import time
+from Modules.Metrics import Histogram
+
+
+class AssignmentScheduler:
+    '''
+    Priority queue of jobs keyed on the time they are next due. Rescheduling a job leaves its old heap entry in place
+    and marks it stale, so every operation stays O(log n). Jobs that find nothing new can be deferred with an
+    exponential backoff, which is reset once they see a change again.
+
+    The clock is injectable so the scheduler can be driven by a fake clock in tests.
+    '''
+    clock = None
+    minimum_backoff = 0
+    heap = []
+    entries = {}
+    backoff_attempts = {}
+    sequence = 0
+    lateness = None
+
+    def __init__(self, clock=time.time, minimum_backoff=30):
+        self.clock = clock
+        self.minimum_backoff = minimum_backoff
+        self.heap = []
+        self.entries = {}
+        self.backoff_attempts = {}
+        self.sequence = 0
+        # How long after their due time jobs are actually handed out.
+        self.lateness = Histogram()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def schedule(self, key, due):
+        self.cancel(key)
+
+        self.sequence += 1
+        entry = [due, self.sequence, key, True]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+
+    def schedule_in(self, key, delay):
+        self.schedule(key, self.clock() + delay)
+
+    def schedule_no_later_than(self, key, delay):
+        # Bring a job forward if it is due later than the given delay, but never push it back.
+        due = self.clock() + delay
+        entry = self.entries.get(key)
+
+        if entry is None or entry[0] > due:
+            self.schedule(key, due)
+
+    def get_due_time(self, key):
+        entry = self.entries.get(key)
+        return None if entry is None else entry[0]
+
+    def cancel(self, key):
+        entry = self.entries.pop(key, None)
+
+        if entry is not None:
+            entry[3] = False
+
+    def forget(self, key):
+        # Cancel the job and drop its backoff state.
+        self.cancel(key)
+        self.backoff_attempts.pop(key, None)
+
+    def defer(self, key, maximum_delay):
+        # Try the job again later, waiting twice as long as last time (up to maximum_delay).
+        attempts = self.backoff_attempts.get(key, 0)
+        self.backoff_attempts[key] = attempts + 1
+        self.schedule_in(key, min(self.minimum_backoff * (2 ** attempts), maximum_delay))
+
+    def reset_backoff(self, key):
+        self.backoff_attempts.pop(key, None)
+
+    def discard_stale_entries(self):
+        while len(self.heap) > 0 and not self.heap[0][3]:
+            heapq.heappop(self.heap)
+
+    def time_until_next(self):
+        # Seconds until the next job is due, or None when nothing is scheduled.
+        self.discard_stale_entries()
+
+        if len(self.heap) == 0:
+            return None
+
+        return max(0.0, self.heap[0][0] - self.clock())
+
+    def pop_due(self):
+        # Remove and return every job that is due, in the order they became due.
+        now = self.clock()
+        due_keys = []
+
+        self.discard_stale_entries()
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+
+            if entry[3]:
+                del self.entries[entry[2]]
+                due_keys.append(entry[2])
+                self.lateness.observe(now - entry[0])
+
+            self.discard_stale_entries()
+
+        return due_keys
@@ -0,0 +1,157 @@
+'''
+Snapshots of the server's client and assignment state, so a restarted server can show every assignment straight away
+instead of waiting for each client to report again.
+
+Snapshot File Format (all integers big endian)
+    SNAPSHOT_HEADER     magic ("GMSS"), version, time the snapshot was taken, payload length, CRC-32 of the payload
+    payload             zlib compressed marshal of the ClientManager state
+'''
+
+import marshal
+import os
+import struct
+import threading
+import time
+import zlib
+
+SNAPSHOT_MAGIC = 'GMSS'
+SNAPSHOT_VERSION = 3
+
+SNAPSHOT_HEADER = struct.Struct('!4sHdIi')
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def encode_snapshot(state, snapshot_time):
+    payload = zlib.compress(marshal.dumps(state))
+    return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, snapshot_time, len(payload),
+                                zlib.crc32(payload)) + payload
+
+
+def decode_snapshot(data):
+    # Returns (state, snapshot_time). Raises SnapshotError if the snapshot is damaged or from a newer version.
+    if len(data) < SNAPSHOT_HEADER.size:
+        raise SnapshotError("Snapshot is truncated.")
+
+    magic, version, snapshot_time, payload_length, checksum = SNAPSHOT_HEADER.unpack_from(data)
+    payload = data[SNAPSHOT_HEADER.size:]
+
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError("Not a snapshot file.")
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError("Unsupported snapshot version " + str(version) + ".")
+    if len(payload) != payload_length or zlib.crc32(payload) != checksum:
+        raise SnapshotError("Snapshot is damaged.")
+
+    try:
+        return marshal.loads(zlib.decompress(payload)), snapshot_time
+    except (ValueError, EOFError, TypeError, zlib.error):
+        raise SnapshotError("Snapshot is damaged.")
+
+
+def write_file_atomically(file_path, data):
+    # Write to a temporary file and rename it into place, so a crash never leaves a half written snapshot behind.
+    temporary_path = file_path + '.tmp'
+
+    with open(temporary_path, 'wb') as fp:
+        fp.write(data)
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    try:
+        os.rename(temporary_path, file_path)
+    except OSError:
+        # Windows won't rename over an existing file.
+        os.remove(file_path)
+        os.rename(temporary_path, file_path)
+
+
+def load_snapshot(file_path):
+    # Returns (state, snapshot_time), or (None, 0) if there is no usable snapshot.
+    try:
+        with open(file_path, 'rb') as fp:
+            data = fp.read()
+    except IOError:
+        return None, 0
+
+    try:
+        return decode_snapshot(data)
+    except SnapshotError:
+        return None, 0
+
+
+class SnapshotWriter:
+    '''
+    Writes snapshots on a background thread. The state is captured on the caller's thread, since that is the only one
+    allowed to touch the client manager, but encoding and writing it happen elsewhere. If snapshots are requested
+    faster than they can be written, only the latest one is kept.
+    '''
+    file_path = ''
+    condition = None
+    pending_snapshot = None
+    writer_thread = None
+    running = False
+    snapshots_written = 0
+    failed_snapshots = 0
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.condition = threading.Condition()
+        self.pending_snapshot = None
+        self.writer_thread = None
+        self.running = False
+        self.snapshots_written = 0
+        self.failed_snapshots = 0
+
+    def start(self):
+        self.running = True
+        self.writer_thread = threading.Thread(target=self.write_snapshots, name='SnapshotWriter')
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+
+    def save(self, state, snapshot_time=None):
+        if snapshot_time is None:
+            snapshot_time = time.time()
+
+        with self.condition:
+            self.pending_snapshot = (state, snapshot_time)
+            self.condition.notify()
+
+    def save_now(self, state, snapshot_time=None):
+        # Write a snapshot on the calling thread, such as when the server is shutting down.
+        if snapshot_time is None:
+            snapshot_time = time.time()
+
+        self.write_snapshot(state, snapshot_time)
+
+    def write_snapshot(self, state, snapshot_time):
+        try:
+            write_file_atomically(self.file_path, encode_snapshot(state, snapshot_time))
+            self.snapshots_written += 1
+        except (IOError, OSError, ValueError):
+            self.failed_snapshots += 1
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        if self.writer_thread is not None:
+            self.writer_thread.join()
+            self.writer_thread = None
+
+    def write_snapshots(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending_snapshot is None:
+                    self.condition.wait()
+
+                if not self.running:
+                    return
+
+                state, snapshot_time = self.pending_snapshot
+                self.pending_snapshot = None
+
+            self.write_snapshot(state, snapshot_time)
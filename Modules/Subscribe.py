@@ -0,0 +1,217 @@
+'''
+Live subscription stream for dashboards.
+
+Every message is a single line of JSON. A new subscriber is first sent the full state
+    {"type": "snapshot", "assignments": [ASSIGNMENT, ...]}
+followed by a message for each assignment as it changes
+    {"type": "update", "assignment": ASSIGNMENT}
+    {"type": "remove", "client": CLIENT_NAME, "exponent": EXPONENT}
+
+A subscriber that falls behind has its pending messages thrown away and is sent a fresh snapshot once it has caught
+up, since that is smaller than the deltas it missed. One that keeps falling behind is disconnected.
+'''
+
+import errno
+import json
+import socket
+from Modules.Ingest import WOULD_BLOCK_ERRORS
+
+
+def encode_update(assignment_json):
+    return '{"type": "update", "assignment": ' + assignment_json + '}\n'
+
+
+def encode_removal(client_name, exponent):
+    return json.dumps({'type': 'remove', 'client': client_name, 'exponent': exponent}, sort_keys=True) + '\n'
+
+
+def encode_snapshot(assignment_json_rows):
+    return '{"type": "snapshot", "assignments": [' + ', '.join(assignment_json_rows) + ']}\n'
+
+
+class Subscriber:
+    server = None
+    sock = None
+    file_descriptor = -1
+    pending = []
+    pending_size = 0
+    buffer_limit = 0
+    writing = False
+    needs_snapshot = False
+    resyncs = 0
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.pending = []
+        self.pending_size = 0
+        self.buffer_limit = 0
+        self.writing = False
+        self.needs_snapshot = False
+        self.resyncs = 0
+
+        self.sock.setblocking(0)
+        self.file_descriptor = server.loop.add_reader(sock, self.handle_read)
+        server.subscribers[self.file_descriptor] = self
+        self.send_snapshot()
+
+    def handle_read(self):
+        # Subscribers have nothing to say, so anything they send is discarded. We only need to notice them leaving.
+        try:
+            data = self.sock.recv(4096)
+        except socket.error as e:
+            if e.args[0] in WOULD_BLOCK_ERRORS:
+                return
+            self.close()
+            return
+
+        if not data:
+            self.close()
+
+    def send_snapshot(self):
+        # The snapshot can be as large as it needs to be, the buffer limit only applies to the deltas queued after it.
+        self.queue(self.server.get_snapshot())
+        self.buffer_limit = self.pending_size + self.server.maximum_buffer
+
+    def send(self, message):
+        # Messages are dropped while waiting to resync, the snapshot will include them.
+        if self.needs_snapshot:
+            return
+
+        if self.pending_size + len(message) > self.buffer_limit:
+            self.fall_behind()
+            return
+
+        self.queue(message)
+
+    def queue(self, message):
+        self.pending.append(message)
+        self.pending_size += len(message)
+
+        if not self.writing:
+            self.handle_write()
+
+    def fall_behind(self):
+        self.resyncs += 1
+        self.server.resynced_subscribers += 1
+
+        if self.resyncs > self.server.maximum_resyncs:
+            self.server.dropped_subscribers += 1
+            self.close()
+            return
+
+        # Throw away what hasn't been started on yet. A message that has been partly sent has to be finished, or the
+        # subscriber would see half a line.
+        if self.writing:
+            del self.pending[1:]
+            self.pending_size = len(self.pending[0])
+        else:
+            self.pending = []
+            self.pending_size = 0
+
+        self.needs_snapshot = True
+
+    def handle_write(self):
+        while len(self.pending) > 0:
+            try:
+                sent = self.sock.send(self.pending[0])
+            except socket.error as e:
+                if e.args[0] in WOULD_BLOCK_ERRORS:
+                    sent = 0
+                else:
+                    self.close()
+                    return
+
+            self.pending_size -= sent
+
+            if sent < len(self.pending[0]):
+                # The socket is full, so wait until it is writable again.
+                self.pending[0] = self.pending[0][sent:]
+
+                if not self.writing:
+                    self.writing = True
+                    self.server.loop.add_writer(self.sock, self.handle_write)
+                return
+
+            self.pending.pop(0)
+
+        if self.writing:
+            self.writing = False
+            self.server.loop.remove_writer(self.file_descriptor)
+
+        self.buffer_limit = self.server.maximum_buffer
+
+        # Caught up after falling behind, so bring the subscriber back up to date.
+        if self.needs_snapshot:
+            self.needs_snapshot = False
+            self.send_snapshot()
+        else:
+            self.resyncs = 0
+
+    def close(self):
+        self.server.loop.remove_reader(self.file_descriptor)
+        self.server.loop.remove_writer(self.file_descriptor)
+        self.server.subscribers.pop(self.file_descriptor, None)
+        self.pending = []
+        self.pending_size = 0
+
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+class SubscriptionServer:
+    '''
+    Accepts subscribers on the event loop and broadcasts messages to them. Each subscriber has its own bounded buffer,
+    so a slow one is resynced or dropped instead of holding up the server.
+    '''
+    loop = None
+    get_snapshot = None
+    host = ''
+    port = 0
+    backlog = 0
+    maximum_buffer = 0
+    maximum_resyncs = 0
+    sock = None
+    subscribers = {}
+    resynced_subscribers = 0
+    dropped_subscribers = 0
+
+    def __init__(self, loop, get_snapshot, host, port, backlog=128, maximum_buffer=262144, maximum_resyncs=3):
+        self.loop = loop
+        self.get_snapshot = get_snapshot
+        self.host = host
+        self.port = int(port)
+        self.backlog = int(backlog)
+        self.maximum_buffer = int(maximum_buffer)
+        self.maximum_resyncs = int(maximum_resyncs)
+        self.subscribers = {}
+        self.resynced_subscribers = 0
+        self.dropped_subscribers = 0
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(self.backlog)
+        self.sock.setblocking(0)
+        self.loop.add_reader(self.sock, self.handle_accept)
+
+    def has_subscribers(self):
+        return len(self.subscribers) > 0
+
+    def handle_accept(self):
+        while True:
+            try:
+                client_socket, _ = self.sock.accept()
+            except socket.error as e:
+                if e.args[0] in WOULD_BLOCK_ERRORS or e.args[0] == errno.ECONNABORTED:
+                    return
+                raise
+
+            Subscriber(self, client_socket)
+
+    def broadcast(self, message):
+        for subscriber in self.subscribers.values():
+            subscriber.send(message)
@@ -0,0 +1,151 @@
+import select
+import socket
+import time
+from Modules import Protocol
+
+
+class ServerConnection:
+    '''
+    A long lived connection to the server. The connection is opened on first use, checked before each send, and
+    re-established automatically if the server closed it or the send failed.
+    '''
+    host = ''
+    port = 0
+    timeout = 0
+    sock = None
+    messages_sent = 0
+    bytes_sent = 0
+    connect_failures = 0
+
+    def __init__(self, host, port, timeout=10):
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self.sock = None
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.connect_failures = 0
+
+    def connect(self):
+        self.close()
+
+        try:
+            self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        except socket.error:
+            self.connect_failures += 1
+            raise
+
+    def is_connected(self):
+        if self.sock is None:
+            return False
+
+        # The server never writes to us, so a readable socket means it has closed the connection (or reset it).
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if readable and self.sock.recv(1) == '':
+                self.close()
+                return False
+        except (select.error, socket.error):
+            self.close()
+            return False
+
+        return True
+
+    def send(self, message):
+        # Try once on the existing connection, and once more on a fresh one if that fails.
+        for attempt in range(0, 2):
+            try:
+                if not self.is_connected():
+                    self.connect()
+
+                self.sock.sendall(message)
+                self.messages_sent += 1
+                self.bytes_sent += len(message)
+                return True
+            except socket.error:
+                self.close()
+
+        return False
+
+    def send_and_close(self, message):
+        # Older servers read a single message from each connection, and only act on it once the connection closes.
+        try:
+            self.connect()
+            self.sock.sendall(message)
+            self.messages_sent += 1
+            self.bytes_sent += len(message)
+            return True
+        except socket.error:
+            return False
+        finally:
+            self.close()
+
+    def close(self):
+        if self.sock is None:
+            return
+
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+        self.sock = None
+
+
+class DatagramConnection:
+    '''
+    Sends progress reports to the server as UDP datagrams, with no connection to set up or tear down. Datagrams are
+    numbered so the server can discard any that arrive after a newer one. Delivery isn't confirmed, so a lost datagram
+    is only made up for by the next report.
+    '''
+    host = ''
+    port = 0
+    sock = None
+    epoch = 0
+    sequence = 0
+    messages_sent = 0
+    bytes_sent = 0
+    connect_failures = 0
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = int(port)
+        self.sock = None
+        # The epoch tells the server that a restarted client's sequence numbers have started again.
+        self.epoch = int(time.time())
+        self.sequence = 0
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.connect_failures = 0
+
+    def send_clients(self, clients):
+        # Clients are given the same way as for Protocol.encode_frame. Returns False if a datagram couldn't be sent.
+        datagrams = Protocol.encode_datagrams(clients, self.epoch, self.sequence + 1)
+        self.sequence += len(datagrams)
+
+        try:
+            if self.sock is None:
+                self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+            for datagram in datagrams:
+                self.sock.sendto(datagram, (self.host, self.port))
+                self.messages_sent += 1
+                self.bytes_sent += len(datagram)
+        except socket.error:
+            # Counted with the connection failures, since it usually means the server's address can't be reached.
+            self.connect_failures += 1
+            self.close()
+            return False
+
+        return True
+
+    def close(self):
+        if self.sock is None:
+            return
+
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+        self.sock = None
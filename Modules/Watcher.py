@@ -0,0 +1,133 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import platform
+import select
+import struct
+import time
+
+# inotify flags, from <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event: watch descriptor, mask, cookie, name length, followed by the name.
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# How long to keep collecting events after the first one, so a save file that prime95 renames and rewrites is
+# reported once instead of as a deletion followed by a new file.
+SETTLE_TIME = 0.5
+
+
+def is_assignment_file_name(file_name, prefix='p'):
+    return file_name.startswith(prefix) and '.' not in file_name
+
+
+class PollingWatcher:
+    '''
+    Fallback used where inotify is unavailable. It never reports changes, so the caller's timed checks do all the work.
+    '''
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return set()
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    '''
+    Watches one or more prime95 working directories with a single inotify descriptor (through ctypes, so nothing extra
+    needs installing) and reports the save files that were written, created, renamed or deleted as (directory,
+    file_name) pairs.
+    '''
+    prefix = ''
+    file_descriptor = -1
+    watched_directories = {}
+
+    def __init__(self, directories, prefix='p'):
+        self.prefix = prefix
+        self.watched_directories = {}
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+        self.file_descriptor = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.file_descriptor < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        for directory in directories:
+            watch_descriptor = libc.inotify_add_watch(self.file_descriptor, directory.encode('utf-8'), WATCH_MASK)
+
+            if watch_descriptor < 0:
+                error_number = ctypes.get_errno()
+                os.close(self.file_descriptor)
+                raise OSError(error_number, "inotify_add_watch failed for " + directory)
+
+            self.watched_directories[watch_descriptor] = directory
+
+    def fileno(self):
+        return self.file_descriptor
+
+    def read_events(self):
+        changed_files = set()
+
+        while True:
+            try:
+                data = os.read(self.file_descriptor, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return changed_files
+                raise
+
+            offset = 0
+            while offset + INOTIFY_EVENT.size <= len(data):
+                watch_descriptor, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                file_name = data[offset:offset + name_length].rstrip('\0')
+                offset += name_length
+
+                # Events were lost, so ask the caller to check every file (reported with an empty file name).
+                if mask & IN_Q_OVERFLOW:
+                    for directory in self.watched_directories.values():
+                        changed_files.add((directory, ''))
+                elif watch_descriptor in self.watched_directories and is_assignment_file_name(file_name, self.prefix):
+                    changed_files.add((self.watched_directories[watch_descriptor], file_name))
+
+    def wait(self, timeout):
+        try:
+            readable, _, _ = select.select([self.file_descriptor], [], [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return set()
+            raise
+
+        if not readable:
+            return set()
+
+        # Let related events (such as a rename followed by a write) arrive before reporting.
+        time.sleep(SETTLE_TIME)
+        return self.read_events()
+
+    def close(self):
+        if self.file_descriptor >= 0:
+            os.close(self.file_descriptor)
+            self.file_descriptor = -1
+
+
+def create_watcher(directories, mode='auto', prefix='p'):
+    # Use inotify when asked to (or left to decide) and the platform supports it, otherwise fall back to polling.
+    if mode == 'poll' or platform.system() != 'Linux':
+        return PollingWatcher()
+
+    try:
+        return InotifyWatcher(directories, prefix)
+    except (OSError, AttributeError):
+        return PollingWatcher()
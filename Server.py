@@ -1,17 +1,40 @@
 import time
 import os
-import socket
 import signal
 import json
-import ftplib
+import Queue
+import socket
+from collections import OrderedDict
 from datetime import datetime
 from tabulate import tabulate
 from Modules import Gimps
+from Modules.Columnar import ColumnarClientManager
+from Modules.EventLoop import EventLoop
+from Modules.Expiry import AssignmentExpiry
+from Modules.History import HistoryStore
+from Modules.Http import HttpServer, ResponseCache
+from Modules.Publisher import FtpPublisher
+from Modules.Relay import RelayForwarder
+from Modules.Transport import ServerConnection
+from Modules.Ingest import DatagramServer, IngestServer
+from Modules.Metrics import COUNT_BUCKETS, PROMETHEUS_CONTENT_TYPE, Histogram, MetricsRegistry, write_metrics_file
+from Modules.Render import RenderScheduler, RowCache, enable_escape_sequences, write_screen
+from Modules.Snapshot import SnapshotWriter, load_snapshot
+from Modules import Subscribe
 
 
 class Config:
     host = ''
     port = 0
+    backlog = 0
+    read_timeout = 0
+    idle_timeout = 0
+    assignment_store = ''
+
+    udp_enabled = False
+    udp_host = ''
+    udp_port = 0
+    udp_receive_buffer = 0
 
     date_format = ''
     clear_command = ''
@@ -19,11 +42,47 @@ class Config:
     print_to_file = False
     print_to_file_name = ''
     print_to_file_ftp = False
+    max_refresh_rate = 0.0
+    sort_by = ''
+
+    history_enabled = False
+    history_database = ''
+    history_flush_interval = 0.0
+    history_replay_window = 0
+    history_retention = 0
+
+    http_enabled = False
+    http_host = ''
+    http_port = 0
+
+    subscribe_enabled = False
+    subscribe_host = ''
+    subscribe_port = 0
+    subscribe_max_buffer = 0
+
+    snapshot_enabled = False
+    snapshot_path = ''
+    snapshot_interval = 0.0
+
+    expiry_enabled = False
+    expiry_stale_intervals = 0
+    expiry_evict_intervals = 0
+    expiry_check_interval = 0.0
+
+    metrics_json_file = ''
+    metrics_json_interval = 0.0
+
+    relay_enabled = False
+    relay_name = ''
+    relay_upstream_host = ''
+    relay_upstream_port = 0
+    relay_forward_interval = 0.0
 
     ftp_host = ''
     ftp_user = ''
     ftp_pass = ''
     ftp_path = ''
+    ftp_timeout = 0.0
 
     def __init__(self):
         with open('server.config.json', 'r') as fp:
@@ -32,29 +91,135 @@ class Config:
 
         self.host = obj['server']['host']
         self.port = int(obj['server']['port'])
+        self.backlog = int(obj['server'].get('backlog', 128))
+        self.read_timeout = float(obj['server'].get('read_timeout', 10))
+        self.idle_timeout = float(obj['server'].get('idle_timeout', 3600))
+        self.assignment_store = obj['server'].get('assignment_store', 'objects')
+
+        udp = obj.get('udp', {})
+        self.udp_enabled = bool(udp.get('enabled', False))
+        self.udp_host = udp.get('host', '')
+        self.udp_port = int(udp.get('port', 1168))
+        self.udp_receive_buffer = int(udp.get('receive_buffer', 1048576))
 
         self.date_format = obj['display']['date_format']
         self.table_type = obj['display']['table_type']
         self.print_to_file = bool(obj['display']['print_to_file'])
         self.print_to_file_name = obj['display']['print_to_file_name']
         self.print_to_file_ftp = bool(obj['display']['print_to_file_ftp'])
+        self.max_refresh_rate = float(obj['display'].get('max_refresh_rate', 1.0))
+        self.sort_by = obj['display'].get('sort_by', 'progress')
+
+        history = obj.get('history', {})
+        self.history_enabled = bool(history.get('enabled', True))
+        self.history_database = history.get('database', 'history.db')
+        self.history_flush_interval = float(history.get('flush_interval', 1.0))
+        self.history_replay_window = int(history.get('replay_window', 21600))
+        self.history_retention = int(history.get('retention', 2592000))
+
+        http = obj.get('http', {})
+        self.http_enabled = bool(http.get('enabled', False))
+        self.http_host = http.get('host', '')
+        self.http_port = int(http.get('port', 1169))
+
+        subscribe = obj.get('subscribe', {})
+        self.subscribe_enabled = bool(subscribe.get('enabled', False))
+        self.subscribe_host = subscribe.get('host', '')
+        self.subscribe_port = int(subscribe.get('port', 1170))
+        self.subscribe_max_buffer = int(subscribe.get('max_buffer', 262144))
+
+        snapshot = obj.get('snapshot', {})
+        self.snapshot_enabled = bool(snapshot.get('enabled', True))
+        self.snapshot_path = snapshot.get('path', 'snapshot.dat')
+        self.snapshot_interval = float(snapshot.get('interval', 60))
+
+        expiry = obj.get('expiry', {})
+        self.expiry_enabled = bool(expiry.get('enabled', True))
+        self.expiry_stale_intervals = int(expiry.get('stale_intervals', 3))
+        self.expiry_evict_intervals = int(expiry.get('evict_intervals', 48))
+        self.expiry_check_interval = float(expiry.get('check_interval', 60))
+
+        metrics = obj.get('metrics', {})
+        self.metrics_json_file = metrics.get('json_file', '')
+        self.metrics_json_interval = float(metrics.get('json_interval', 60))
+
+        relay = obj.get('relay', {})
+        self.relay_enabled = bool(relay.get('enabled', False))
+        self.relay_name = relay.get('name', '') or socket.gethostname()
+        self.relay_upstream_host = relay.get('upstream_host', '')
+        self.relay_upstream_port = int(relay.get('upstream_port', 1168))
+        self.relay_forward_interval = float(relay.get('forward_interval', 10))
 
         self.ftp_host = obj['ftp']['host']
         self.ftp_user = obj['ftp']['user']
         self.ftp_pass = obj['ftp']['pass']
-        self.ftp_path = obj['ftp']['pass']
+        self.ftp_path = obj['ftp']['path']
+        self.ftp_timeout = float(obj['ftp'].get('timeout', 30))
 
         if obj['display']['clear_command'] == 'cls' or obj['display']['clear_command'] == 'clear':
             self.clear_command = obj['display']['clear_command']
 
 
-CLIENT_MANAGER = Gimps.ClientManager()
+def create_client_manager():
+    expiry = None
+    if CONFIG.expiry_enabled:
+        expiry = AssignmentExpiry(CONFIG.expiry_stale_intervals, CONFIG.expiry_evict_intervals)
+
+    # The columnar store holds large fleets in far less memory, the object store is simpler to work with.
+    if CONFIG.assignment_store == 'columnar':
+        return ColumnarClientManager(CONFIG.sort_by, expiry)
+
+    return Gimps.ClientManager(CONFIG.sort_by, expiry)
+
+
 CONFIG = Config()
+CLIENT_MANAGER = create_client_manager()
+EVENT_LOOP = EventLoop()
+MESSAGE_QUEUE = Queue.Queue()
+HISTORY = None
+SNAPSHOT_WRITER = None
+FTP_PUBLISHER = None
+RELAY_FORWARDER = None
+SUBSCRIPTION_SERVER = None
+HTTP_SERVER = None
+DATAGRAM_SERVER = None
+
+if CONFIG.history_enabled:
+    HISTORY = HistoryStore(CONFIG.history_database, CONFIG.history_flush_interval, retention=CONFIG.history_retention)
+
+if CONFIG.snapshot_enabled:
+    SNAPSHOT_WRITER = SnapshotWriter(CONFIG.snapshot_path)
+
+if CONFIG.print_to_file and CONFIG.print_to_file_name != '' and CONFIG.print_to_file_ftp:
+    FTP_PUBLISHER = FtpPublisher(CONFIG.ftp_host, CONFIG.ftp_user, CONFIG.ftp_pass, CONFIG.ftp_path,
+                                 CONFIG.print_to_file_name, CONFIG.ftp_timeout)
+    FTP_PUBLISHER.start()
+
+if CONFIG.relay_enabled:
+    RELAY_FORWARDER = RelayForwarder(CONFIG.relay_name,
+                                     ServerConnection(CONFIG.relay_upstream_host, CONFIG.relay_upstream_port),
+                                     CONFIG.relay_forward_interval)
+    RELAY_FORWARDER.start()
 
 
 # Catch SIGINT
 def signal_handler(sig, frame):
     print "Exiting Program..."
+
+    # Make sure every update received so far is written to the history.
+    if HISTORY is not None:
+        HISTORY.close()
+
+    # Forward the last updates upstream.
+    if RELAY_FORWARDER is not None:
+        RELAY_FORWARDER.stop()
+
+    # Take a final snapshot, once the background writer has finished with the file.
+    if SNAPSHOT_WRITER is not None:
+        SNAPSHOT_WRITER.stop()
+        CLIENT_MANAGER.finish_batch()
+        SNAPSHOT_WRITER.save_now(CLIENT_MANAGER.get_state())
+
     os.sys.exit(0)
 
 
@@ -62,94 +227,358 @@ def signal_handler(sig, frame):
 signal.signal(signal.SIGINT, signal_handler)
 
 
-def display_output():
+def get_client_label(assignment):
+    # Clients whose reports came through relays are shown with the path they took.
+    client = CLIENT_MANAGER.get_client(assignment.client_name)
 
-    # Get sorted assignments from client manager.
-    assignments = CLIENT_MANAGER.get_assignments_sorted()
+    if client is not None and client.via != '':
+        return assignment.client_name + ' (via ' + client.via + ')'
+    return assignment.client_name
 
-    # Create table data.
-    table_headers = ['Client', 'Exponent', 'Progress', 'Avg. Iterations', 'Est. Completion', 'Last Updated']
-    table_data = []
 
-    # Loop through each assignment, and add its information to the list.
-    for assignment in assignments:
-        estimated_completion_date_string = 'To Be Determined'
-        average_iterations_per_second_string = 'To Be Determined'
+def format_assignment_row(assignment):
+    estimated_completion_date_string = 'To Be Determined'
+    average_iterations_per_second_string = 'To Be Determined'
 
-        if assignment.estimated_completion_date != 0:
-            estimated_completion_date_string = datetime.fromtimestamp(assignment.estimated_completion_date).strftime(
-                CONFIG.date_format)
+    if assignment.estimated_completion_date != 0:
+        estimated_completion_date_string = datetime.fromtimestamp(assignment.estimated_completion_date).strftime(
+            CONFIG.date_format)
 
-        if assignment.average_iterations_per_second != 0:
-            average_iterations_per_second_string = '{:.2f} iters/sec'.format(
-                round(assignment.get_average_iterations_per_second(), 2))
+    if assignment.get_average_iterations_per_second() != 0:
+        average_iterations_per_second_string = '{:.2f} iters/sec'.format(
+            round(assignment.get_average_iterations_per_second(), 2))
 
-        progress_string = '{}% ({:,} iterations)'.format(assignment.progress, assignment.iterations)
+    progress_string = '{}% ({:,} iterations)'.format(assignment.progress, assignment.iterations)
 
-        table_data.append([
-            assignment.client_name,
-            '{:,} ({:,} digits)'.format(assignment.exponent, assignment.exponent_digit_length),
-            progress_string,
-            average_iterations_per_second_string,
-            estimated_completion_date_string,
-            datetime.fromtimestamp(assignment.last_updated).strftime(CONFIG.date_format)
-        ])
+    last_updated_string = datetime.fromtimestamp(assignment.last_updated).strftime(CONFIG.date_format)
+    if assignment.stale:
+        last_updated_string += ' (stale)'
+
+    return (
+        get_client_label(assignment),
+        '{:,} ({:,} digits)'.format(assignment.exponent, assignment.exponent_digit_length),
+        progress_string,
+        average_iterations_per_second_string,
+        estimated_completion_date_string,
+        last_updated_string
+    )
+
+
+def format_assignment_json(assignment):
+    # Each assignment's JSON is cached too, and joined into the full document.
+    client = CLIENT_MANAGER.get_client(assignment.client_name)
+
+    return json.dumps({
+        'client': assignment.client_name,
+        'via': client.via if client is not None and client.via != '' else None,
+        'exponent': assignment.exponent,
+        'exponent_digit_length': assignment.exponent_digit_length,
+        'iterations': assignment.iterations,
+        'progress': assignment.progress,
+        'average_iterations_per_second': assignment.get_average_iterations_per_second(),
+        'estimated_completion': assignment.estimated_completion_date or None,
+        'last_updated': assignment.last_updated,
+        'stale': assignment.stale
+    }, sort_keys=True)
+
+
+ROW_CACHE = RowCache(format_assignment_row)
+JSON_CACHE = RowCache(format_assignment_json)
+HTTP_RESPONSES = ResponseCache()
+METRICS = MetricsRegistry()
+RENDER_LATENCY = Histogram()
+# The queue is emptied every time around the event loop, so what it held is only worth recording as each drain starts.
+DRAIN_SIZES = Histogram(COUNT_BUCKETS)
+
+
+def display_output():
+    render_start = time.time()
+
+    # Work out the estimates and display order of everything updated since the last redraw.
+    CLIENT_MANAGER.finish_batch()
+
+    # Create table data. Only the rows of assignments that changed since the last redraw are formatted again.
+    table_headers = ['Client', 'Exponent', 'Progress', 'Avg. Iterations', 'Est. Completion', 'Last Updated']
+    table_data = ROW_CACHE.get_rows(CLIENT_MANAGER.iter_assignments_sorted())
 
     # Print table to screen.
-    os.system(CONFIG.clear_command)
-    print tabulate(table_data, table_headers, CONFIG.table_type, stralign='center')
+    table = tabulate(table_data, table_headers, CONFIG.table_type, stralign='center')
+
+    # Client names are unicode, so the table is too once any of them isn't plain ASCII.
+    if isinstance(table, unicode):
+        table = table.encode('utf-8')
+
+    write_screen(table, CONFIG.clear_command != '')
+
+    # Update the pages served over HTTP, so requests are answered straight from memory.
+    if CONFIG.http_enabled:
+        HTTP_RESPONSES.set_page('/status.txt', 'text/plain; charset=utf-8', table + '\n')
+        HTTP_RESPONSES.set_page('/status.json', 'application/json', '{"assignments": [' + ', '.join(
+            JSON_CACHE.get_rows(CLIENT_MANAGER.iter_assignments_sorted())) + ']}')
 
     # (Optionally) Print table to file.
     if CONFIG.print_to_file and CONFIG.print_to_file_name != '':
         # Write data to file.
         with open(CONFIG.print_to_file_name, 'w') as fp:
-            fp.write(tabulate(table_data, table_headers, CONFIG.table_type, stralign='center'))
+            fp.write(table)
             fp.close()
 
-        # (Optionally) Upload data file to ftp.
-        if CONFIG.print_to_file_ftp:
-            try:
-                ftp_session = ftplib.FTP(CONFIG.ftp_host, CONFIG.ftp_user, CONFIG.ftp_pass)
-                table_file = open(CONFIG.print_to_file_name, 'rb')
-                ftp_session.storbinary("STOR " + CONFIG.print_to_file_name, table_file)
-                table_file.close()
-                ftp_session.close()
-            except Exception:
-                time.sleep(0)
-
-
-def parse_client_message(message):
-    # Parse the message received from the client.
-    '''
-    Message Format
-    CLIENT_NAME|CLIENT_WORKERS|UPDATE_INTERVAL|ASSIGNMENT_EXPONENT|ASSIGNMENT_ITERATIONS
-    '''
-    split_message = message.split("|")
-
-    # Retrieve values from client message.
-    client_name = str(split_message[0])
-    client_number_of_workers = int(split_message[1])
-    client_update_interval = int(split_message[2])
-    client_assignment_exponent = int(split_message[3])
-    client_assignment_iterations = int(split_message[4])
-
-    # Add or update client in client manager.
-    CLIENT_MANAGER.add_or_update_client(client_name, client_number_of_workers, client_update_interval,
-                                        client_assignment_exponent, client_assignment_iterations)
+        # (Optionally) Upload data file to ftp. This happens in the background, so it never holds up the server.
+        if FTP_PUBLISHER is not None:
+            FTP_PUBLISHER.publish(table)
+
+    RENDER_LATENCY.observe(time.time() - render_start)
+
+
+def save_snapshot():
+    # Capture the state here on the main thread, and let the snapshot writer encode and write it.
+    CLIENT_MANAGER.finish_batch()
+    SNAPSHOT_WRITER.save(CLIENT_MANAGER.get_state())
+    EVENT_LOOP.call_later(CONFIG.snapshot_interval, save_snapshot)
+
+
+def register_metrics():
+    # Most of these read counters the modules keep anyway, so they cost nothing until the metrics are exported.
+    METRICS.add_counter('messages_received_total', 'Messages decoded from clients.',
+                        lambda: INGEST_SERVER.received_messages)
+    METRICS.add_counter('updates_received_total', 'Assignment updates decoded from clients.',
+                        lambda: INGEST_SERVER.received_updates)
+    METRICS.add_counter('messages_rejected_total', 'Malformed messages from clients.',
+                        lambda: INGEST_SERVER.rejected_messages)
+    METRICS.add_counter('connections_accepted_total', 'Client connections accepted.',
+                        lambda: INGEST_SERVER.accepted_connections)
+    METRICS.add_counter('connections_timed_out_total', 'Client connections closed for being too slow or idle.',
+                        lambda: INGEST_SERVER.timed_out_connections)
+    METRICS.add_gauge('connections_open', 'Client connections currently open.',
+                      lambda: len(INGEST_SERVER.connections))
+    METRICS.add_histogram('message_queue_drain_size', 'Updates applied each time the message queue was emptied.',
+                          DRAIN_SIZES)
+    METRICS.add_gauge('clients', 'Clients being tracked.', lambda: len(CLIENT_MANAGER.clients))
+    METRICS.add_gauge('assignments', 'Assignments being tracked.', lambda: len(CLIENT_MANAGER.sorted_index))
+    METRICS.add_histogram('parse_seconds', 'Time taken to decode each read from a client.',
+                          INGEST_SERVER.parse_latency)
+    METRICS.add_histogram('render_seconds', 'Time taken to redraw the table.', RENDER_LATENCY)
+    METRICS.add_counter('rows_formatted_total', 'Table rows formatted.', lambda: ROW_CACHE.rows_formatted)
+
+    if DATAGRAM_SERVER is not None:
+        METRICS.add_counter('datagrams_received_total', 'Datagrams received from clients.',
+                            lambda: DATAGRAM_SERVER.received_datagrams)
+        METRICS.add_counter('datagram_updates_received_total', 'Assignment updates received in datagrams.',
+                            lambda: DATAGRAM_SERVER.received_updates)
+        METRICS.add_counter('datagrams_rejected_total', 'Malformed datagrams.',
+                            lambda: DATAGRAM_SERVER.rejected_datagrams)
+        METRICS.add_counter('datagram_updates_stale_total', 'Updates discarded for arriving after newer ones.',
+                            lambda: DATAGRAM_SERVER.stale_updates)
+        METRICS.add_histogram('datagram_parse_seconds', 'Time taken to decode each datagram.',
+                              DATAGRAM_SERVER.parse_latency)
+
+    if HISTORY is not None:
+        METRICS.add_counter('history_samples_written_total', 'Updates written to the history database.',
+                            lambda: HISTORY.written_samples)
+        METRICS.add_counter('history_samples_dropped_total', 'Updates not recorded because the history writer fell '
+                            'behind.', lambda: HISTORY.dropped_samples)
+        METRICS.add_counter('history_samples_failed_total', 'Updates that could not be written to the history '
+                            'database.', lambda: HISTORY.failed_samples)
+        METRICS.add_counter('history_samples_pruned_total', 'Updates deleted from the history database for being older '
+                            'than the retention period.', lambda: HISTORY.pruned_samples)
+
+    if SNAPSHOT_WRITER is not None:
+        METRICS.add_counter('snapshots_written_total', 'Snapshots written.', lambda: SNAPSHOT_WRITER.snapshots_written)
+        METRICS.add_counter('snapshots_failed_total', 'Snapshots that could not be written.',
+                            lambda: SNAPSHOT_WRITER.failed_snapshots)
+
+    if FTP_PUBLISHER is not None:
+        METRICS.add_counter('ftp_uploads_total', 'Tables uploaded to the FTP server.', lambda: FTP_PUBLISHER.uploads)
+        METRICS.add_counter('ftp_uploads_skipped_total', 'Uploads skipped because the table had not changed.',
+                            lambda: FTP_PUBLISHER.skipped_uploads)
+        METRICS.add_counter('ftp_uploads_failed_total', 'Uploads that failed.', lambda: FTP_PUBLISHER.failed_uploads)
+        METRICS.add_histogram('ftp_upload_seconds', 'Time taken to upload the table.', FTP_PUBLISHER.upload_time)
+
+    if RELAY_FORWARDER is not None:
+        METRICS.add_counter('relay_updates_forwarded_total', 'Updates forwarded to the upstream server.',
+                            lambda: RELAY_FORWARDER.forwarded_updates)
+        METRICS.add_counter('relay_batches_forwarded_total', 'Batches forwarded to the upstream server.',
+                            lambda: RELAY_FORWARDER.forwarded_batches)
+        METRICS.add_counter('relay_batches_failed_total', 'Batches that could not be forwarded, and were retried.',
+                            lambda: RELAY_FORWARDER.failed_batches)
+
+    if SUBSCRIPTION_SERVER is not None:
+        METRICS.add_gauge('subscribers', 'Subscribers currently connected.',
+                          lambda: len(SUBSCRIPTION_SERVER.subscribers))
+        METRICS.add_counter('subscribers_resynced_total', 'Times a subscriber fell behind and was resynced.',
+                            lambda: SUBSCRIPTION_SERVER.resynced_subscribers)
+        METRICS.add_counter('subscribers_dropped_total', 'Subscribers disconnected for falling behind.',
+                            lambda: SUBSCRIPTION_SERVER.dropped_subscribers)
+
+    if CLIENT_MANAGER.expiry is not None:
+        METRICS.add_counter('assignments_marked_stale_total', 'Assignments marked stale for not being reported.',
+                            lambda: CLIENT_MANAGER.expiry.stale_assignments)
+        METRICS.add_counter('assignments_evicted_total', 'Assignments removed for not being reported.',
+                            lambda: CLIENT_MANAGER.expiry.evicted_assignments)
+        METRICS.add_counter('clients_evicted_total', 'Clients removed once they had no assignments left.',
+                            lambda: CLIENT_MANAGER.expiry.evicted_clients)
+
+    if HTTP_SERVER is not None:
+        METRICS.add_counter('http_requests_total', 'HTTP requests served.', lambda: HTTP_SERVER.requests_served)
+
+
+def save_metrics():
+    try:
+        write_metrics_file(METRICS, CONFIG.metrics_json_file)
+    except (IOError, OSError):
+        pass
+
+    EVENT_LOOP.call_later(CONFIG.metrics_json_interval, save_metrics)
+
+
+def expire_assignments():
+    # Runs on the event loop, between drains of the message queue.
+    changed_assignments = CLIENT_MANAGER.expire_assignments()
+
+    if len(changed_assignments) > 0:
+        RENDER_SCHEDULER.mark_dirty()
+
+        if SUBSCRIPTION_SERVER is not None and SUBSCRIPTION_SERVER.has_subscribers():
+            publish_assignment_changes(changed_assignments)
+
+    EVENT_LOOP.call_later(CONFIG.expiry_check_interval, expire_assignments)
+
+
+def get_subscription_snapshot():
+    CLIENT_MANAGER.finish_batch()
+    return Subscribe.encode_snapshot(JSON_CACHE.get_rows(CLIENT_MANAGER.iter_assignments_sorted()))
+
+
+def publish_assignment_changes(changed_assignments):
+    # Send subscribers the final state of every assignment touched by this round of updates.
+    CLIENT_MANAGER.finish_batch()
+
+    for (client_name, exponent), assignment in changed_assignments.items():
+        client = CLIENT_MANAGER.get_client(client_name)
+
+        if assignment is not None and client is not None and client.get_assignment(exponent) == assignment:
+            SUBSCRIPTION_SERVER.broadcast(Subscribe.encode_update(format_assignment_json(assignment)))
+        else:
+            SUBSCRIPTION_SERVER.broadcast(Subscribe.encode_removal(client_name, exponent))
+
+
+def is_assignment_tracked(client_name, exponent):
+    client = CLIENT_MANAGER.get_client(client_name)
+    return client is not None and client.check_assignment(exponent)
+
+
+def process_client_updates():
+    # Apply every update the ingest engine has queued to the client manager.
+    updates_applied = 0
+
+    # Only keep track of what changed when someone is listening.
+    changed_assignments = None
+    if SUBSCRIPTION_SERVER is not None and SUBSCRIPTION_SERVER.has_subscribers():
+        changed_assignments = OrderedDict()
+
+    # The estimates and display order are only brought up to date when they are next needed, normally by the next
+    # redraw, so however many drains there were in between they are worked out once.
+    CLIENT_MANAGER.begin_batch()
+
+    while True:
+        try:
+            update = MESSAGE_QUEUE.get_nowait()
+        except Queue.Empty:
+            break
+
+        client_name, exponent, via = update[0], update[3], update[5]
+
+        if changed_assignments is not None:
+            client = CLIENT_MANAGER.get_client(client_name)
+            previous_exponents = set(client.assignments_by_exponent) if client is not None else set()
+
+        # Add or update client in client manager.
+        CLIENT_MANAGER.add_or_update_client(*update[:5], via=via)
+        updates_applied += 1
+
+        if HISTORY is not None:
+            HISTORY.record(*update[:5])
+
+        if RELAY_FORWARDER is not None:
+            RELAY_FORWARDER.add(*update)
+
+        # Adding an assignment can push out an older one, which subscribers need to hear about as well.
+        if changed_assignments is not None:
+            client = CLIENT_MANAGER.get_client(client_name)
+            changed_assignments[(client_name, exponent)] = client.get_assignment(exponent)
+
+            for removed_exponent in previous_exponents.difference(client.assignments_by_exponent):
+                changed_assignments[(client_name, removed_exponent)] = None
 
+    if updates_applied > 0:
+        DRAIN_SIZES.observe(updates_applied)
+
+    if changed_assignments:
+        publish_assignment_changes(changed_assignments)
+
+    return updates_applied
+
+
+# Restore the clients and assignments from the last snapshot before accepting connections.
+snapshot_time = 0
+if SNAPSHOT_WRITER is not None:
+    snapshot_state, snapshot_time = load_snapshot(CONFIG.snapshot_path)
+
+    if snapshot_state is not None:
+        try:
+            CLIENT_MANAGER.restore_state(snapshot_state)
+        except (ValueError, TypeError, IndexError):
+            # The snapshot doesn't hold the state we expect, so start from nothing instead.
+            CLIENT_MANAGER = create_client_manager()
+
+    SNAPSHOT_WRITER.start()
+    EVENT_LOOP.call_later(CONFIG.snapshot_interval, save_snapshot)
+
+# Rebuild the speed averages from the recorded history, so they don't have to start again from nothing. Anything
+# already covered by the snapshot is skipped.
+if HISTORY is not None:
+    HISTORY.replay(CLIENT_MANAGER, max(snapshot_time, time.time() - CONFIG.history_replay_window))
+    HISTORY.start()
 
 # Display table.
+enable_escape_sequences()
 display_output()
+RENDER_SCHEDULER = RenderScheduler(EVENT_LOOP, display_output, CONFIG.max_refresh_rate)
+
+# Start accepting client connections on the event loop.
+INGEST_SERVER = IngestServer(EVENT_LOOP, MESSAGE_QUEUE, CONFIG.host, CONFIG.port, CONFIG.read_timeout, CONFIG.backlog,
+                             CONFIG.idle_timeout)
+INGEST_SERVER.start()
+
+if CONFIG.udp_enabled:
+    DATAGRAM_SERVER = DatagramServer(EVENT_LOOP, MESSAGE_QUEUE, CONFIG.udp_host, CONFIG.udp_port,
+                                     CONFIG.udp_receive_buffer, is_assignment_tracked)
+    DATAGRAM_SERVER.start()
+
+if CONFIG.subscribe_enabled:
+    SUBSCRIPTION_SERVER = Subscribe.SubscriptionServer(EVENT_LOOP, get_subscription_snapshot, CONFIG.subscribe_host,
+                                                       CONFIG.subscribe_port, CONFIG.backlog,
+                                                       CONFIG.subscribe_max_buffer)
+    SUBSCRIPTION_SERVER.start()
+
+if CONFIG.http_enabled:
+    HTTP_SERVER = HttpServer(EVENT_LOOP, HTTP_RESPONSES, CONFIG.http_host, CONFIG.http_port, CONFIG.read_timeout,
+                             CONFIG.backlog)
+    HTTP_SERVER.start()
+
+# Export the metrics as /metrics on the HTTP listener, and (optionally) dump them to a JSON file as well.
+register_metrics()
+HTTP_RESPONSES.set_handler('/metrics', PROMETHEUS_CONTENT_TYPE, METRICS.render_prometheus)
+
+if CONFIG.metrics_json_file != '':
+    EVENT_LOOP.call_later(CONFIG.metrics_json_interval, save_metrics)
 
-# Create socket connection to listen for clients.
-socket_connection = socket.socket()
-socket_connection.bind((CONFIG.host, CONFIG.port))
-socket_connection.listen(10)
+# Anything restored from the snapshot or history that has already run out is dealt with straight away.
+if CLIENT_MANAGER.expiry is not None:
+    EVENT_LOOP.call_later(0, expire_assignments)
 
 while True:
-    c, addr = socket_connection.accept()
-    client_message = c.recv(1024)
-    c.close()
+    EVENT_LOOP.run_once()
 
-    parse_client_message(client_message)
-    display_output()
+    if process_client_updates() > 0:
+        RENDER_SCHEDULER.mark_dirty()
@@ -0,0 +1,85 @@
+'''
+Memory used by the server's client and assignment store, for the object and columnar backends.
+
+Each measurement runs in a fresh interpreter, which builds a fleet of the given size, sends every assignment a few
+progress updates so its speed samples are filled in, and reports how much its peak resident memory grew.
+
+Usage: python bench/memory.py [--sizes 1000,10000,100000] [--output results.json]
+'''
+import argparse
+import os
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from results import BenchmarkResults
+
+WORKERS_PER_CLIENT = 4
+UPDATE_INTERVAL = 1800
+UPDATES_PER_ASSIGNMENT = 4
+BACKENDS = ('objects', 'columnar')
+
+
+def get_peak_memory():
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS.
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak_memory
+    return peak_memory * 1024
+
+
+def build_fleet(backend, number_of_assignments):
+    from Modules import Gimps
+    from Modules.Columnar import ColumnarClientManager
+
+    if backend == 'columnar':
+        client_manager = ColumnarClientManager()
+    else:
+        client_manager = Gimps.ClientManager()
+
+    timestamp = 1500000000.0
+    for update in range(0, UPDATES_PER_ASSIGNMENT):
+        for i in range(0, number_of_assignments):
+            client_manager.add_or_update_client('client-' + str(i // WORKERS_PER_CLIENT), WORKERS_PER_CLIENT,
+                                                UPDATE_INTERVAL, 80000000 + i, 1000 + update * 5000,
+                                                timestamp + update * UPDATE_INTERVAL)
+
+    return client_manager
+
+
+def measure(backend, number_of_assignments):
+    # Runs in the child interpreter, and prints the bytes used.
+    baseline = get_peak_memory()
+    client_manager = build_fleet(backend, number_of_assignments)
+    print get_peak_memory() - baseline
+    return client_manager
+
+
+def run_measurement(backend, number_of_assignments):
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--measure', backend,
+                                      str(number_of_assignments)])
+    return int(output.strip())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sizes', default='1000,10000,100000', help='comma separated fleet sizes, in assignments')
+    parser.add_argument('--output', help='file to write the JSON results to, instead of stdout')
+    parser.add_argument('--measure', nargs=2, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.measure is not None:
+        measure(arguments.measure[0], int(arguments.measure[1]))
+        sys.exit(0)
+
+    benchmark_results = BenchmarkResults('memory')
+
+    for size in [int(size) for size in arguments.sizes.split(',')]:
+        for backend in BACKENDS:
+            memory_used = run_measurement(backend, size)
+            benchmark_results.add('memory_per_assignment', memory_used / float(size), 'bytes', assignments=size,
+                                  backend=backend)
+
+    benchmark_results.write(arguments.output)
@@ -0,0 +1,188 @@
+'''
+Microbenchmarks for the server and client hot paths, at increasing fleet sizes.
+
+    add_or_update_client       one progress update applied to the client manager, which should cost the same at
+                               any fleet size, so it is swept up to a larger size than the rest
+    get_assignments_sorted     building the sorted assignment list for the table
+    apply_batch                a progress update for every assignment, applied as one batch
+    update_iterations          one progress update applied directly to an assignment
+    render_rows                formatting the table rows after a single update
+    render_table               the same, followed by tabulate (when it is installed)
+    read_file                  re-reading a prime95 save file header
+
+Usage: python bench/microbench.py [--sizes 10,100,1000] [--scaling-sizes 10,1000,100000] [--output results.json]
+'''
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from datetime import datetime
+from Modules import Gimps
+from Modules.Render import RowCache
+from Modules.SaveFile import LL_MAGIC, SAVE_FILE_HEADER
+from results import BenchmarkResults
+
+try:
+    from tabulate import tabulate
+except ImportError:
+    tabulate = None
+
+WORKERS_PER_CLIENT = 4
+UPDATE_INTERVAL = 1800
+
+
+def build_client_manager(number_of_assignments):
+    client_manager = Gimps.ClientManager()
+    assignments = []
+
+    for i in range(0, number_of_assignments):
+        client_name = 'client-' + str(i // WORKERS_PER_CLIENT)
+        exponent = 80000000 + i
+        client_manager.add_or_update_client(client_name, WORKERS_PER_CLIENT, UPDATE_INTERVAL, exponent, 1000)
+        assignments.append((client_name, exponent))
+
+    return client_manager, assignments
+
+
+def time_per_operation(function, operations):
+    # Best of three runs, in microseconds per operation.
+    return min(timeit.repeat(function, number=operations, repeat=3)) / operations * 1000000
+
+
+def bench_add_or_update_client(results, number_of_assignments):
+    client_manager, assignments = build_client_manager(number_of_assignments)
+    random.seed(1168)
+    sample = [random.choice(assignments) for _ in range(0, 10000)]
+    progress = [1000]
+
+    def run():
+        progress[0] += 1000
+        for client_name, exponent in sample:
+            client_manager.add_or_update_client(client_name, WORKERS_PER_CLIENT, UPDATE_INTERVAL, exponent,
+                                                progress[0])
+
+    results.add('add_or_update_client', time_per_operation(run, 1) / len(sample), 'us/op',
+                assignments=number_of_assignments)
+
+
+def bench_get_assignments_sorted(results, number_of_assignments):
+    client_manager, _ = build_client_manager(number_of_assignments)
+    operations = max(10, 100000 // number_of_assignments)
+
+    results.add('get_assignments_sorted', time_per_operation(client_manager.get_assignments_sorted, operations),
+                'us/op', assignments=number_of_assignments)
+
+
+def bench_apply_batch(results, number_of_assignments):
+    client_manager, assignments = build_client_manager(number_of_assignments)
+    progress = [1000]
+
+    def run():
+        progress[0] += 1000
+        client_manager.begin_batch()
+        for client_name, exponent in assignments:
+            client_manager.add_or_update_client(client_name, WORKERS_PER_CLIENT, UPDATE_INTERVAL, exponent,
+                                                progress[0])
+        client_manager.finish_batch()
+
+    results.add('apply_batch', time_per_operation(run, 1) / number_of_assignments, 'us/op',
+                assignments=number_of_assignments)
+
+
+def bench_update_iterations(results):
+    assignment = Gimps.Assignment('client-0', 80000000, 1000, UPDATE_INTERVAL)
+    progress = [1000]
+
+    def run():
+        progress[0] += 1000
+        assignment.update_iterations(progress[0])
+
+    results.add('update_iterations', time_per_operation(run, 100000), 'us/op')
+
+
+def format_row(assignment):
+    # The same formatting Server.py does for each row.
+    return (
+        assignment.client_name,
+        '{:,} ({:,} digits)'.format(assignment.exponent, assignment.exponent_digit_length),
+        '{}% ({:,} iterations)'.format(assignment.progress, assignment.iterations),
+        '{:.2f} iters/sec'.format(round(assignment.get_average_iterations_per_second(), 2)),
+        datetime.fromtimestamp(assignment.estimated_completion_date).strftime('%B %d, %Y at %I:%M:%S %p'),
+        datetime.fromtimestamp(assignment.last_updated).strftime('%B %d, %Y at %I:%M:%S %p')
+    )
+
+
+def bench_render_table(results, number_of_assignments):
+    client_manager, assignments = build_client_manager(number_of_assignments)
+    row_cache = RowCache(format_row)
+    row_cache.get_rows(client_manager.iter_assignments_sorted())
+    progress = [1000]
+
+    def render_rows():
+        # A redraw after a single update.
+        progress[0] += 1000
+        client_name, exponent = assignments[progress[0] // 1000 % len(assignments)]
+        client_manager.add_or_update_client(client_name, WORKERS_PER_CLIENT, UPDATE_INTERVAL, exponent, progress[0])
+        return row_cache.get_rows(client_manager.iter_assignments_sorted())
+
+    operations = max(5, 10000 // number_of_assignments)
+    results.add('render_rows', time_per_operation(render_rows, operations), 'us/op',
+                assignments=number_of_assignments)
+
+    if tabulate is not None:
+        def render_table():
+            tabulate(render_rows(), tablefmt='grid', stralign='center')
+
+        results.add('render_table', time_per_operation(render_table, operations), 'us/op',
+                    assignments=number_of_assignments)
+
+
+def write_save_file(file_path, exponent, iterations):
+    with open(file_path, 'wb') as fp:
+        fp.write(SAVE_FILE_HEADER.pack(LL_MAGIC, 1, 1.0, 2, exponent, -1, 'LL', 0.5, 0, 0, iterations))
+        fp.write('\0' * 4096)
+
+
+def bench_read_file(results):
+    directory = tempfile.mkdtemp(prefix='gimps-bench-')
+
+    try:
+        file_path = os.path.join(directory, 'p80000023')
+        write_save_file(file_path, 80000023, 12345)
+        assignment_file = Gimps.AssignmentFile(file_path)
+
+        results.add('read_file', time_per_operation(assignment_file.read_file, 10000), 'us/op')
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sizes', default='10,100,1000,10000', help='comma separated fleet sizes, in assignments')
+    parser.add_argument('--scaling-sizes', default='10,100,1000,10000,100000',
+                        help='comma separated fleet sizes for the add_or_update_client scaling sweep')
+    parser.add_argument('--output', help='file to write the JSON results to, instead of stdout')
+    arguments = parser.parse_args()
+
+    benchmark_results = BenchmarkResults('microbench')
+    sizes = [int(size) for size in arguments.sizes.split(',')]
+
+    for size in [int(size) for size in arguments.scaling_sizes.split(',')]:
+        bench_add_or_update_client(benchmark_results, size)
+    for size in sizes:
+        bench_get_assignments_sorted(benchmark_results, size)
+    for size in sizes:
+        bench_apply_batch(benchmark_results, size)
+    for size in sizes:
+        bench_render_table(benchmark_results, size)
+
+    bench_update_iterations(benchmark_results)
+    bench_read_file(benchmark_results)
+
+    benchmark_results.write(arguments.output)
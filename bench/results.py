@@ -0,0 +1,70 @@
+'''
+Machine readable benchmark results.
+
+Every benchmark script writes a single JSON document, so results from different runs and machines can be collected and
+compared to spot regressions:
+
+    {
+      "suite": "microbench",
+      "timestamp": 1570000000.0,
+      "python": "2.7.18",
+      "platform": "Linux-5.4.0-x86_64",
+      "commit": "1a2b3c4",
+      "results": [
+        {"name": "add_or_update_client", "parameters": {"assignments": 1000}, "value": 5.1, "unit": "us/op"},
+        ...
+      ]
+    }
+'''
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+REPOSITORY_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def get_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPOSITORY_DIRECTORY,
+                                           stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class BenchmarkResults:
+    suite = ''
+    results = []
+
+    def __init__(self, suite):
+        self.suite = suite
+        self.results = []
+
+    def add(self, name, value, unit, **parameters):
+        self.results.append({'name': name, 'parameters': parameters, 'value': value, 'unit': unit})
+
+        # Progress goes to stderr, so stdout is left for the JSON document.
+        parameter_string = ', '.join('{}={}'.format(key, parameters[key]) for key in sorted(parameters))
+        sys.stderr.write('{} ({}): {:.3f} {}\n'.format(name, parameter_string, value, unit))
+
+    def to_json(self):
+        return json.dumps({
+            'suite': self.suite,
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'commit': get_commit(),
+            'results': self.results
+        }, indent=2, sort_keys=True)
+
+    def write(self, output_path=None):
+        # Write to the given file, or to stdout when there isn't one.
+        if output_path is None:
+            print self.to_json()
+            return
+
+        with open(output_path, 'w') as fp:
+            fp.write(self.to_json() + '\n')
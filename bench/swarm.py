@@ -0,0 +1,253 @@
+'''
+Synthetic client swarm for load testing a running Server.py.
+
+Each connection thread plays a share of the simulated clients, sending one report per client per round for as long as
+the run lasts. Reports use the legacy CLIENT|WORKERS|INTERVAL|EXPONENT|ITERATIONS text format by default, or binary
+frames with --protocol binary. With --legacy, each assignment is reported on a connection of its own, as a single
+CLIENT|WORKERS|INTERVAL|EXPONENT|ITERATIONS message, the way old clients do.
+
+What was sent only says how fast the server accepted it, so the server's own counters are read from /metrics (which
+needs "http" enabled on the server) before and after the run as well. The difference gives the updates it actually
+applied, and how many of those sent never were. Other clients reporting to the server at the same time are counted too.
+
+Usage: python bench/swarm.py --port 1168 --metrics-port 1169 --connections 16 --clients 1000 --duration 10
+                             [--output results.json]
+'''
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+import urllib2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Modules import Protocol
+from results import BenchmarkResults
+
+UPDATE_INTERVAL = 1800
+
+# Once the run is over, how long the server's counters may take to catch up with everything that was sent.
+SETTLE_TIMEOUT = 10.0
+SETTLE_INTERVAL = 0.5
+
+
+def percentile(values, fraction):
+    if len(values) == 0:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def read_server_counters(arguments):
+    # Returns the server's received message and update counts, or None if its metrics can't be read.
+    if arguments.metrics_port == 0:
+        return None
+
+    url = 'http://' + arguments.host + ':' + str(arguments.metrics_port) + '/metrics'
+
+    try:
+        metrics = urllib2.urlopen(url, None, 10).read()
+    except (urllib2.URLError, socket.error):
+        return None
+
+    counters = {}
+    for line in metrics.split('\n'):
+        if line.startswith('#') or ' ' not in line:
+            continue
+
+        name, value = line.rsplit(' ', 1)
+        counters[name] = float(value)
+
+    return (counters.get('gimps_messages_received_total', 0.0), counters.get('gimps_updates_received_total', 0.0))
+
+
+def wait_for_server_counters(arguments, counters_before, updates_sent):
+    # Updates can still be waiting in the server's buffers, so wait until it has counted them all or stopped counting.
+    counters_after = read_server_counters(arguments)
+    settle_deadline = time.time() + SETTLE_TIMEOUT
+
+    while counters_after is not None and time.time() < settle_deadline:
+        if counters_after[1] - counters_before[1] >= updates_sent:
+            break
+
+        time.sleep(SETTLE_INTERVAL)
+        counters = read_server_counters(arguments)
+
+        if counters == counters_after:
+            break
+        counters_after = counters
+
+    return counters_after
+
+
+class SwarmConnection(threading.Thread):
+    arguments = None
+    client_names = []
+    deadline = 0.0
+    messages_sent = 0
+    updates_sent = 0
+    errors = 0
+    latencies = []
+
+    def __init__(self, arguments, client_names, deadline):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.arguments = arguments
+        self.client_names = client_names
+        self.deadline = deadline
+        self.messages_sent = 0
+        self.updates_sent = 0
+        self.errors = 0
+        self.latencies = []
+
+    def encode(self, client_index, iterations):
+        # Returns the messages for one report, as (message, number of updates) pairs.
+        client_name = self.client_names[client_index]
+        assignments = [(80000000 + client_index * self.arguments.workers + worker, iterations)
+                       for worker in range(0, self.arguments.workers)]
+
+        if self.arguments.legacy:
+            return [(Protocol.encode_text_message(client_name, self.arguments.workers, UPDATE_INTERVAL,
+                                                  [assignment]), 1) for assignment in assignments]
+
+        if self.arguments.protocol == 'binary':
+            return [(Protocol.encode_frame([(client_name, self.arguments.workers, UPDATE_INTERVAL, assignments)]),
+                     len(assignments))]
+
+        return [(Protocol.encode_text_message(client_name, self.arguments.workers, UPDATE_INTERVAL, assignments) + '\n',
+                 len(assignments))]
+
+    def connect(self):
+        return socket.create_connection((self.arguments.host, self.arguments.port), 10)
+
+    def send(self, sock, message):
+        start = time.time()
+
+        if self.arguments.legacy:
+            sock = self.connect()
+            sock.sendall(message)
+            sock.close()
+        else:
+            sock.sendall(message)
+
+        self.latencies.append(time.time() - start)
+        return sock
+
+    def run(self):
+        sock = None
+        iterations = 1000
+        # Seconds between messages on this connection, to hold the requested overall rate.
+        message_interval = 0.0
+        if self.arguments.rate > 0:
+            message_interval = self.arguments.connections / float(self.arguments.rate)
+
+        next_send = time.time()
+
+        while time.time() < self.deadline:
+            for client_index in range(0, len(self.client_names)):
+                if time.time() >= self.deadline:
+                    break
+
+                if message_interval > 0:
+                    next_send += message_interval
+                    time.sleep(max(0.0, next_send - time.time()))
+
+                for message, number_of_updates in self.encode(client_index, iterations):
+                    try:
+                        if sock is None and not self.arguments.legacy:
+                            sock = self.connect()
+
+                        self.send(sock, message)
+                        self.messages_sent += 1
+                        self.updates_sent += number_of_updates
+                    except socket.error:
+                        self.errors += 1
+
+                        if sock is not None:
+                            sock.close()
+                            sock = None
+
+            iterations += 1000
+
+        if sock is not None:
+            sock.close()
+
+
+def run_swarm(arguments):
+    deadline = time.time() + arguments.duration
+    connections = []
+
+    for i in range(0, arguments.connections):
+        client_names = ['swarm-' + str(client) for client in range(i, arguments.clients, arguments.connections)]
+        connections.append(SwarmConnection(arguments, client_names, deadline))
+
+    counters_before = read_server_counters(arguments)
+
+    start = time.time()
+    for connection in connections:
+        connection.start()
+    for connection in connections:
+        connection.join()
+    elapsed = time.time() - start
+
+    messages_sent = sum(connection.messages_sent for connection in connections)
+    updates_sent = sum(connection.updates_sent for connection in connections)
+
+    counters_after = None
+    if counters_before is not None:
+        counters_after = wait_for_server_counters(arguments, counters_before, updates_sent)
+
+    results = BenchmarkResults('swarm')
+    parameters = {
+        'connections': arguments.connections,
+        'clients': arguments.clients,
+        'workers': arguments.workers,
+        'protocol': arguments.protocol,
+        'legacy': arguments.legacy,
+        'rate': arguments.rate
+    }
+    latencies = [latency * 1000 for connection in connections for latency in connection.latencies]
+
+    results.add('messages_per_second', messages_sent / elapsed, 'messages/s', **parameters)
+    results.add('updates_per_second', updates_sent / elapsed, 'updates/s', **parameters)
+    results.add('send_latency_p50', percentile(latencies, 0.5), 'ms', **parameters)
+    results.add('send_latency_p99', percentile(latencies, 0.99), 'ms', **parameters)
+    results.add('errors', sum(c.errors for c in connections), 'count', **parameters)
+
+    if counters_after is not None:
+        messages_received = int(counters_after[0] - counters_before[0])
+        updates_received = int(counters_after[1] - counters_before[1])
+
+        results.add('applied_updates_per_second', updates_received / elapsed, 'updates/s', **parameters)
+        results.add('messages_lost', max(0, messages_sent - messages_received), 'count', **parameters)
+        results.add('updates_lost', max(0, updates_sent - updates_received), 'count', **parameters)
+    else:
+        sys.stderr.write("Couldn't read the server's metrics, so only what was sent is reported.\n")
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1168)
+    parser.add_argument('--metrics-port', type=int, default=1169,
+                        help='port of the server\'s HTTP listener, for its /metrics, 0 to not read them')
+    parser.add_argument('--connections', type=int, default=8, help='number of concurrent connections')
+    parser.add_argument('--clients', type=int, default=100, help='number of simulated clients')
+    parser.add_argument('--workers', type=int, default=4, help='assignments reported by each client')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run for')
+    parser.add_argument('--rate', type=float, default=0, help='total messages per second, 0 for as fast as possible')
+    parser.add_argument('--protocol', choices=('text', 'binary'), default='text')
+    parser.add_argument('--legacy', action='store_true',
+                        help='report each assignment on a new connection, in the text format, like old clients')
+    parser.add_argument('--output', help='file to write the JSON results to, instead of stdout')
+    arguments = parser.parse_args()
+
+    if arguments.legacy and arguments.protocol == 'binary':
+        parser.error('old clients only send the text format, so --legacy can\'t be used with --protocol binary')
+
+    run_swarm(arguments).write(arguments.output)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import unittest
+from array import array
+from Modules import Columnar
+from Modules import Gimps
+from Modules.Columnar import ColumnarClientManager
+
+
+class ColumnarClientManagerTest(unittest.TestCase):
+    def test_unicode_client_names_are_accepted(self):
+        client_manager = ColumnarClientManager()
+        client_manager.add_or_update_client(u'bin\xe9', 1, 1800, 80000023, 100, 1500000000)
+        client_manager.add_or_update_client('plain', 1, 1800, 80000041, 100, 1500000000)
+
+        self.assertEqual(sorted(assignment.client_name for assignment in client_manager.iter_assignments_sorted()),
+                         [u'bin\xe9', 'plain'])
+
+    def test_state_matches_the_object_store(self):
+        client_managers = [Gimps.ClientManager(), ColumnarClientManager()]
+
+        for client_manager in client_managers:
+            for step in range(0, 5):
+                for i in range(0, 12):
+                    client_manager.add_or_update_client(u'client-' + unicode(i // 3), 3, 1800, 80000000 + i,
+                                                        1000 + step * 500 + i, 1500000000 + step * 1800)
+
+        self.assertEqual(client_managers[0].get_state(), client_managers[1].get_state())
+        self.assertEqual([(assignment.client_name, assignment.exponent, assignment.estimated_completion_date)
+                          for assignment in client_managers[0].iter_assignments_sorted()],
+                         [(assignment.client_name, assignment.exponent, assignment.estimated_completion_date)
+                          for assignment in client_managers[1].iter_assignments_sorted()])
+
+    def add_updates(self, client_manager, steps):
+        # Enough assignments for a batch to be worked out with NumPy, when it is installed.
+        for step in range(0, steps):
+            client_manager.begin_batch()
+            for i in range(0, 2 * Columnar.MINIMUM_VECTORIZED_BATCH):
+                client_manager.add_or_update_client('client-' + str(i // 4), 4, 1800, 80000000 + i,
+                                                    1000 + step * (300 + i * 17), 1500000000.25 + step * (1700 + i))
+            client_manager.finish_batch()
+
+    def test_batch_estimates_are_the_same_without_numpy(self):
+        client_managers = [ColumnarClientManager(), ColumnarClientManager()]
+        self.add_updates(client_managers[0], 4)
+
+        numpy = Columnar.numpy
+        Columnar.numpy = None
+        try:
+            self.add_updates(client_managers[1], 4)
+        finally:
+            Columnar.numpy = numpy
+
+        self.assertEqual(client_managers[0].get_state(), client_managers[1].get_state())
+        self.assertEqual(client_managers[0].columns.progress, client_managers[1].columns.progress)
+
+    @unittest.skipIf(Columnar.numpy is None, "NumPy isn't installed")
+    def test_vectorized_estimates_match_the_scalar_ones(self):
+        client_manager = ColumnarClientManager()
+        self.add_updates(client_manager, 4)
+
+        columns = client_manager.columns
+        slots = set(range(0, len(columns.exponents)))
+        for slot in slots:
+            columns.update_estimate(slot)
+        estimated_completion_dates = array('d', columns.estimated_completion_dates)
+
+        columns.estimated_completion_dates[:] = array('d', [0.0]) * len(slots)
+        columns.update_estimates_vectorized(slots)
+
+        self.assertEqual(columns.estimated_completion_dates, estimated_completion_dates)
+        self.assertNotEqual(estimated_completion_dates.count(0.0), len(slots))
+
+
+if __name__ == '__main__':
+    unittest.main()
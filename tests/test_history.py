@@ -0,0 +1,75 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from Modules.History import HistoryStore
+
+
+class QuickHistoryStore(HistoryStore):
+    # Gives up waiting for a locked database straight away, rather than after SQLite's default five seconds.
+    def connect(self):
+        connection = HistoryStore.connect(self)
+        connection.execute('PRAGMA busy_timeout=0')
+        return connection
+
+
+class HistoryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database_path = os.path.join(self.directory, 'history.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def wait_for(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_samples_older_than_the_retention_are_pruned(self):
+        history = HistoryStore(self.database_path, 0.01, retention=100, prune_interval=0.05)
+        history.record('client', 1, 60, 1000003, 10, time.time() - 1000)
+        history.start()
+        self.wait_for(lambda: history.written_samples == 1)
+        history.record('client', 1, 60, 1000003, 20)
+
+        self.wait_for(lambda: history.pruned_samples == 1)
+        history.close()
+
+        self.assertEqual([iterations for _, iterations in history.get_assignment_history('client', 1000003)], [20])
+
+    def test_write_errors_are_counted_and_the_writer_carries_on(self):
+        history = QuickHistoryStore(self.database_path, 0.01, retention=0)
+        history.start()
+
+        # Lock the database, so the writer's batch fails once SQLite gives up waiting for the lock.
+        connection = sqlite3.connect(self.database_path, timeout=0)
+        connection.execute('BEGIN EXCLUSIVE')
+        history.record('client', 1, 60, 1000003, 10)
+        self.wait_for(lambda: history.failed_samples == 1)
+        connection.rollback()
+        connection.close()
+
+        history.record('client', 1, 60, 1000003, 20)
+        history.close()
+
+        self.assertEqual(history.failed_samples, 1)
+        self.assertTrue(isinstance(history.last_error, sqlite3.Error))
+        self.assertEqual(history.written_samples, 1)
+
+    def test_close_gives_up_when_the_writer_has_stopped(self):
+        history = HistoryStore(self.database_path, maximum_pending=1)
+        history.writer_thread = threading.Thread(target=lambda: None)
+        history.writer_thread.start()
+        history.record('client', 1, 60, 1000003, 10)
+
+        close_start = time.time()
+        history.close(timeout=0.1)
+        self.assertTrue(time.time() - close_start < 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
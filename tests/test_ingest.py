@@ -0,0 +1,112 @@
+import Queue
+import unittest
+from Modules import Protocol
+from Modules.Ingest import SEQUENCE_PRUNE_INTERVAL, DatagramServer
+
+
+class RecordingLoop:
+    # Stands in for the event loop, keeping the timers it was asked for instead of running them.
+    timers = []
+
+    def __init__(self):
+        self.timers = []
+
+    def call_later(self, delay, callback):
+        self.timers.append((delay, callback))
+
+
+class DatagramServerTest(unittest.TestCase):
+    def setUp(self):
+        self.message_queue = Queue.Queue()
+        self.server = DatagramServer(None, self.message_queue, '127.0.0.1', 0)
+
+    def get_updates(self):
+        updates = []
+        while not self.message_queue.empty():
+            updates.append(self.message_queue.get_nowait())
+        return updates
+
+    def test_split_report_delivered_out_of_order_is_accepted(self):
+        assignments = [(80000000 + i, 1000 + i) for i in range(0, 300)]
+        datagrams = Protocol.encode_datagrams([('client', 300, 1800, assignments)], 1500000000, 1)
+        self.assertTrue(len(datagrams) > 1)
+
+        for datagram in reversed(datagrams):
+            self.server.handle_datagram(datagram)
+
+        self.assertEqual(sorted((update[3], update[4]) for update in self.get_updates()), assignments)
+        self.assertEqual(self.server.stale_updates, 0)
+
+    def test_later_report_for_other_assignments_does_not_discard_an_earlier_one(self):
+        first = Protocol.encode_datagrams([('client', 2, 1800, [(80000023, -1)])], 1500000000, 1)
+        second = Protocol.encode_datagrams([('client', 2, 1800, [(80000041, 500)])], 1500000000, 2)
+
+        self.server.handle_datagram(second[0])
+        self.server.handle_datagram(first[0])
+
+        self.assertEqual(sorted((update[3], update[4]) for update in self.get_updates()),
+                         [(80000023, -1), (80000041, 500)])
+
+    def test_older_update_for_the_same_assignment_is_discarded(self):
+        first = Protocol.encode_datagrams([('client', 1, 1800, [(80000023, 100)])], 1500000000, 1)
+        second = Protocol.encode_datagrams([('client', 1, 1800, [(80000023, 200)])], 1500000000, 2)
+
+        self.server.handle_datagram(second[0])
+        self.server.handle_datagram(first[0])
+        self.server.handle_datagram(second[0])
+
+        self.assertEqual([update[4] for update in self.get_updates()], [200])
+        self.assertEqual(self.server.stale_updates, 2)
+
+    def test_restarted_client_is_accepted(self):
+        old = Protocol.encode_datagrams([('client', 1, 1800, [(80000023, 100)])], 1500000000, 50)
+        restarted = Protocol.encode_datagrams([('client', 1, 1800, [(80000023, 150)])], 1500000100, 1)
+
+        self.server.handle_datagram(old[0])
+        self.server.handle_datagram(restarted[0])
+
+        self.assertEqual([update[4] for update in self.get_updates()], [100, 150])
+
+    def test_restarted_client_with_an_earlier_epoch_is_accepted(self):
+        old = Protocol.encode_datagrams([('client', 1, 1800, [(80000023, 100)])], 1500000100, 50)
+        restarted = Protocol.encode_datagrams([('client', 1, 1800, [(80000023, 150)])], 1500000000, 1)
+
+        self.server.handle_datagram(old[0])
+        self.server.handle_datagram(restarted[0])
+
+        self.assertEqual([update[4] for update in self.get_updates()], [100, 150])
+        self.assertEqual(self.server.sequences[('client', 80000023)], (1500000000, 1))
+
+    def test_sequences_of_removed_assignments_are_pruned(self):
+        tracked = set([('client', 80000023)])
+        loop = RecordingLoop()
+        server = DatagramServer(loop, self.message_queue, '127.0.0.1', 0,
+                                is_tracked=lambda client_name, exponent: (client_name, exponent) in tracked)
+        datagrams = Protocol.encode_datagrams([('client', 2, 1800, [(80000023, 100), (80000041, 200)])], 1500000000, 5)
+
+        server.handle_datagram(datagrams[0])
+        server.prune_sequences()
+
+        self.assertEqual(server.sequences.keys(), [('client', 80000023)])
+        self.assertEqual(loop.timers, [(SEQUENCE_PRUNE_INTERVAL, server.prune_sequences)])
+
+        # The removed assignment's updates start over, as if it had never been seen.
+        server.handle_datagram(Protocol.encode_datagrams([('client', 2, 1800, [(80000041, 50)])], 1500000000, 1)[0])
+        self.assertEqual([update[4] for update in self.get_updates()], [100, 200, 50])
+
+    def test_progress_and_removal_in_one_datagram_are_both_accepted(self):
+        datagrams = Protocol.encode_datagrams([('client', 1, 1800, [(80000023, 100), (80000023, -1)])], 1500000000, 1)
+
+        self.server.handle_datagram(datagrams[0])
+
+        self.assertEqual([update[4] for update in self.get_updates()], [100, -1])
+
+    def test_malformed_datagram_is_rejected(self):
+        self.server.handle_datagram('junk')
+
+        self.assertEqual(self.server.rejected_datagrams, 1)
+        self.assertEqual(self.get_updates(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import unittest
+from Modules import Protocol
+
+
+class ProtocolTest(unittest.TestCase):
+    def test_non_ascii_client_name_is_decoded(self):
+        frame = Protocol.encode_frame([(u'bin\xe9', 2, 1800, [(80000023, 100)], u'site-\xe5')], True)
+        decoder = Protocol.FrameDecoder()
+
+        updates = decoder.feed(frame)
+
+        self.assertEqual(updates, [(u'bin\xe9', 2, 1800, 80000023, 100, u'site-\xe5')])
+        self.assertTrue(isinstance(updates[0][0], unicode))
+
+    def test_text_message_name_is_decoded(self):
+        self.assertEqual(Protocol.parse_text_message(u'bin\xe9|1|1800|80000023|100'.encode('utf-8')),
+                         [(u'bin\xe9', 1, 1800, 80000023, 100, '')])
+
+    def test_frame_with_invalid_utf8_name_is_rejected_and_the_stream_carries_on(self):
+        bad_frame = Protocol.encode_frame([('bin\xff', 1, 1800, [(80000023, 100)])])
+        good_frame = Protocol.encode_frame([('good', 1, 1800, [(80000041, 200)])])
+        decoder = Protocol.FrameDecoder()
+
+        updates = decoder.feed(bad_frame + good_frame)
+
+        self.assertEqual(updates, [(u'good', 1, 1800, 80000041, 200, '')])
+        self.assertEqual(decoder.rejected_messages, 1)
+        self.assertEqual(decoder.decoded_messages, 1)
+
+    def test_datagram_with_invalid_utf8_name_is_rejected(self):
+        datagram = Protocol.encode_datagrams([('bin\xff', 1, 1800, [(80000023, 100)])], 1500000000, 1)[0]
+
+        self.assertRaises(Protocol.ProtocolError, Protocol.decode_datagram, datagram)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import ftplib
+import socket
+import unittest
+from Modules.Publisher import FtpPublisher
+
+
+class FakeFtp:
+    '''
+    Stands in for ftplib.FTP, keeping the uploaded files in a dictionary. Every FakeFtp shares the same server, so
+    files survive reconnecting.
+    '''
+    files = {}
+    sessions = []
+    failures = []
+    rename_over_existing = True
+
+    def __init__(self, host, user, password, timeout=None):
+        self.timeout = timeout
+        self.commands = []
+        self.closed = False
+        FakeFtp.sessions.append(self)
+
+    def check_failure(self):
+        if len(FakeFtp.failures) > 0:
+            raise FakeFtp.failures.pop(0)
+
+    def storbinary(self, command, fp):
+        self.check_failure()
+        self.commands.append(command)
+        FakeFtp.files[command.split(' ', 1)[1]] = fp.read()
+
+    def rename(self, from_path, to_path):
+        self.commands.append('RNFR ' + from_path + ' RNTO ' + to_path)
+        if to_path in FakeFtp.files and not FakeFtp.rename_over_existing:
+            raise ftplib.error_perm('550 File exists')
+        FakeFtp.files[to_path] = FakeFtp.files.pop(from_path)
+
+    def delete(self, path):
+        self.commands.append('DELE ' + path)
+        del FakeFtp.files[path]
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class FtpPublisherTest(unittest.TestCase):
+    def setUp(self):
+        FakeFtp.files = {}
+        FakeFtp.sessions = []
+        FakeFtp.failures = []
+        FakeFtp.rename_over_existing = True
+        self.publisher = FtpPublisher('ftp.example.com', 'user', 'password', '/www', 'output.txt', 5,
+                                      ftp_factory=FakeFtp)
+
+    def test_upload_is_stored_under_a_temporary_name_and_renamed(self):
+        self.publisher.upload('table')
+
+        self.assertEqual(FakeFtp.files, {'/www/output.txt': 'table'})
+        self.assertEqual(FakeFtp.sessions[0].commands, ['STOR /www/output.txt.tmp',
+                                                        'RNFR /www/output.txt.tmp RNTO /www/output.txt'])
+        self.assertEqual(FakeFtp.sessions[0].timeout, 5)
+        self.assertEqual(self.publisher.uploads, 1)
+
+    def test_unchanged_content_is_skipped(self):
+        self.publisher.upload('table')
+        self.publisher.upload('table')
+        self.publisher.upload('new table')
+
+        self.assertEqual(self.publisher.uploads, 2)
+        self.assertEqual(self.publisher.skipped_uploads, 1)
+        self.assertEqual(FakeFtp.files, {'/www/output.txt': 'new table'})
+
+    def test_session_is_kept_open_between_uploads(self):
+        self.publisher.upload('table')
+        self.publisher.upload('new table')
+
+        self.assertEqual(len(FakeFtp.sessions), 1)
+
+    def test_existing_file_is_deleted_when_the_server_wont_rename_over_it(self):
+        FakeFtp.rename_over_existing = False
+        self.publisher.upload('table')
+        self.publisher.upload('new table')
+
+        self.assertEqual(FakeFtp.files, {'/www/output.txt': 'new table'})
+        self.assertTrue('DELE /www/output.txt' in FakeFtp.sessions[0].commands)
+
+    def test_reconnects_once_after_an_error(self):
+        FakeFtp.failures = [EOFError()]
+        self.publisher.upload('table')
+
+        self.assertEqual(len(FakeFtp.sessions), 2)
+        self.assertTrue(FakeFtp.sessions[0].closed)
+        self.assertEqual(FakeFtp.files, {'/www/output.txt': 'table'})
+        self.assertEqual(self.publisher.failed_uploads, 0)
+
+    def test_timeouts_are_counted_as_failed_uploads(self):
+        FakeFtp.failures = [socket.timeout('timed out'), socket.timeout('timed out')]
+        self.publisher.upload('table')
+
+        self.assertEqual(self.publisher.failed_uploads, 1)
+        self.assertTrue(isinstance(self.publisher.last_error, socket.timeout))
+        self.assertEqual(FakeFtp.files, {})
+
+        # The same table is tried again when it is next published.
+        self.publisher.upload('table')
+        self.assertEqual(FakeFtp.files, {'/www/output.txt': 'table'})
+
+
+if __name__ == '__main__':
+    unittest.main()
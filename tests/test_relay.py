@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import unittest
+from Modules import Protocol
+from Modules.Relay import encode_batch, extend_via
+
+
+def decode_frames(data):
+    # Returns the payload length and updates of each frame in the data.
+    frames = []
+    offset = 0
+
+    while offset < len(data):
+        magic, version, flags, length = Protocol.FRAME_HEADER.unpack_from(data, offset)
+        offset += Protocol.FRAME_HEADER.size
+        frames.append((length, Protocol.decode_frame_payload(data, offset, offset + length, flags)))
+        offset += length
+
+    return frames
+
+
+class EncodeBatchTest(unittest.TestCase):
+    def test_via_is_extended_towards_the_central_server(self):
+        self.assertEqual(extend_via('', 'site-a'), 'site-a')
+        self.assertEqual(extend_via('site-a', 'region-1'), 'site-a > region-1')
+
+    def test_frames_with_non_ascii_names_stay_under_the_maximum_size(self):
+        # Each name is 3 bytes per character once encoded, so counting characters would undersize every block.
+        pending = {}
+        for i in range(0, 400):
+            client_name = u'客户端' * 200 + unicode(i)
+            for exponent in range(0, 8):
+                pending[(client_name, 1000003 + exponent)] = (8, 1800, 100, u'站点' * 300)
+
+        frames = decode_frames(encode_batch(pending))
+
+        self.assertTrue(len(frames) > 1)
+        for length, updates in frames:
+            self.assertTrue(length <= Protocol.MAXIMUM_FRAME_SIZE)
+        self.assertEqual(sum(len(updates) for _, updates in frames), len(pending))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from Modules.Scanner import DirectoryScanner
+
+
+class DirectoryScannerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.scanner = DirectoryScanner(self.directory)
+        self.file_path = os.path.join(self.directory, 'p80000023')
+
+        with open(self.file_path, 'w') as fp:
+            fp.write('not a save file')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_rejected_file_is_only_reported_again_once_it_changes(self):
+        new_files, _, _ = self.scanner.scan()
+        self.assertEqual([file_path for file_path, _ in new_files], [self.file_path])
+
+        self.scanner.reject(*new_files[0])
+        self.assertEqual(self.scanner.scan(), ([], [], []))
+
+        os.utime(self.file_path, (time.time() + 60, time.time() + 60))
+        new_files, _, _ = self.scanner.scan()
+        self.assertEqual([file_path for file_path, _ in new_files], [self.file_path])
+
+    def test_rejected_file_that_is_removed_is_forgotten(self):
+        new_files, _, _ = self.scanner.scan()
+        self.scanner.reject(*new_files[0])
+        os.remove(self.file_path)
+
+        self.assertEqual(self.scanner.scan(), ([], [], []))
+        self.assertEqual(self.scanner.rejected_files, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from Modules.Scheduler import AssignmentScheduler
+
+
+class FakeClock:
+    now = 0.0
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class AssignmentSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = AssignmentScheduler(self.clock, minimum_backoff=30)
+
+    def test_pop_due_returns_jobs_in_due_order(self):
+        self.scheduler.schedule_in('c', 30)
+        self.scheduler.schedule_in('a', 10)
+        self.scheduler.schedule_in('b', 20)
+        self.scheduler.schedule_in('later', 100)
+
+        self.assertEqual(self.scheduler.pop_due(), [])
+
+        self.clock.now += 30
+        self.assertEqual(self.scheduler.pop_due(), ['a', 'b', 'c'])
+        self.assertEqual(len(self.scheduler), 1)
+        self.assertEqual(self.scheduler.time_until_next(), 70)
+
+    def test_rescheduling_replaces_the_old_due_time(self):
+        self.scheduler.schedule_in('a', 10)
+        self.scheduler.schedule_in('a', 50)
+
+        self.clock.now += 10
+        self.assertEqual(self.scheduler.pop_due(), [])
+
+        self.clock.now += 40
+        self.assertEqual(self.scheduler.pop_due(), ['a'])
+        self.assertEqual(self.scheduler.time_until_next(), None)
+
+    def test_defer_doubles_the_delay_up_to_the_maximum(self):
+        delays = []
+
+        for _ in range(0, 6):
+            self.scheduler.defer('a', 300)
+            delays.append(self.scheduler.get_due_time('a') - self.clock.now)
+
+        self.assertEqual(delays, [30, 60, 120, 240, 300, 300])
+
+    def test_reset_backoff_starts_again_from_the_minimum(self):
+        self.scheduler.defer('a', 300)
+        self.scheduler.defer('a', 300)
+        self.scheduler.reset_backoff('a')
+        self.scheduler.defer('a', 300)
+
+        self.assertEqual(self.scheduler.get_due_time('a') - self.clock.now, 30)
+
+    def test_schedule_no_later_than_only_brings_jobs_forward(self):
+        self.scheduler.schedule_in('a', 100)
+        self.scheduler.schedule_no_later_than('a', 10)
+        self.assertEqual(self.scheduler.get_due_time('a'), self.clock.now + 10)
+
+        self.scheduler.schedule_no_later_than('a', 50)
+        self.assertEqual(self.scheduler.get_due_time('a'), self.clock.now + 10)
+
+        self.scheduler.schedule_no_later_than('b', 50)
+        self.assertEqual(self.scheduler.get_due_time('b'), self.clock.now + 50)
+
+    def test_cancelled_jobs_are_never_returned(self):
+        self.scheduler.schedule_in('a', 10)
+        self.scheduler.schedule_in('b', 10)
+        self.scheduler.cancel('a')
+
+        self.clock.now += 10
+        self.assertEqual(self.scheduler.pop_due(), ['b'])
+        self.assertFalse('a' in self.scheduler)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from Modules import Gimps
+from Modules.Columnar import ColumnarClientManager
+from Modules.Snapshot import decode_snapshot, encode_snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+    def restore(self, client_manager_class):
+        client_manager = client_manager_class()
+        client_manager.add_or_update_client('relayed', 2, 1800, 80000023, 1000, 1500000000, via=u'site-a > region-1')
+        client_manager.add_or_update_client('relayed', 2, 1800, 80000041, 2000, 1500000000)
+        client_manager.add_or_update_client('local', 1, 1800, 80000069, 3000, 1500000000)
+        client_manager.get_client('relayed').mark_assignment_stale(80000041)
+
+        state, _ = decode_snapshot(encode_snapshot(client_manager.get_state(), 1500000000))
+        restored_client_manager = client_manager_class()
+        restored_client_manager.restore_state(state)
+
+        self.assertEqual(restored_client_manager.get_state(), client_manager.get_state())
+        return restored_client_manager
+
+    def check_restored(self, client_manager):
+        self.assertEqual(client_manager.get_client('relayed').via, u'site-a > region-1')
+        self.assertEqual(client_manager.get_client('local').via, '')
+        self.assertEqual(sorted((assignment.exponent, assignment.stale)
+                                for assignment in client_manager.iter_assignments_sorted()),
+                         [(80000023, False), (80000041, True), (80000069, False)])
+
+    def test_object_store_keeps_via_and_stale(self):
+        self.check_restored(self.restore(Gimps.ClientManager))
+
+    def test_columnar_store_keeps_via_and_stale(self):
+        self.check_restored(self.restore(ColumnarClientManager))
+
+    def test_stores_read_each_others_snapshots(self):
+        client_manager = ColumnarClientManager()
+        client_manager.restore_state(self.restore(Gimps.ClientManager).get_state())
+
+        self.check_restored(client_manager)
+
+
+if __name__ == '__main__':
+    unittest.main()